@@ -0,0 +1,166 @@
+"""
+Benchmarks of quant circuits: run time of QFT (fourier.get_fourier_circuit), of random layered circuits
+(random 1-qbit gates and CNOTs between neighbours) on random states and of random real circuits (H, X, Z, CNOT,
+SWAP, Toffoli) on random real states.
+
+    python benchmark.py             # default sizes
+    python benchmark.py 12 16 22    # numbers of qbits
+    python benchmark.py threads     # thread sweep, default sizes 22 24 26
+    python benchmark.py threads 24  # thread sweep for given numbers of qbits
+
+dense: every gate applied by tensor contraction; kernels: phases multiply for diagonal gates,
+index swap for permutation gates (see Gate.kind); fused: kernels after Circuit.optimize(FUSION_QBITS);
+compiled: kernels after Circuit.compile (QFT is one FFT gate).
+auto: kernels in the precision chosen by circuit @ state (real amplitudes for real circuits and states, see
+Circuit.get_dtype); single: the same in single precision, error: its max amplitude error against complex128.
+threads: kernels of the random circuit with quant.THREADS in THREAD_COUNTS, speedup against one thread
+(more threads than cores show the cost of oversubscription).
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import fourier
+import quant
+
+
+FUSION_QBITS = 3
+THREAD_COUNTS = [1, 2, 4, 8]
+
+
+def as_dense(circuit):
+    return quant.Circuit([quant.Gate(g.U, g.qbits, g.controls, kind='dense') for g in circuit.gates])
+
+
+def random_state(N, seed=0, real=False):
+    rng = np.random.default_rng(seed)
+    amp = rng.normal(size=1 << N)
+    if not real:
+        amp = amp + 1j * rng.normal(size=1 << N)
+    return quant.State(N, amp / np.linalg.norm(amp), copy=False)
+
+
+"""Best time of circuit.run on copies of the state (converted to dtype), and the result."""
+def time_run(circuit, state, repeat=3, dtype=np.complex128):
+    best = float('inf')
+    for _ in range(repeat):
+        s = state.astype(dtype)
+        start = time.perf_counter()
+        result = circuit.run(s)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def get_random_circuit(N, depth=10, seed=0):
+    rng = np.random.default_rng(seed)
+    gates = []
+    for layer in range(depth):
+        for k in range(N):
+            U, _ = np.linalg.qr(rng.normal(size=(2, 2)) + 1j * rng.normal(size=(2, 2)))
+            gates.append(quant.Gate(U, [k]))
+        for k in range(layer % 2, N - 1, 2):
+            gates.append(quant.gate_cnot(k, k + 1))
+    return quant.Circuit(gates)
+
+
+def get_real_circuit(N, depth=10, seed=0):
+    rng = np.random.default_rng(seed)
+    one_qbit = [quant.gate_H, quant.gate_X, quant.gate_Z]
+    gates = []
+    for layer in range(depth):
+        for k in range(N):
+            gates.append(one_qbit[rng.integers(len(one_qbit))](k))
+        for k in range(layer % 2, N - 2, 3):
+            two_qbit = quant.gate_cnot(k, k + 1) if rng.integers(2) else quant.gate_swap(k, k + 2)
+            gates += [two_qbit, quant.gate_toffoli(k, k + 1, k + 2)]
+    return quant.Circuit(gates)
+
+
+CIRCUITS = {
+    'qft': (fourier.get_fourier_circuit, False),
+    'random': (get_random_circuit, False),
+    'real': (get_real_circuit, True),
+}
+
+
+def bench(make_circuit, sizes, repeat=3, real=False):
+    rows = []
+    for N in sizes:
+        circuit = make_circuit(N)
+        fused = make_circuit(N)
+        fused.optimize(FUSION_QBITS)
+        compiled = make_circuit(N)
+        compiled.compile()
+        state = random_state(N, real=real)
+        kernels, expected = time_run(circuit, state, repeat)
+        auto_dtype = circuit.get_dtype(state)
+        single_dtype = quant.Circuit(circuit.gates, 'single').get_dtype(state)
+        single, result = time_run(circuit, state, repeat, single_dtype)
+        rows.append({
+            'qbits': N,
+            'gates': len(circuit.gates),
+            'fused_gates': len(fused.gates),
+            'dense': time_run(as_dense(circuit), state, repeat)[0],
+            'kernels': kernels,
+            'fused': time_run(fused, state, repeat)[0],
+            'compiled': time_run(compiled, state, repeat)[0],
+            'auto_dtype': np.dtype(auto_dtype).name,
+            'auto': time_run(circuit, state, repeat, auto_dtype)[0],
+            'single': single,
+            'error': np.max(np.abs(result.amp - expected.amp)),
+        })
+    return rows
+
+
+def bench_threads(sizes, repeat=3):
+    rows = []
+    threads = quant.THREADS
+    try:
+        for N in sizes:
+            circuit = get_random_circuit(N)
+            state = random_state(N)
+            base = None
+            for count in THREAD_COUNTS:
+                quant.THREADS = count
+                best = time_run(circuit, state, repeat)[0]
+                base = base or best
+                rows.append({'qbits': N, 'threads': count, 'time': best, 'speedup': base / best})
+    finally:
+        quant.THREADS = threads
+    return rows
+
+
+def format_thread_rows(rows):
+    lines = ['{:>6}{:>9}{:>10}{:>9}'.format('qbits', 'threads', 'time, s', 'speedup')]
+    for row in rows:
+        lines.append('{:>6}{:>9}{:>10.4f}{:>9.2f}'.format(row['qbits'], row['threads'], row['time'], row['speedup']))
+    return '\n'.join(lines)
+
+
+def format_rows(rows):
+    lines = ['{:>6}{:>8}{:>8}{:>12}{:>12}{:>12}{:>13}{:>12}{:>12}{:>12}{:>10}'.format(
+        'qbits', 'gates', 'fused', 'dense, s', 'kernels, s', 'fused, s', 'compiled, s', 'auto', 'auto, s', 'single, s',
+        'error')]
+    for row in rows:
+        lines.append('{:>6}{:>8}{:>8}{:>12.4f}{:>12.4f}{:>12.4f}{:>13.4f}{:>12}{:>12.4f}{:>12.4f}{:>10.1e}'.format(
+            row['qbits'], row['gates'], row['fused_gates'], row['dense'], row['kernels'], row['fused'], row['compiled'],
+            row['auto_dtype'], row['auto'], row['single'], row['error']))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    if argv[:1] == ['threads']:
+        sizes = [int(arg) for arg in argv[1:]] or [22, 24, 26]
+        print('random, threads')
+        print(format_thread_rows(bench_threads(sizes)))
+        return
+    sizes = [int(arg) for arg in argv] or [8, 12, 16, 20]
+    for name, (make_circuit, real) in CIRCUITS.items():
+        print(name)
+        print(format_rows(bench(make_circuit, sizes, real=real)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,3 +1,47 @@
+import collections
+
+import numpy as np
+
+
+"""
+Bit manipulation of basis state indices and amplitude arrays, vectorized with numpy.
+Bits are numbered "msb" first, as qbits: bit j of an N-bit number x is (x >> (N - 1 - j)) & 1.
+"""
+
+
+"""
+Deposit: bit i of every n-bit number of values (array) is put to bit positions[i] of an N-bit number, other bits are 0.
+"""
+def deposit_bits(values, N, positions):
+    values = np.asarray(values)
+    n = len(positions)
+    result = np.zeros_like(values)
+    for i, j in enumerate(positions):
+        result |= ((values >> (n - 1 - i)) & 1) << (N - 1 - j)
+    return result
+
+
+"""Extract (inverse of deposit_bits): bits positions of N-bit numbers x (array) as n-bit numbers."""
+def extract_bits(x, N, positions):
+    x = np.asarray(x)
+    n = len(positions)
+    result = np.zeros_like(x)
+    for i, j in enumerate(positions):
+        result |= ((x >> (N - 1 - j)) & 1) << (n - 1 - i)
+    return result
+
+
+"""
+Table of merged numbers for all bases: T[base, x] = merge_bits_array(m, base, index_list)[x],
+shape 2^m x 2^n.
+"""
+def merge_bits_table(m, index_list, dtype=np.int64):
+    n = len(index_list)
+    free = [j for j in range(n + m) if j not in index_list]
+    bases = deposit_bits(np.arange(1 << m, dtype=dtype), n + m, free)
+    return bases[:, None] | deposit_bits(np.arange(1 << n, dtype=dtype), n + m, index_list)[None, :]
+
+
 """
 Get array of merged numbers.
 
@@ -12,24 +56,75 @@ Note: this corresponds to the usual "msb" qbits numeration.
 """
 def merge_bits_array(m, base, index_list):
     n = len(index_list)
-    index_set = set(index_list)
-
-    base_index = 0
-    merged_base = 0
-    for j in range(n + m):
-        if j in index_set:
-            # here comes bit from x, so nothing to do
-            continue
-        if base & (1 << (m - 1 - base_index)) != 0:
-            merged_base |= (1 << (n + m - 1 - j))
-        base_index += 1
-
-    merged_list = []
-    for x in range((1<<n)):
-        merged = merged_base
-        for i, j in enumerate(index_list):
-            if x & (1 << (n - 1 - i)) != 0:
-                merged |= (1 << (n + m - 1 - j))
-        merged_list.append(merged)
-
-    return merged_list
+    free = [j for j in range(n + m) if j not in index_list]
+    merged_base = int(deposit_bits(base, n + m, free))
+    return (merged_base | deposit_bits(np.arange(1 << n), n + m, index_list)).tolist()
+
+
+"""
+Qbits permutation of amplitudes amp of N qbits, without copy: tensor view with an axis per qbit,
+new qbit j is old qbit order[j]. Ravel (or copy to a buffer) to get amplitudes of the permuted state.
+"""
+def permute_qbits(amp, N, order):
+    return amp.reshape((2,) * N).transpose(order)
+
+
+"""Basis permutation of a qbits permutation: new amp[i] = amp[perm[i]] (see permute_qbits)."""
+def qbits_permutation(n, order):
+    return permute_qbits(np.arange(1 << n), n, order).ravel()
+
+
+"""Order of qbits if the basis permutation perm (new amp[i] = amp[perm[i]]) is a qbits permutation, else None."""
+def get_qbits_order(perm):
+    n = len(perm).bit_length() - 1
+    # new qbit j is old qbit order[j]: its basis state comes from the basis state of old qbit order[j]
+    order = [n - 1 - (int(perm[1 << (n - 1 - j)]).bit_length() - 1) for j in range(n)]
+    if sorted(order) != list(range(n)) or np.any(qbits_permutation(n, order) != perm):
+        return None
+    return order
+
+
+# index plans: get_index_plan results are cached (least recently used are evicted),
+# total size of cached arrays is at most PLAN_CACHE_BYTES
+PLAN_CACHE_BYTES = 64 << 20
+_plans = collections.OrderedDict()
+_plans_bytes = 0
+
+
+"""
+Gather/scatter index plan of a gate on N qbits: array P of shape 2^(N-n-c) x 2^n,
+P[base] = merge_bits_array(N-n, base, index_list) with the control bits set to 1 (only bases with all controls = 1).
+So amp[P] is the matrix of amplitude vectors the gate acts on, e.g. amp[P] = amp[P] @ U.T applies U.
+Plans are cached by (N, index_list, controls), see PLAN_CACHE_BYTES.
+"""
+def get_index_plan(N, index_list, controls=()):
+    global _plans_bytes
+    key = (N, tuple(index_list), tuple(controls))
+    plan = _plans.get(key)
+    if plan is not None:
+        _plans.move_to_end(key)
+        return plan
+
+    dtype = np.int32 if N < 31 else np.int64
+    free = [j for j in range(N) if j not in index_list and j not in controls]
+    base = deposit_bits(np.arange(1 << len(free), dtype=dtype), N, free)
+    base |= sum(1 << (N - 1 - j) for j in controls)
+    plan = base[:, None] | deposit_bits(np.arange(1 << len(index_list), dtype=dtype), N, index_list)[None, :]
+
+    _plans[key] = plan
+    _plans_bytes += plan.nbytes
+    while _plans_bytes > PLAN_CACHE_BYTES and len(_plans) > 1:
+        _, evicted = _plans.popitem(last=False)
+        _plans_bytes -= evicted.nbytes
+    return plan
+
+
+"""Number of cached plans and their total size in bytes."""
+def plan_cache_info():
+    return len(_plans), _plans_bytes
+
+
+def clear_plan_cache():
+    global _plans_bytes
+    _plans.clear()
+    _plans_bytes = 0
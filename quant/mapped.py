@@ -0,0 +1,246 @@
+"""
+Out-of-core states: amplitudes in a file mapped to memory (np.memmap), circuits are run by blocked passes.
+
+The last L qbits (least significant, LOCAL_QBITS by default) are local: a block of 2^L consecutive amplitudes
+has them all, the other (global) qbits are fixed in the block. A pass reads every block once, applies a group
+of consecutive gates to it in memory and writes it back, so the file is read and written sequentially.
+Gates act on local qbits, except controls and diagonal gates: they only select blocks or multiply them.
+When a gate needs a global qbit, it is swapped with a local qbit (one pass over pairs of blocks);
+the scheduler keeps the swapped layout while it is possible and evicts the local qbit that is not needed
+for the longest time. The original order of qbits is restored at the end.
+So a gate (not diagonal) may act on at most L qbits; a wider QFT (quant.FourierGate) is run as its gates.
+
+    state = create_state('state.bin', 32)
+    runner = BlockedRunner(local_qbits=26)
+    runner.run(circuit, state)
+    print(runner.report())
+"""
+
+import time
+
+import numpy as np
+
+import quant
+
+LOCAL_QBITS = 24
+
+
+"""State |0..0> of N qbits in a new file (dtype of amplitudes, see quant.DTYPES: single precision halves the file)."""
+def create_state(path, N, dtype=np.complex128):
+    amp = np.memmap(path, dtype=dtype, mode='w+', shape=(1 << N,))
+    amp[0] = 1
+    return quant.State(N, amp, copy=False, dtype=dtype)
+
+
+"""State of N qbits in an existing file (mode 'r+': changes are written to the file)."""
+def open_state(path, N, mode='r+', dtype=np.complex128):
+    return quant.State(N, np.memmap(path, dtype=dtype, mode=mode, shape=(1 << N,)), copy=False, dtype=dtype)
+
+
+"""Writes changed amplitudes of the state to its file."""
+def flush(state):
+    amp = state.amp
+    while amp is not None and not isinstance(amp, np.memmap):
+        amp = amp.base
+    if amp is not None:
+        amp.flush()
+
+
+"""Whether the gate can act on the global qbit k (logical): k selects blocks (control) or multiplies them (diagonal)."""
+def _global_allowed(g, k):
+    return k in g.controls or g.kind == 'diagonal'
+
+
+class BlockedRunner:
+    def __init__(self, local_qbits=LOCAL_QBITS):
+        self.local_qbits = local_qbits
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.passes = 0  # passes applying gates
+        self.swaps = 0  # passes swapping a global qbit with a local one
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.io_seconds = 0.0
+        self.compute_seconds = 0.0
+
+    """I/O throughput, bytes per second (read and written)."""
+    def throughput(self):
+        return (self.bytes_read + self.bytes_written) / self.io_seconds if self.io_seconds else 0.0
+
+    def report(self):
+        return 'passes {}, swaps {}, read {:.1f} MB, written {:.1f} MB, I/O {:.2f} s ({:.1f} MB/s), compute {:.2f} s'.format(
+            self.passes, self.swaps, self.bytes_read / 1e6, self.bytes_written / 1e6,
+            self.io_seconds, self.throughput() / 1e6, self.compute_seconds)
+
+    """Applies the circuit to the state in place, returns the state."""
+    def run(self, circuit, state):
+        N = state.N
+        L = min(self.local_qbits, N)
+        self.N, self.L, self.G = N, L, N - L
+        # layout[k] - position of logical qbit k in the amplitudes index (qbit numeration), positions >= G are local
+        self.layout = list(range(N))
+
+        if not all(isinstance(g, quant.Gate) for g in circuit.gates):
+            raise ValueError("Mid-circuit operations are not supported out of core")
+        gates = []
+        for g in circuit.gates:
+            if g.kind == 'fourier' and g.n > L:
+                gates.extend(g.decompose())
+            elif g.kind != 'diagonal' and g.n > L:
+                raise ValueError("Gate on {} qbits does not fit {} local qbits".format(g.n, L))
+            else:
+                gates.append(g)
+        group = []
+        for index, g in enumerate(gates):
+            needed = [k for k in g.qbits if not self._is_local(k) and not _global_allowed(g, k)]
+            if needed:
+                self._pass(state, group)
+                group = []
+                for k in needed:
+                    self._make_local(state, k, g, gates[index + 1:])
+            group.append(g)
+        self._pass(state, group)
+        self._restore(state)
+        return state
+
+    def _is_local(self, k):
+        return self.layout[k] >= self.G
+
+    """
+    Swaps logical qbit k (global) with the local qbit which is not a qbit of the gate and is needed the latest
+    (a local control may be evicted: controls act from global positions too).
+    """
+    def _make_local(self, state, k, gate, rest):
+        def next_use(j):
+            for distance, g in enumerate(rest):
+                if j in g.qbits and not _global_allowed(g, j):
+                    return distance
+            return len(rest)
+
+        candidates = [j for j in range(self.N) if self._is_local(j) and j not in gate.qbits]
+        j = max(candidates, key=next_use)
+        self._swap_pass(state, self.layout[k], self.layout[j])
+        self.layout[k], self.layout[j] = self.layout[j], self.layout[k]
+
+    """Moves every logical qbit back to its position: global positions by swap passes, then local ones in one pass."""
+    def _restore(self, state):
+        for p in range(self.G):
+            a = self.layout[p]
+            if a == p:
+                continue
+            j = self.layout.index(p)  # logical qbit at the position p
+            if a >= self.G:
+                self._swap_pass(state, p, a)
+            else:
+                # both global: exchange through the first local position
+                for x, y in [(a, self.G), (p, self.G), (a, self.G)]:
+                    self._swap_pass(state, x, y)
+            self.layout[p], self.layout[j] = p, a
+
+        # local positions: swaps of positions, applied as gates with the identity layout
+        swaps = []
+        for q in range(self.G, self.N):
+            a = self.layout[q]
+            if a != q:
+                j = self.layout.index(q)
+                swaps.append(quant.gate_swap(a, q))
+                self.layout[q], self.layout[j] = q, a
+        self._pass(state, swaps)
+
+    def _read(self, amp, start, stop):
+        t = time.perf_counter()
+        block = np.array(amp[start:stop])
+        self.io_seconds += time.perf_counter() - t
+        self.bytes_read += block.nbytes
+        return block
+
+    def _write(self, amp, start, block):
+        t = time.perf_counter()
+        amp[start:start + len(block)] = block
+        self.io_seconds += time.perf_counter() - t
+        self.bytes_written += block.nbytes
+
+    """Gate acting on the block with global bits (bits of the block index, msb first), or None if it does not act."""
+    def _block_gate(self, g, bits):
+        G = self.G
+        local_controls = []
+        for k in g.controls:
+            p = self.layout[k]
+            if p < G:
+                if not bits[p]:
+                    return None
+            else:
+                local_controls.append(p - G)
+        if all(self._is_local(k) for k in g.qbits):
+            return g.relabel([self.layout[k] - G for k in g.qbits], local_controls)
+
+        # diagonal gate: global qbits are fixed in the block, phases of the local qbits remain
+        phases = g.phases.reshape((2,) * g.n)
+        local_qbits = []
+        key = []
+        for k in g.qbits:
+            p = self.layout[k]
+            if p < G:
+                key.append(bits[p])
+            else:
+                key.append(slice(None))
+                local_qbits.append(p - G)
+        phases = phases[tuple(key)].ravel()
+        if not local_qbits:
+            # one phase for the controlled subspace: diagonal gate on the local controls (or the whole block)
+            phases = np.concatenate([np.ones((1 << len(local_controls)) - 1), phases])
+            local_qbits, local_controls = local_controls, []
+        return quant.Gate(np.diag(phases), local_qbits, local_controls, 'diagonal')
+
+    """One pass: the group of gates is applied to every block."""
+    def _pass(self, state, group):
+        if not group:
+            return
+        self.passes += 1
+        size = 1 << self.L
+        amp = state.amp
+        # gates on local qbits only are the same for all blocks
+        local = [all(self._is_local(k) for k in g.qbits + g.controls) for g in group]
+        static = [self._block_gate(g, []) if is_local else None for g, is_local in zip(group, local)]
+        for b in range(1 << self.G):
+            bits = [(b >> (self.G - 1 - p)) & 1 for p in range(self.G)]
+            block_gates = [sg if is_local else self._block_gate(g, bits) for g, sg, is_local in zip(group, static, local)]
+            block_gates = [bg for bg in block_gates if bg is not None]
+            if not block_gates:
+                continue
+            block = self._read(amp, b * size, (b + 1) * size)
+            t = time.perf_counter()
+            block_state = quant.State(self.L, block, copy=False, dtype=block.dtype)
+            for bg in block_gates:
+                if bg.n == 0:
+                    block *= bg.cast('phases', block.dtype)[0]
+                else:
+                    bg.apply(block_state, out=block)
+            self.compute_seconds += time.perf_counter() - t
+            self._write(amp, b * size, block)
+
+    """Swap of positions a (global) and b (local) of the amplitudes index: pairs of blocks exchange halves."""
+    def _swap_pass(self, state, a, b):
+        self.swaps += 1
+        size = 1 << self.L
+        amp = state.amp
+        bit = 1 << (self.G - 1 - a)
+        for low in range(1 << self.G):
+            if low & bit:
+                continue
+            high = low | bit
+            block0 = self._read(amp, low * size, (low + 1) * size)
+            block1 = self._read(amp, high * size, (high + 1) * size)
+            t = time.perf_counter()
+            # amplitudes with (a, b) = (0, 1) and (1, 0) are exchanged
+            key0 = (slice(None),) * (b - self.G) + (1,)
+            key1 = (slice(None),) * (b - self.G) + (0,)
+            tensor0 = block0.reshape((2,) * self.L)
+            tensor1 = block1.reshape((2,) * self.L)
+            tmp = tensor0[key0].copy()
+            tensor0[key0] = tensor1[key1]
+            tensor1[key1] = tmp
+            self.compute_seconds += time.perf_counter() - t
+            self._write(amp, low * size, block0)
+            self._write(amp, high * size, block1)
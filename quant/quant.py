@@ -1,69 +1,721 @@
+import concurrent.futures
+import itertools
+
 import numpy as np
 
 import bit_utils
 
+# gates are applied by chunks of 2^CHUNK_QBITS amplitudes: temporary arrays stay small
+CHUNK_QBITS = 16
+# small states (at most 2^GATHER_QBITS amplitudes, batches included): gates are applied by gather/scatter
+# with cached index plans (see bit_utils.get_index_plan),
+# numpy call overhead of tensor contraction is larger than the work there
+GATHER_QBITS = 10
+# permutations of at least TRANSPOSE_QBITS qbits are applied by one transposed copy, smaller ones by slice moves
+TRANSPOSE_QBITS = 7
+# chunks of large states are processed by a pool of THREADS threads (numpy releases GIL);
+# opt-in: set it to the number of cores after checking the speedup with `python benchmark.py threads`
+THREADS = 1
+
+_executor = None
+_executor_threads = 0
+
+
+def _get_executor():
+    global _executor, _executor_threads
+    if _executor_threads != THREADS:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = concurrent.futures.ThreadPoolExecutor(THREADS)
+        _executor_threads = THREADS
+    return _executor
+
+
+# precision of amplitudes: complex, or real (only real gates, e.g. H, X, Z, CNOT, SWAP, Toffoli, keep a state real)
+DTYPES = {
+    'double': (np.complex128, np.float64),
+    'single': (np.complex64, np.float32),
+}
+
+
+def _is_complex(dtype):
+    return np.issubdtype(dtype, np.complexfloating)
+
+
+def _is_real(amp):
+    return not _is_complex(amp.dtype) or not np.any(amp.imag)
+
+
+"""Amplitudes to convert to dtype: real part for a real dtype (imaginary parts must be 0)."""
+def _real_part(amp, dtype):
+    if _is_complex(amp.dtype) and not _is_complex(dtype):
+        if np.any(amp.imag):
+            raise ValueError("State is not real")
+        return amp.real
+    return amp
+
+
 # quantum state space of system of N qbits is C^{2^N}
 # pure state <=> amplitudes array a[x], x=(x_0..x_{N-1}) = 0..2^N-1 (first bit is most significant)
 
 class State:
-    def __init__(self, N, amp=None):
+    # copy=False: use amp as is if it is a contiguous array of dtype, e.g. a preallocated buffer
+    # dtype: complex128 (default), complex64, float64 or float32 (see DTYPES)
+    def __init__(self, N, amp=None, copy=True, dtype=np.complex128):
         self.N = N
         if amp is None:
-            amp = np.zeros(1 << N, dtype=np.complex128)
+            amp = np.zeros(1 << N, dtype=dtype)
             amp[0] = 1.0
-        self.amp = np.array(amp)
+        self.amp = np.array(amp, dtype=dtype) if copy else np.ascontiguousarray(amp, dtype=dtype)
+
+    def copy(self):
+        return State(self.N, self.amp.copy(), copy=False, dtype=self.amp.dtype)
+
+    """Copy of the state with amplitudes of dtype (a complex state can be real only if its amplitudes are real)."""
+    def astype(self, dtype):
+        return State(self.N, _real_part(self.amp, dtype), dtype=dtype)
+
+    """Whether the amplitudes are real numbers."""
+    def is_real(self):
+        return _is_real(self.amp)
+
+    """
+    Probabilities of outcomes of measurement of qbits (default: all) in computational basis,
+    outcome x has bits of qbits, msb first. Marginal is summed over the other axes of |amp|^2.
+    """
+    def probabilities(self, qbits=None):
+        probs = np.abs(self.amp) ** 2
+        if qbits is None:
+            return probs
+        kept = sorted(qbits)
+        marginal = probs.reshape((2,) * self.N).sum(axis=tuple(k for k in range(self.N) if k not in kept))
+        return marginal.transpose([kept.index(k) for k in qbits]).ravel()
+
+    """
+    Measurement of qbit k in computational basis with collapse in place: amplitudes of the other outcome are zeroed,
+    the rest are renormalized. Returns the outcome (0 or 1).
+    """
+    def measure(self, k, rng=np.random):
+        psi = self.amp.reshape((2,) * self.N)
+        key0 = (slice(None),) * k + (0,)
+        key1 = (slice(None),) * k + (1,)
+        p1 = np.sum(np.abs(psi[key1]) ** 2)
+        p0 = np.sum(np.abs(psi[key0]) ** 2)
+        outcome = int(rng.random() * (p0 + p1) < p1)
+        psi[(key0, key1)[1 - outcome]] = 0
+        psi[(key0, key1)[outcome]] *= 1 / np.sqrt((p0, p1)[outcome])
+        return outcome
+
+    """Measurement of qbit k, then the qbit is set to 0 (X if the outcome is 1). Returns the outcome."""
+    def reset(self, k, rng=np.random):
+        outcome = self.measure(k, rng)
+        if outcome:
+            psi = self.amp.reshape((2,) * self.N)
+            key0 = (slice(None),) * k + (0,)
+            key1 = (slice(None),) * k + (1,)
+            psi[key0] = psi[key1]
+            psi[key1] = 0
+        return outcome
+
+    """Reorders qbits in place: new qbit j is old qbit order[j] (one transposed copy, see bit_utils.permute_qbits)."""
+    def permute_qbits(self, order):
+        self.amp[:] = bit_utils.permute_qbits(self.amp, self.N, order).ravel()
+        return self
+
+
+# B states of N qbits at once: amplitudes are columns of 2^N x B matrix, circuits act on all of them in one pass
+class StateBatch:
+    def __init__(self, N, amp, copy=True, dtype=np.complex128):
+        self.N = N
+        self.amp = np.array(amp, dtype=dtype) if copy else np.ascontiguousarray(amp, dtype=dtype)
+        if self.amp.ndim != 2 or self.amp.shape[0] != 1 << N:
+            raise ValueError("Batch amplitudes must be 2^N x B matrix")
+
+    """All basis states: the batch of columns of the identity matrix."""
+    @staticmethod
+    def basis(N, dtype=np.complex128):
+        return StateBatch(N, np.eye(1 << N, dtype=dtype), copy=False, dtype=dtype)
+
+    @staticmethod
+    def from_states(states):
+        return StateBatch(states[0].N, np.array([state.amp for state in states]).T, dtype=states[0].amp.dtype)
+
+    def copy(self):
+        return StateBatch(self.N, self.amp.copy(), copy=False, dtype=self.amp.dtype)
+
+    def astype(self, dtype):
+        return StateBatch(self.N, _real_part(self.amp, dtype), dtype=dtype)
+
+    def is_real(self):
+        return _is_real(self.amp)
+
+    def __len__(self):
+        return self.amp.shape[1]
+
+    def __getitem__(self, b):
+        return State(self.N, self.amp[:, b], dtype=self.amp.dtype)
 
 
 # computational basis
-def state_comp(bits):
+def state_comp(bits, dtype=np.complex128):
     N = len(bits)
-    amp = np.zeros(1 << N, dtype=np.complex128)
+    amp = np.zeros(1 << N, dtype=dtype)
 
     x = sum(1 << (N - 1 - j) for j, b in enumerate(bits) if b)
     amp[x] = 1
-    return State(N, amp)
-
-
+    return State(N, amp, copy=False, dtype=dtype)
+
+
+# measurement in computational basis, the state is not changed
+# cumulative distribution of the state (or of qbits) is computed once, then any number of shots is sampled from it
+class Sampler:
+    def __init__(self, state, qbits=None):
+        self.qbits = list(range(state.N)) if qbits is None else list(qbits)
+        self.probs = state.probabilities(qbits)
+        self.cdf = np.cumsum(self.probs)
+        # smallest integer type for outcomes
+        self.dtype = np.min_scalar_type((1 << len(self.qbits)) - 1)
+
+    """Outcomes of shots measurements (integers, bits of qbits, msb first). rng: np.random or np.random.Generator."""
+    def sample(self, shots, rng=np.random):
+        size = len(self.cdf)
+        if shots > size:
+            # many shots: histogram, then every outcome repeated by its count in random order (same distribution),
+            # linear time instead of a binary search per shot
+            outcomes = np.repeat(np.arange(size, dtype=self.dtype), self.counts(shots, rng))
+            rng.shuffle(outcomes)
+            return outcomes
+        # side='right': outcomes of zero probability are never chosen
+        outcomes = np.searchsorted(self.cdf, rng.random(shots) * self.cdf[-1], side='right')
+        return np.minimum(outcomes, size - 1).astype(self.dtype)
+
+    """Histogram: numbers of shots with every outcome (array of 2^len(qbits) counts), without sampling every shot."""
+    def counts(self, shots, rng=np.random):
+        return rng.multinomial(shots, self.probs / self.probs.sum())
+
+
+def measure_comp(state, shots, qbits=None, rng=np.random):
+    return Sampler(state, qbits).sample(shots, rng)
+
+
+"""Kind of gate matrix: 'diagonal', 'swap' (permutation of qbits), 'permutation' (of basis states) or 'dense'."""
+def get_kind(U):
+    if not np.any(U - np.diag(np.diag(U))):
+        return 'diagonal'
+    if np.all((U == 0) | (U == 1)) and np.all(U.sum(axis=0) == 1) and np.all(U.sum(axis=1) == 1):
+        if bit_utils.get_qbits_order(np.argmax(U, axis=1)) is not None:
+            return 'swap'
+        return 'permutation'
+    return 'dense'
+
+
+# U acts on qbits if all control qbits are 1 (U is 2^n x 2^n, controls are not in the matrix)
+# kind (see get_kind) selects the kernel: phases multiply, axes transpose, index swap or tensor contraction; detected by default
+# U is kept in complex128, kernels use it in the precision of the state (see cast)
 class Gate:
-    def __init__(self, U, qbits):
+    def __init__(self, U, qbits, controls=(), kind=None):
         self.U = np.array(U, dtype=np.complex128)
         self.n = len(qbits)
-        self.qbits = qbits
-
-
-    def apply(self, state):
+        self.qbits = list(qbits)
+        self.controls = list(controls)
+        self.kind = get_kind(self.U) if kind is None else kind
+        self.real = not np.any(self.U.imag)
+        self._casts = {}
+        if self.kind == 'diagonal':
+            self.phases = np.diag(self.U).copy()
+            self.phase_slices = [i for i, phase in enumerate(self.phases) if phase != 1]
+        elif self.kind in ('permutation', 'swap'):
+            if self.kind == 'swap':
+                # new qbit qbits[j] is old qbit qbits[order[j]]
+                self.order = bit_utils.get_qbits_order(np.argmax(self.U, axis=1))
+            # cycles of basis states, U|j> = |i> means new amp[i] = amp[j], j = next element of the cycle
+            perm = self.perm = np.argmax(self.U, axis=1)
+            self.cycles = []
+            seen = set()
+            for i in range(1 << self.n):
+                cycle = []
+                while i not in seen:
+                    seen.add(i)
+                    cycle.append(i)
+                    i = perm[i]
+                if len(cycle) > 1:
+                    self.cycles.append(cycle)
+
+    """Equivalent gate without controls: dense matrix on controls + qbits."""
+    def dense(self):
+        if not self.controls:
+            return self
+        gate_size = 1 << self.n
+        size = gate_size << len(self.controls)
+        V = np.eye(size, dtype=np.complex128)
+        V[size - gate_size:, size - gate_size:] = self.U
+        return Gate(V, self.controls + self.qbits)
+
+
+    """The same gate on other qbits and controls."""
+    def relabel(self, qbits, controls=()):
+        return Gate(self.U, qbits, controls, self.kind)
+
+    """Matrix of the gate on the given qbits (they must include controls and qbits of the gate), msb first."""
+    def matrix(self, qbits):
+        local = self.relabel([qbits.index(j) for j in self.qbits], [qbits.index(j) for j in self.controls])
+        return local.apply(StateBatch.basis(len(qbits))).amp
+
+
+    """
+    Returns U applied to the state (State or StateBatch). The result is written to out (array of the shape
+    of state.amp) if it is given, out may be state.amp itself: the gate is applied in place.
+    """
+    def apply(self, state, out=None):
         N = state.N
         n = self.n
-        if n > N:
+        if n + len(self.controls) > N:
             raise ValueError("Gate has more qbits than state")
-
-        result = np.zeros(1 << N, dtype=np.complex128)
-
-        for xbase in range(1<<(N-n)):
-            merge_array = bit_utils.merge_bits_array(m=N-n, base=xbase, index_list=self.qbits)
-            vec = state.amp[merge_array]
-            uvec = self.U @ vec
-            for uv, j in zip(uvec, merge_array):
-                result[j] = uv
-
-        return State(N, result)
+        dtype = state.amp.dtype
+        if not self.real and not _is_complex(dtype):
+            raise ValueError("Complex gate on real state")
+        if out is None:
+            out = np.empty(state.amp.shape, dtype=dtype)
+        if state.amp.size <= 1 << GATHER_QBITS and self.kind != 'fourier':
+            if out is not state.amp:
+                np.copyto(out, state.amp)
+            self._gather(out, N)
+            return type(state)(N, out, copy=False, dtype=dtype)
+        if out is not state.amp and (self.controls or self.kind != 'dense'):
+            # amplitudes with some control qbit = 0 are not changed, other kernels work in place
+            np.copyto(out, state.amp)
+            state = type(state)(N, out, copy=False, dtype=dtype)
+
+        # amplitudes as a tensor with an axis per qbit (axis k <=> qbit k, since the first bit is most significant),
+        # batch of states is the last axis
+        batch = state.amp.shape[1:]
+        psi = state.amp.reshape((2,) * N + batch)
+        result = out.reshape((2,) * N + batch)
+
+        # chunks: some other qbits (outer) are fixed, control qbits are fixed to 1, U maps every chunk to itself,
+        # so it can be written back in place; chunks are independent, they are processed by THREADS threads
+        free = [k for k in range(N) if k not in self.qbits and k not in self.controls]
+        batch_qbits = (int(np.prod(batch)) - 1).bit_length()
+        outer = free[:max(N - len(self.controls) + batch_qbits - CHUNK_QBITS, 0)]
+        fixed = outer + self.controls
+        chunk_qbits = [k - sum(1 for j in fixed if j < k) for k in self.qbits]
+        keys = []
+        for outer_bits in itertools.product([0, 1], repeat=len(outer)):
+            key = [slice(None)] * N
+            for k in self.controls:
+                key[k] = 1
+            for k, b in zip(outer, outer_bits):
+                key[k] = b
+            keys.append(tuple(key))
+
+        if self.kind == 'swap' and sum(1 for j, k in enumerate(self.order) if j != k) >= TRANSPOSE_QBITS:
+            kernel = self._transpose_chunk
+        elif self.kind == 'diagonal':
+            kernel = self._phases_chunk
+        elif self.kind in ('permutation', 'swap'):
+            kernel = self._permute
+        elif self.kind == 'fourier':
+            kernel = self._fourier_chunk
+        else:
+            # U as a tensor with n output axes and n input axes
+            U = self.cast('U', dtype).reshape((2,) * (2 * n))
+
+            def kernel(chunk, chunk_qbits, key):
+                # contract input axes with the gate qbits
+                product = np.tensordot(U, psi[key], axes=(list(range(n, 2 * n)), chunk_qbits))
+                # output axes of U come first, move them back to the places of the qbits
+                chunk[...] = np.moveaxis(product, list(range(n)), chunk_qbits)
+
+        def run_chunk(key):
+            kernel(result[key], chunk_qbits, key)
+
+        if THREADS > 1 and len(keys) > 1:
+            list(_get_executor().map(run_chunk, keys))
+        else:
+            for key in keys:
+                run_chunk(key)
+        return type(state)(N, out, copy=False, dtype=dtype)
+
+    """Applies the gate in place to amplitudes amp of N qbits by index plan: rows of amp[plan] are vectors U acts on."""
+    def _gather(self, amp, N):
+        plan = bit_utils.get_index_plan(N, self.qbits, self.controls)
+        # vectors are rows for a state, a batch adds the last axis
+        if self.kind == 'diagonal':
+            phases = self.cast('phases', amp.dtype)
+            amp[plan] = amp[plan] * phases.reshape(phases.shape + (1,) * (amp.ndim - 1))
+        elif self.kind in ('permutation', 'swap'):
+            amp[plan] = amp[plan[:, self.perm]]
+        elif amp.ndim == 1:
+            amp[plan] = amp[plan] @ self.cast('U', amp.dtype).T
+        else:
+            amp[plan] = self.cast('U', amp.dtype) @ amp[plan]
+
+    """Attribute U or phases in the given precision (real part for real states), cached."""
+    def cast(self, name, dtype):
+        key = (name, np.dtype(dtype))
+        if key not in self._casts:
+            value = getattr(self, name)
+            if not _is_complex(dtype):
+                value = value.real
+            self._casts[key] = np.ascontiguousarray(value, dtype=dtype)
+        return self._casts[key]
+
+    """Index of the slice of a tensor where the gate qbits (its axes tensor_qbits) are the bits of i."""
+    def _get_slice(self, ndim, tensor_qbits, i):
+        key = [slice(None)] * ndim
+        for index, k in enumerate(tensor_qbits):
+            key[k] = (i >> (self.n - 1 - index)) & 1
+        return tuple(key)
+
+    """Multiplies slices of the chunk (tensor, the gate qbits are its axes chunk_qbits) by the phases."""
+    def _phases_chunk(self, chunk, chunk_qbits, key=None):
+        n = self.n
+        phases = self.cast('phases', chunk.dtype)
+        if len(self.phase_slices) <= (1 << n) // 2:
+            # e.g. Z, phase, controlled phase: only amplitudes with the gate qbits = 1 are multiplied
+            for i in self.phase_slices:
+                chunk[self._get_slice(chunk.ndim, chunk_qbits, i)] *= phases[i]
+        else:
+            # phases as a tensor over the gate qbits, broadcast over other axes
+            shape = [1] * chunk.ndim
+            for k in chunk_qbits:
+                shape[k] = 2
+            chunk *= phases.reshape((2,) * n).transpose(np.argsort(chunk_qbits)).reshape(shape)
+
+    """Permutes axes chunk_qbits of the chunk (qbits permutation)."""
+    def _transpose_chunk(self, chunk, chunk_qbits, key=None):
+        axes = list(range(chunk.ndim))
+        for j, k in zip(chunk_qbits, self.order):
+            axes[j] = chunk_qbits[k]
+        # zero-copy transposed view of the amplitudes, numpy copies it once since it overlaps the result
+        chunk[...] = chunk.transpose(axes)
+
+    """Moves slices of the chunk (tensor, the gate qbits are its axes chunk_qbits) along the cycles."""
+    def _permute(self, chunk, chunk_qbits, key=None):
+        slices = [self._get_slice(chunk.ndim, chunk_qbits, i) for i in range(1 << self.n)]
+        for cycle in self.cycles:
+            first = chunk[slices[cycle[0]]].copy()
+            for i, j in zip(cycle, cycle[1:]):
+                chunk[slices[i]] = chunk[slices[j]]
+            chunk[slices[cycle[-1]]] = first
 
 
     def __matmul__(self, state):
-        if not isinstance(state, State):
+        if not isinstance(state, (State, StateBatch)):
             return NotImplemented
         return self.apply(state)
 
 
-# circut = list of gates; they are applied left-to-right
+"""
+Whether the gates commute, by their structure: gates on disjoint qbits, or every common qbit is a control
+or a qbit of a diagonal gate for both of them (e.g. two diagonal gates, CNOTs with the same control, CNOT and Z on its control).
+False means "not known to commute".
+"""
+def gates_commute(a, b):
+    def diagonal_qbits(g):
+        return set(g.controls) | (set(g.qbits) if g.kind == 'diagonal' else set())
+
+    common = set(a.controls + a.qbits) & set(b.controls + b.qbits)
+    return common <= diagonal_qbits(a) and common <= diagonal_qbits(b)
+
+
+"""
+Product 'a then b' of gates with the same controls and qbits (in any order) as one gate with controls and qbits of a,
+or None if the gates act on different qbits.
+"""
+def combine_gates(a, b):
+    if set(a.controls) != set(b.controls) or set(a.qbits) != set(b.qbits):
+        return None
+    if 'fourier' in (a.kind, b.kind):
+        # 2^n x 2^n matrices of the transform are not built
+        return None
+    # matrix of b in the order of qbits of a
+    B = b.relabel([a.qbits.index(k) for k in b.qbits]).matrix(list(range(a.n)))
+    return Gate(B @ a.U, a.qbits, a.controls)
+
+
+"""
+Quantum Fourier transform on qbits (qbits[0] is the most significant bit of the transformed index):
+|x> -> sum_y exp(2 pi i x y / 2^n) |y> / 2^(n/2), the same as fourier.get_fourier_circuit.
+Applied as np.fft.ifft (np.fft.fft for the inverse transform) of every chunk, O(n 2^N) instead of O(n^2 2^N)
+for the circuit of gates. U (2^n x 2^n) is built only on demand, e.g. for Gate.matrix.
+"""
+class FourierGate(Gate):
+    def __init__(self, qbits, controls=(), inverse=False):
+        self.n = len(qbits)
+        self.qbits = list(qbits)
+        self.controls = list(controls)
+        self.inverse = inverse
+        self.kind = 'fourier'
+        self.real = False
+        self._casts = {}
+
+    @property
+    def U(self):
+        transform = np.fft.fft if self.inverse else np.fft.ifft
+        return transform(np.eye(1 << self.n), axis=0, norm='ortho')
+
+    def relabel(self, qbits, controls=()):
+        return FourierGate(qbits, controls, self.inverse)
+
+    """
+    The same transform as a list of gates on at most 2 qbits (plus the controls): H(q_j) and phase rotations
+    exp(2 pi i / 2^(k-j+1)) of q_j controlled by q_k, k > j, for every j, then swaps reversing the qbits
+    (reversed and conjugated for the inverse transform).
+    """
+    def decompose(self):
+        n, qbits = self.n, self.qbits
+        gates = []
+        for j in range(n):
+            gates.append(gate_H(qbits[j]))
+            for k in range(j + 1, n):
+                R = np.diag([1, np.exp(2j * np.pi / 2**(k - j + 1))])
+                gates.append(gate_controlled([qbits[k]], Gate(R, [qbits[j]])))
+        for j in range(n // 2):
+            gates.append(gate_swap(qbits[j], qbits[n - 1 - j]))
+        if self.inverse:
+            gates = [Gate(g.U.conj().T, g.qbits, g.controls) for g in reversed(gates)]
+        if self.controls:
+            gates = [gate_controlled(self.controls, g) for g in gates]
+        return gates
+
+    def _fourier_chunk(self, chunk, chunk_qbits, key=None):
+        n = self.n
+        # the gate qbits become the first axes, merged to one index of the transform (batch and other axes are the rest)
+        moved = np.moveaxis(chunk, chunk_qbits, list(range(n)))
+        transform = np.fft.fft if self.inverse else np.fft.ifft
+        moved[...] = transform(moved.reshape((1 << n, -1)), axis=0, norm='ortho').reshape(moved.shape)
+
+
+"""
+Whether gates[start:] begins with the QFT circuit (FourierGate.decompose) on some qbits (n >= 2):
+H(q_j) and rotations R_{k-j+1} of q_j controlled by q_k, k > j, for every j, then swaps of q_j and q_{n-1-j}.
+Returns (qbits, end of the sequence) or None.
+"""
+def _match_fourier(gates, start):
+    H = np.array([[1, 1], [1, -1]]) * 2**(-0.5)
+
+    def is_H(i, k):
+        g = gates[i] if i < len(gates) else None
+        return isinstance(g, Gate) and g.qbits == [k] and not g.controls and g.kind == 'dense' and np.allclose(g.U, H)
+
+    # controlled phase exp(2 pi i / 2^m) on j and k (symmetric: either of them may be the control), or None
+    def rotation_qbit(i, j, m):
+        g = gates[i] if i < len(gates) else None
+        if not isinstance(g, Gate) or g.kind != 'diagonal' or g.n != 1 or len(g.controls) != 1 or j not in g.qbits + g.controls:
+            return None
+        if not np.allclose(g.phases, [1, np.exp(2j * np.pi / 2**m)]):
+            return None
+        return g.controls[0] if g.qbits == [j] else g.qbits[0]
+
+    def is_swap(i, k, l):
+        g = gates[i] if i < len(gates) else None
+        return isinstance(g, Gate) and g.kind == 'swap' and not g.controls and g.n == 2 and set(g.qbits) == {k, l}
+
+    g = gates[start]
+    if not isinstance(g, Gate) or g.n != 1 or not is_H(start, g.qbits[0]):
+        return None
+    # the first row of rotations gives the qbits
+    qbits = [g.qbits[0]]
+    i = start + 1
+    while True:
+        k = rotation_qbit(i, qbits[0], len(qbits) + 1)
+        if k is None or k in qbits:
+            break
+        qbits.append(k)
+        i += 1
+    n = len(qbits)
+    if n < 2:
+        return None
+    for j in range(1, n):
+        if not is_H(i, qbits[j]):
+            return None
+        i += 1
+        for k in range(j + 1, n):
+            if rotation_qbit(i, qbits[j], k - j + 1) != qbits[k]:
+                return None
+            i += 1
+    for j in range(n // 2):
+        if not is_swap(i, qbits[j], qbits[n - 1 - j]):
+            return None
+        i += 1
+    return qbits, i
+
+
+# mid-circuit operations: they change the state in place and read or write classical bits cbits (dict),
+# see Circuit.run
+
+# measurement of the qbit with collapse, the outcome is written to the classical bit (default: named as the qbit)
+class Measure:
+    def __init__(self, qbit, cbit=None):
+        self.qbit = qbit
+        self.cbit = qbit if cbit is None else cbit
+
+    def run(self, state, cbits, rng):
+        cbits[self.cbit] = state.measure(self.qbit, rng)
+
+
+# the qbit is measured and set to 0
+class Reset:
+    def __init__(self, qbit):
+        self.qbit = qbit
+
+    def run(self, state, cbits, rng):
+        state.reset(self.qbit, rng)
+
+
+# gate applied if the classical bit has the value
+class Conditional:
+    def __init__(self, cbit, gate, value=1):
+        self.cbit = cbit
+        self.gate = gate
+        self.value = value
+
+    def run(self, state, cbits, rng):
+        if self.cbit not in cbits:
+            raise ValueError("Classical bit {!r} is not measured".format(self.cbit))
+        if cbits[self.cbit] == self.value:
+            self.gate.apply(state, out=state.amp)
+
+
+# circut = list of gates (and mid-circuit operations: Measure, Reset, Conditional); they are applied left-to-right
+# precision: 'double' or 'single' (see DTYPES), used by @; None keeps the precision of the state
 class Circuit:
-    def __init__(self, gates):
+    def __init__(self, gates, precision=None):
         self.gates = gates
+        self.precision = precision
+
+    """Whether all gates are real: real states stay real."""
+    def is_real(self):
+        return all(g.real for g in self.gates if isinstance(g, Gate)) and \
+            all(g.gate.real for g in self.gates if isinstance(g, Conditional))
+
+    """dtype of amplitudes to run the circuit on the state with: real if the circuit and the state are real."""
+    def get_dtype(self, state):
+        precision = self.precision
+        if precision is None:
+            precision = 'single' if state.amp.dtype in DTYPES['single'] else 'double'
+        complex_dtype, real_dtype = DTYPES[precision]
+        return real_dtype if self.is_real() and state.is_real() else complex_dtype
+
+    """
+    Applies the gates to the state (State or StateBatch) in place (no copies of amplitudes), returns the state.
+    Outcomes of measurements are written to cbits (dict: classical bit -> 0 or 1), if it is given.
+    """
+    def run(self, state, cbits=None, rng=np.random):
+        if cbits is None:
+            cbits = {}
+        for g in self.gates:
+            if isinstance(g, Gate):
+                g.apply(state, out=state.amp)
+                continue
+            if not isinstance(state, State):
+                raise ValueError("Mid-circuit measurement needs a State")
+            g.run(state, cbits, rng)
+        return state
 
+    """Returns the result for a copy of the state in the precision of the circuit (real, if possible, see get_dtype)."""
     def __matmul__(self, state):
+        return self.run(state.astype(self.get_dtype(state)))
+
+    """Matrix of the circuit on N qbits (default: up to the last used qbit), the circuit is run on the batch of all basis states."""
+    def unitary(self, N=None):
+        if N is None:
+            N = 1 + max(k for g in self.gates for k in g.qbits + g.controls)
+        return self.run(StateBatch.basis(N)).amp
+
+    """
+    Gate fusion: consecutive gates acting together on at most max_qbits qbits are replaced with one dense gate
+    (fewer passes over the state). Gate order is kept, mid-circuit operations are kept as is.
+    Returns the number of removed gates.
+    """
+    def optimize(self, max_qbits=3):
+        fused = []
+        group = []  # consecutive gates to fuse
+        group_qbits = []
+
+        def flush():
+            if len(group) == 1:
+                fused.append(group[0])
+            elif group:
+                M = np.eye(1 << len(group_qbits), dtype=np.complex128)
+                for g in group:
+                    M = g.matrix(group_qbits) @ M
+                fused.append(Gate(M, list(group_qbits)))
+
         for g in self.gates:
-            state = g @ state
-        return state
+            if not isinstance(g, Gate):
+                # mid-circuit operations are not fused
+                flush()
+                group, group_qbits = [], []
+                fused.append(g)
+                continue
+            new_qbits = [k for k in g.controls + g.qbits if k not in group_qbits]
+            if group and len(group_qbits) + len(new_qbits) > max_qbits:
+                flush()
+                group, group_qbits = [], []
+                new_qbits = g.controls + g.qbits
+            group.append(g)
+            group_qbits.extend(new_qbits)
+        flush()
+
+        removed = len(self.gates) - len(fused)
+        self.gates = fused
+        return removed
+
+    """
+    Substitutes kernels for known gate sequences: the QFT circuit (see FourierGate.decompose, on any qbits)
+    is replaced with one FourierGate. Should precede optimize: fused gates are not recognized.
+    Returns the number of removed gates.
+    """
+    def compile(self):
+        compiled = []
+        i = 0
+        while i < len(self.gates):
+            match = _match_fourier(self.gates, i)
+            if match is None:
+                compiled.append(self.gates[i])
+                i += 1
+            else:
+                qbits, i = match
+                compiled.append(gate_fourier(qbits))
+
+        removed = len(self.gates) - len(compiled)
+        self.gates = compiled
+        return removed
+
+    """
+    Algebraic simplification: every gate is moved back over the gates it commutes with (see gates_commute)
+    to a gate on the same qbits; inverse pairs (XX, HH, CNOT CNOT, SWAP SWAP, T T^+, ...) are removed,
+    diagonal gates (phase rotations) are merged into one. The unitary is not changed.
+    Gates are not moved over mid-circuit operations.
+    Returns the number of removed gates.
+    """
+    def simplify(self, atol=1e-9):
+        simplified = []
+        for g in self.gates:
+            for i in range(len(simplified) - 1, -1, -1):
+                h = simplified[i]
+                if not isinstance(g, Gate) or not isinstance(h, Gate):
+                    # mid-circuit operations are kept in place
+                    simplified.append(g)
+                    break
+                product = combine_gates(h, g)
+                if product is not None and np.allclose(product.U, np.eye(1 << product.n), atol=atol):
+                    del simplified[i]
+                    break
+                if product is not None and h.kind == 'diagonal' and g.kind == 'diagonal':
+                    simplified[i] = product
+                    break
+                if not gates_commute(h, g):
+                    simplified.append(g)
+                    break
+            else:
+                simplified.append(g)
+
+        removed = len(self.gates) - len(simplified)
+        self.gates = simplified
+        return removed
 
 
 def gate_X(k):
@@ -99,13 +751,13 @@ def gate_T(k):
 
 """Обмен k-го и l-го кубитов."""
 def gate_swap(k, l):
-    U = np.array([
-        [1, 0, 0, 0],
-        [0, 0, 1, 0],
-        [0, 1, 0, 0],
-        [0, 0, 0, 1],
-    ])
-    return Gate(U, [k, l])
+    return gate_permute([k, l], [1, 0])
+
+
+"""Перестановка кубитов: новый кубит qbits[j] - старый кубит qbits[order[j]]."""
+def gate_permute(qbits, order):
+    U = np.eye(1 << len(qbits))[bit_utils.qbits_permutation(len(qbits), order)]
+    return Gate(U, qbits, kind='swap')
 
 
 """Контролируемый заданными кубитами гейт."""
@@ -114,20 +766,11 @@ def gate_controlled(cqbits, gate):
     if set(cqbits) & set(gate.qbits):
         raise ValueError("Controlled qbit in gate qbits!")
 
-    c = len(cqbits)
-    n = gate.n
-    gate_size = 1 << n
-    size = 1 << (n + c)
-    V = np.zeros(shape=(size, size), dtype=np.complex128)
-
-    for i in range(size - gate_size):
-        V[i][i] = 1
-
-    for i in range(gate_size):
-        for j in range(gate_size):
-            V[size - gate_size + i][size - gate_size + j] = gate.U[i, j]
+    if len(set(cqbits)) != len(cqbits) or set(cqbits) & set(gate.controls):
+        raise ValueError("Repeated control qbits!")
 
-    return Gate(V, cqbits + gate.qbits)
+    # structured form: the base matrix is applied only where all controls are 1, see Gate.dense()
+    return gate.relabel(gate.qbits, controls=list(cqbits) + gate.controls)
 
 
 def gate_cnot(k, l):
@@ -136,3 +779,8 @@ def gate_cnot(k, l):
 
 def gate_toffoli(k, l, m):
     return gate_controlled([k, l], gate_X(m))
+
+
+"""Quantum Fourier transform on the qbits (inverse: its inverse), see FourierGate."""
+def gate_fourier(qbits, inverse=False):
+    return FourierGate(qbits, inverse=inverse)
@@ -1,10 +1,13 @@
 import itertools
+import os
+import tempfile
 
 import numpy as np
 
 import quant
 import fourier
 import bit_utils
+import mapped
 
 
 def has_diff(state1, state2):
@@ -44,6 +47,178 @@ def test_quant_X():
     print('ok')
 
 
+def random_state(N):
+    amp = np.random.normal(size=1 << N) + 1j * np.random.normal(size=1 << N)
+    return quant.State(N, amp / np.linalg.norm(amp))
+
+
+def test_quant_apply():
+    print("test_quant_apply")
+    N = 5
+    for qbits in [[0], [4], [3, 0], [1, 4, 2]]:
+        n = len(qbits)
+        U = np.random.normal(size=(1 << n, 1 << n)) + 1j * np.random.normal(size=(1 << n, 1 << n))
+        state = random_state(N)
+
+        # reference: apply U to amplitudes of every base separately
+        expected = np.zeros(1 << N, dtype=np.complex128)
+        for xbase in range(1 << (N - n)):
+            merge_array = bit_utils.merge_bits_array(m=N-n, base=xbase, index_list=qbits)
+            expected[merge_array] = U @ state.amp[merge_array]
+
+        if has_diff(quant.Gate(U, qbits) @ state, quant.State(N, expected)):
+            raise ValueError("wrong apply for qbits {}".format(qbits))
+    print('ok')
+
+
+def test_quant_in_place():
+    print("test_quant_in_place")
+    N = 5
+    circuit = quant.Circuit([quant.gate_H(0), quant.gate_cnot(0, 3), quant.gate_toffoli(4, 3, 1), quant.gate_T(4)])
+    start_state = random_state(N)
+    expected = start_state
+    for g in circuit.gates:
+        expected = g @ expected
+
+    chunk_qbits, gather_qbits, threads = quant.CHUNK_QBITS, quant.GATHER_QBITS, quant.THREADS
+    try:
+        for quant.CHUNK_QBITS, quant.GATHER_QBITS, quant.THREADS in [
+                (chunk_qbits, gather_qbits, 1), (chunk_qbits, 0, 1), (2, 0, 1), (2, 0, 4)]:
+            state = start_state.copy()
+            amp = state.amp
+            if circuit.run(state) is not state or state.amp is not amp:
+                raise ValueError("expected the same amplitudes buffer")
+            if has_diff(state, expected):
+                raise ValueError("wrong in-place circuit with chunks of {} qbits, {} threads".format(quant.CHUNK_QBITS, quant.THREADS))
+    finally:
+        quant.CHUNK_QBITS, quant.GATHER_QBITS, quant.THREADS = chunk_qbits, gather_qbits, threads
+
+    amp = start_state.amp.copy()
+    if has_diff(circuit @ start_state, expected) or np.any(start_state.amp != amp):
+        raise ValueError("expected @ to keep the state")
+    print('ok')
+
+
+def test_quant_kernels():
+    print("test_quant_kernels")
+    N = 5
+    R = np.array([[1, 0], [0, np.exp(0.3j)]])
+    P = np.eye(8)[[3, 0, 1, 2, 4, 6, 5, 7]]  # cycles of length 4, 2 and fixed points
+    gates = [
+        (quant.gate_Z(3), 'diagonal'),
+        (quant.gate_controlled([4], quant.Gate(R, [1])), 'diagonal'),
+        (quant.Gate(np.diag(np.exp(1j * np.arange(8))), [4, 0, 2]), 'diagonal'),
+        (quant.gate_X(0), 'permutation'),
+        (quant.gate_swap(4, 1), 'swap'),
+        (quant.gate_permute([3, 0, 4], [2, 0, 1]), 'swap'),
+        (quant.gate_controlled([2], quant.gate_swap(1, 3)), 'swap'),
+        (quant.gate_toffoli(3, 0, 2), 'permutation'),
+        (quant.Gate(P, [2, 4, 1], controls=[3]), 'permutation'),
+        (quant.gate_Y(1), 'dense'),
+    ]
+    gather_qbits, transpose_qbits = quant.GATHER_QBITS, quant.TRANSPOSE_QBITS
+    chunk_qbits, threads = quant.CHUNK_QBITS, quant.THREADS
+    try:
+        # tensor kernels (slice moves or transposes for qbits permutations), by chunks in threads,
+        # then gather by index plans
+        for quant.GATHER_QBITS, quant.TRANSPOSE_QBITS, quant.CHUNK_QBITS, quant.THREADS in [
+                (0, transpose_qbits, chunk_qbits, 1), (0, 2, chunk_qbits, 1), (0, transpose_qbits, 2, 3), (0, 2, 2, 3),
+                (gather_qbits, transpose_qbits, chunk_qbits, 1)]:
+            for gate, kind in gates:
+                if gate.kind != kind:
+                    raise ValueError("expected {} gate, got {}".format(kind, gate.kind))
+                state = random_state(N)
+                dense = quant.Gate(gate.U, gate.qbits, gate.controls, kind='dense')
+                expected = dense @ state
+                if has_diff(gate @ state, expected):
+                    raise ValueError("wrong {} kernel".format(kind))
+                if has_diff(gate.apply(state, out=state.amp), expected):
+                    raise ValueError("wrong in-place {} kernel".format(kind))
+    finally:
+        quant.GATHER_QBITS, quant.TRANSPOSE_QBITS = gather_qbits, transpose_qbits
+        quant.CHUNK_QBITS, quant.THREADS = chunk_qbits, threads
+    print('ok')
+
+
+def test_bit_permutations():
+    print("test_bit_permutations")
+    N = 6
+    x = np.arange(1 << N)
+    positions = [5, 2, 0]
+    rest = [1, 3, 4]
+    low = bit_utils.extract_bits(x, N, positions)
+    if np.any(bit_utils.deposit_bits(low, N, positions) | bit_utils.deposit_bits(bit_utils.extract_bits(x, N, rest), N, rest) != x):
+        raise ValueError("expected deposit(extract(x)) = x")
+    if list(low[[0b000001, 0b001000, 0b100000]]) != [0b100, 0b010, 0b001]:
+        raise ValueError("wrong extract_bits")
+
+    table = bit_utils.merge_bits_table(4, [3, 0])
+    if any(list(table[base]) != bit_utils.merge_bits_array(4, base, [3, 0]) for base in range(1 << 4)):
+        raise ValueError("wrong merge_bits_table")
+
+    # permutation of qbits = transposed view of the amplitudes
+    order = [2, 0, 3, 1]
+    amp = random_state(4).amp
+    view = bit_utils.permute_qbits(amp, 4, order)
+    if not np.shares_memory(view, amp):
+        raise ValueError("expected a view")
+    for i in range(1 << 4):
+        bits = [(i >> (3 - j)) & 1 for j in range(4)]
+        old_bits = [0] * 4
+        for j, k in enumerate(order):
+            old_bits[k] = bits[j]
+        if view.ravel()[i] != amp[int(''.join(map(str, old_bits)), 2)]:
+            raise ValueError("wrong permute_qbits")
+    if bit_utils.get_qbits_order(bit_utils.qbits_permutation(4, order)) != order:
+        raise ValueError("wrong get_qbits_order")
+    if bit_utils.get_qbits_order(np.array([1, 0, 2, 3])) is not None:
+        raise ValueError("expected not a qbits permutation")
+
+    # gate_permute = product of swaps
+    state = random_state(5)
+    swaps = quant.Circuit([quant.gate_swap(0, 4), quant.gate_swap(1, 3)])
+    if has_diff(quant.gate_permute([0, 1, 2, 3, 4], [4, 3, 2, 1, 0]) @ state, swaps @ state):
+        raise ValueError("wrong gate_permute")
+    amp = state.amp
+    if has_diff(state.copy().permute_qbits([4, 3, 2, 1, 0]), swaps @ state) or state.permute_qbits([0, 1, 2, 3, 4]).amp is not amp:
+        raise ValueError("wrong State.permute_qbits")
+    print('ok')
+
+
+def test_index_plan():
+    print("test_index_plan")
+    N = 6
+    bit_utils.clear_plan_cache()
+    for qbits, controls in [([2], []), ([5, 0], []), ([1, 3], [4]), ([0], [5, 2])]:
+        plan = bit_utils.get_index_plan(N, qbits, controls)
+        control_bits = sum(1 << (N - 1 - j) for j in controls)
+        expected = []
+        for base in range(1 << (N - len(qbits))):
+            merged = bit_utils.merge_bits_array(m=N-len(qbits), base=base, index_list=qbits)
+            if merged[0] & control_bits == control_bits:
+                expected.append(merged)
+        if plan.shape != (1 << (N - len(qbits) - len(controls)), 1 << len(qbits)) or np.any(plan != expected):
+            raise ValueError("wrong plan for qbits {} controls {}".format(qbits, controls))
+        if bit_utils.get_index_plan(N, qbits, controls) is not plan:
+            raise ValueError("expected cached plan")
+
+    # least recently used plans are evicted
+    cache_bytes = bit_utils.PLAN_CACHE_BYTES
+    try:
+        bit_utils.clear_plan_cache()
+        plan = bit_utils.get_index_plan(N, [0])
+        bit_utils.PLAN_CACHE_BYTES = 2 * plan.nbytes
+        bit_utils.get_index_plan(N, [1])
+        bit_utils.get_index_plan(N, [0])
+        bit_utils.get_index_plan(N, [2])
+        if bit_utils.plan_cache_info() != (2, 2 * plan.nbytes) or bit_utils.get_index_plan(N, [0]) is not plan:
+            raise ValueError("expected eviction of the least recently used plan")
+    finally:
+        bit_utils.PLAN_CACHE_BYTES = cache_bytes
+        bit_utils.clear_plan_cache()
+    print('ok')
+
+
 def test_quant_equations():
     print("test_quant_equations")
 
@@ -126,6 +301,29 @@ def test_quant_controlled():
         if has_diff(circ1 @ state, circ2 @ state):
             raise ValueError("expected equality for C^2-U")
 
+    # structured controlled gates are the same as dense ones
+    N = 5
+    state = random_state(N)
+    V = np.array([[0.6j, 0.8j], [0.8, -0.6]])
+    for gate in [
+        quant.gate_controlled([3], quant.Gate(V, [1])),
+        quant.gate_controlled([4, 0], quant.gate_swap(3, 1)),
+        quant.gate_controlled([2], quant.gate_toffoli(4, 0, 1)),
+    ]:
+        dense = gate.dense()
+        if dense.controls or dense.n != gate.n + len(gate.controls):
+            raise ValueError("wrong dense gate")
+        if has_diff(gate @ state, dense @ state):
+            raise ValueError("expected structured C-U = dense C-U")
+
+    # wide multi-controlled gate: C^15 X flips the last qbit only for 1...1
+    N = 16
+    gate = quant.gate_controlled(list(range(N - 1)), quant.gate_X(N - 1))
+    if has_diff(gate @ quant.state_comp([1] * N), quant.state_comp([1] * (N - 1) + [0])):
+        raise ValueError("wrong C^{} X".format(N - 1))
+    if has_diff(gate @ quant.state_comp([0] + [1] * (N - 1)), quant.state_comp([0] + [1] * (N - 1))):
+        raise ValueError("wrong C^{} X".format(N - 1))
+
     print("ok")
 
 
@@ -166,6 +364,378 @@ def test_quant_toffoli():
     print("ok")
 
 
+def test_quant_optimize():
+    print("test_quant_optimize")
+
+    # Toffoli decomposition (see test_quant_toffoli) on 3 qbits of 4
+    T = quant.gate_T(0).U
+    Tc = T.conj().T
+    gates = [
+        quant.gate_H(3), quant.gate_cnot(1, 3), quant.Gate(Tc, [3]), quant.gate_cnot(0, 3), quant.gate_T(3),
+        quant.gate_cnot(1, 3), quant.Gate(Tc, [3]), quant.gate_cnot(0, 3), quant.Gate(Tc, [1]), quant.gate_T(3),
+        quant.gate_cnot(0, 1), quant.gate_H(3), quant.Gate(Tc, [1]), quant.gate_cnot(0, 1), quant.gate_T(0),
+        quant.gate_phase(1),
+    ]
+    for max_qbits, expected_gates in [(3, 1), (2, 8), (1, 16)]:
+        circuit = quant.Circuit(list(gates))
+        removed = circuit.optimize(max_qbits)
+        if removed != len(gates) - expected_gates or len(circuit.gates) != expected_gates:
+            raise ValueError("expected {} gates after fusion to {} qbits, got {}".format(expected_gates, max_qbits, len(circuit.gates)))
+        if any(len(g.qbits) + len(g.controls) > max_qbits for g in circuit.gates if g not in gates):
+            raise ValueError("fused gate is too large")
+        for _ in range(3):
+            state = random_state(4)
+            if has_diff(circuit @ state, quant.Circuit(gates) @ state):
+                raise ValueError("fusion changed the circuit")
+
+    toffoli = quant.gate_toffoli(0, 1, 3)
+    circuit = quant.Circuit(list(gates))
+    circuit.optimize(3)
+    if np.max(np.abs(circuit.gates[0].matrix([0, 1, 3]) - toffoli.matrix([0, 1, 3]))) > 1e-6:
+        raise ValueError("expected fused Toffoli")
+    print("ok")
+
+
+def circuit_matrix(circuit, N):
+    return np.array([(circuit @ quant.State(N, np.eye(1 << N)[x])).amp for x in range(1 << N)]).T
+
+
+"""
+count random gates on N >= 3 qbits: Clifford+T gates and their inverses (many inverse pairs),
+random 1-qbit unitaries, CNOT, SWAP, CZ, Toffoli and controlled 2-qbit diagonal gates.
+"""
+def random_gates(N, count):
+    Tc = quant.gate_T(0).U.conj().T
+    factories = [
+        lambda k, l, m: quant.gate_X(k), lambda k, l, m: quant.gate_H(k), lambda k, l, m: quant.gate_Z(k),
+        lambda k, l, m: quant.gate_T(k), lambda k, l, m: quant.Gate(Tc, [k]), lambda k, l, m: quant.gate_phase(k),
+        lambda k, l, m: quant.Gate(np.linalg.qr(np.random.normal(size=(2, 2)) + 1j * np.random.normal(size=(2, 2)))[0], [k]),
+        lambda k, l, m: quant.gate_cnot(k, l), lambda k, l, m: quant.gate_swap(k, l),
+        lambda k, l, m: quant.gate_controlled([k], quant.gate_Z(l)), lambda k, l, m: quant.gate_toffoli(k, l, m),
+        lambda k, l, m: quant.Gate(np.diag(np.exp(1j * np.random.normal(size=4))), [k, l], controls=[m]),
+    ]
+    gates = []
+    for _ in range(count):
+        k, l, m = np.random.permutation(N)[:3]
+        gates.append(factories[np.random.randint(len(factories))](k, l, m))
+    return gates
+
+
+def test_quant_simplify():
+    print("test_quant_simplify")
+
+    Tc = quant.gate_T(0).U.conj().T
+    cases = [
+        ([quant.gate_X(0), quant.gate_X(0)], 0),
+        ([quant.gate_H(1), quant.gate_X(0), quant.gate_X(0), quant.gate_H(1)], 0),
+        ([quant.gate_swap(0, 1), quant.gate_swap(1, 0)], 0),
+        ([quant.gate_cnot(0, 1), quant.gate_Z(0), quant.gate_cnot(0, 1)], 1),
+        ([quant.gate_cnot(0, 1), quant.gate_cnot(0, 2), quant.gate_cnot(0, 1)], 1),
+        ([quant.gate_T(1), quant.gate_cnot(0, 2), quant.Gate(Tc, [1])], 1),
+        ([quant.gate_T(0), quant.gate_Z(1), quant.gate_T(0), quant.gate_phase(0)], 2),
+        ([quant.gate_T(2), quant.gate_H(2), quant.Gate(Tc, [2])], 3),
+        ([quant.gate_cnot(0, 1), quant.gate_X(1), quant.gate_cnot(0, 1)], 3),
+    ]
+    for gates, expected_gates in cases:
+        circuit = quant.Circuit(list(gates))
+        removed = circuit.simplify()
+        if len(circuit.gates) != expected_gates or removed != len(gates) - expected_gates:
+            raise ValueError("expected {} gates after simplification, got {}".format(expected_gates, len(circuit.gates)))
+        if np.max(np.abs(circuit_matrix(circuit, 3) - circuit_matrix(quant.Circuit(gates), 3))) > 1e-6:
+            raise ValueError("simplification changed the unitary")
+
+    # T T = S: phases are merged into one gate
+    circuit = quant.Circuit([quant.gate_T(0), quant.gate_T(0)])
+    circuit.simplify()
+    if len(circuit.gates) != 1 or np.max(np.abs(circuit.gates[0].U - quant.gate_phase(0).U)) > 1e-6:
+        raise ValueError("expected TT=S")
+
+    # QFT followed by its inverse: everything cancels
+    for n in range(2, 6):
+        gates = fourier.get_fourier_circuit(n).gates + quant.gate_fourier(range(n), inverse=True).decompose()
+        circuit = quant.Circuit(list(gates))
+        if circuit.simplify() != len(gates) or circuit.gates:
+            raise ValueError("expected empty circuit for QFT and inverse QFT")
+
+    # random circuits of gates with many inverse pairs
+    N = 3
+    for _ in range(20):
+        gates = random_gates(N, 40)
+        circuit = quant.Circuit(list(gates))
+        circuit.simplify()
+        if len(circuit.gates) > len(gates):
+            raise ValueError("simplification added gates")
+        if np.max(np.abs(circuit_matrix(circuit, N) - circuit_matrix(quant.Circuit(gates), N))) > 1e-6:
+            raise ValueError("simplification changed the unitary")
+    print("ok")
+
+
+def test_quant_batch():
+    print("test_quant_batch")
+    P = np.eye(8)[[3, 0, 1, 2, 4, 6, 5, 7]]
+    for N in [4, 12]:
+        gates = [
+            quant.gate_H(0), quant.gate_cnot(0, N - 1), quant.gate_toffoli(N - 1, 2, 1), quant.gate_T(3),
+            quant.gate_swap(1, N - 2), quant.Gate(P, [2, 3, 0], controls=[N - 1]),
+            quant.Gate(np.linalg.qr(np.random.normal(size=(4, 4)))[0], [N - 1, 1]),
+            quant.gate_permute(list(range(N)), list(range(N - 1, -1, -1))) if N <= 8 else quant.gate_Y(N - 2),
+        ]
+        circuit = quant.Circuit(gates)
+        states = [random_state(N) for _ in range(5)]
+        chunk_qbits, transpose_qbits = quant.CHUNK_QBITS, quant.TRANSPOSE_QBITS
+        try:
+            for quant.CHUNK_QBITS, quant.TRANSPOSE_QBITS in [(chunk_qbits, transpose_qbits), (4, 2)]:
+                batch = circuit @ quant.StateBatch.from_states(states)
+                if len(batch) != len(states):
+                    raise ValueError("wrong batch size")
+                for b, state in enumerate(states):
+                    if has_diff(batch[b], circuit @ state):
+                        raise ValueError("wrong batch run on {} qbits".format(N))
+        finally:
+            quant.CHUNK_QBITS, quant.TRANSPOSE_QBITS = chunk_qbits, transpose_qbits
+
+    N = 4
+    circuit = quant.Circuit([quant.gate_H(1), quant.gate_toffoli(0, 1, 3), quant.gate_swap(2, 0), quant.gate_T(2)])
+    if np.max(np.abs(circuit.unitary() - circuit_matrix(circuit, N))) > 1e-6:
+        raise ValueError("wrong unitary")
+    F = np.exp(2j * np.pi * np.outer(np.arange(16), np.arange(16)) / 16) / 4
+    if np.max(np.abs(fourier.get_fourier_circuit(4).unitary() - F)) > 1e-6:
+        raise ValueError("wrong unitary of QFT")
+    print('ok')
+
+
+def test_quant_sampling():
+    print("test_quant_sampling")
+    N = 4
+    state = random_state(N)
+    probs = state.probabilities()
+    if abs(probs.sum() - 1) > 1e-9:
+        raise ValueError("probabilities must sum to 1")
+
+    # marginal on qbits [2, 0]: outcome bits are qbit 2, qbit 0
+    expected = np.zeros(4)
+    for x in range(1 << N):
+        expected[2 * ((x >> 1) & 1) + ((x >> 3) & 1)] += probs[x]
+    if np.max(np.abs(state.probabilities([2, 0]) - expected)) > 1e-9:
+        raise ValueError("wrong marginal probabilities")
+
+    shots = 200000
+    for qbits, p in [(None, probs), ([2, 0], expected)]:
+        sampler = quant.Sampler(state, qbits)
+        # binary search per shot (few shots) and shuffled histogram (many shots)
+        for outcomes in [sampler.sample(10), sampler.sample(shots)]:
+            if outcomes.dtype != np.uint8 or outcomes.max() >= len(p):
+                raise ValueError("wrong outcomes")
+        counts = sampler.counts(shots)
+        for frequencies in [np.bincount(outcomes, minlength=len(p)) / shots, counts / shots]:
+            if counts.sum() != shots or np.max(np.abs(frequencies - p)) > 0.01:
+                raise ValueError("frequencies differ from probabilities")
+
+    # outcomes of zero probability never appear
+    bell = quant.State(2, [2**-0.5, 0, 0, 2**-0.5])
+    for shots in [3, 1000]:
+        if set(quant.measure_comp(bell, shots).tolist()) - {0, 3}:
+            raise ValueError("expected outcomes 00 and 11 only")
+    if quant.Sampler(quant.state_comp([1, 0, 1]), [2, 1]).sample(5).tolist() != [2] * 5:
+        raise ValueError("expected outcome 10")
+    print('ok')
+
+
+def test_quant_mid_circuit():
+    print("test_quant_mid_circuit")
+
+    # Bell pair: outcomes of both qbits are equal, the state collapses to |00> or |11>
+    bell = quant.Circuit([quant.gate_H(0), quant.gate_cnot(0, 1), quant.Measure(0, 'a'), quant.Measure(1, 'b')])
+    outcomes = set()
+    for _ in range(20):
+        cbits = {}
+        state = bell.run(quant.State(2), cbits)
+        if cbits['a'] != cbits['b']:
+            raise ValueError("expected equal outcomes")
+        if has_diff(state, quant.state_comp([cbits['a']] * 2)):
+            raise ValueError("expected collapsed state")
+        outcomes.add(cbits['a'])
+    if outcomes != {0, 1}:
+        raise ValueError("expected both outcomes")
+
+    ones = sum(quant.State(1, [0.6, 0.8]).measure(0) for _ in range(2000))
+    if abs(ones / 2000 - 0.64) > 0.05:
+        raise ValueError("wrong measurement probability")
+
+    # teleportation of qbit 0 to qbit 2: corrections are conditioned on the outcomes
+    V = np.linalg.qr(np.random.normal(size=(2, 2)) + 1j * np.random.normal(size=(2, 2)))[0]
+    psi = V[:, 0]
+    teleport = quant.Circuit([
+        quant.Gate(V, [0]), quant.gate_H(1), quant.gate_cnot(1, 2),
+        quant.gate_cnot(0, 1), quant.gate_H(0), quant.Measure(0, 'm0'), quant.Measure(1, 'm1'),
+        quant.Conditional('m1', quant.gate_X(2)), quant.Conditional('m0', quant.gate_Z(2)),
+    ])
+    for _ in range(10):
+        cbits = {}
+        amp = teleport.run(quant.State(3), cbits).amp.reshape(2, 2, 2)
+        if np.max(np.abs(amp[cbits['m0'], cbits['m1']] - psi)) > 1e-6:
+            raise ValueError("teleportation failed")
+
+    # reset: the qbit is 0, the state stays normalized
+    state = random_state(4)
+    quant.Circuit([quant.Reset(1)]).run(state)
+    if np.max(np.abs(state.probabilities([1]) - [1, 0])) > 1e-9 or abs(np.linalg.norm(state.amp) - 1) > 1e-9:
+        raise ValueError("wrong reset")
+
+    # measurements are barriers for optimizations
+    circuit = quant.Circuit([quant.gate_X(0), quant.Measure(0), quant.gate_X(0)])
+    if circuit.simplify() != 0 or circuit.optimize() != 0:
+        raise ValueError("gates must not be merged over a measurement")
+    try:
+        circuit.run(quant.StateBatch.basis(1))
+        failed = False
+    except ValueError:
+        failed = True
+    if not failed:
+        raise ValueError("expected error: measurement of a batch")
+
+    # condition on a classical bit that is not measured
+    circuit = quant.Circuit([quant.Measure(0, 'm0'), quant.Conditional('m1', quant.gate_X(1))])
+    try:
+        circuit.run(quant.State(2))
+        failed = False
+    except ValueError as error:
+        failed = "'m1'" in str(error)
+    if not failed:
+        raise ValueError("expected error: unmeasured classical bit")
+    print('ok')
+
+
+def test_mapped_state():
+    print("test_mapped_state")
+    N = 7
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.bin')
+        for _ in range(10):
+            circuit = quant.Circuit(random_gates(N, 20))
+            start_state = random_state(N)
+            state = mapped.create_state(path, N)
+            state.amp[:] = start_state.amp
+            runner = mapped.BlockedRunner(local_qbits=3)
+            if runner.run(circuit, state) is not state or has_diff(state, circuit @ start_state):
+                raise ValueError("wrong blocked run")
+            block_bytes = 16 << runner.L
+            if runner.bytes_read != runner.bytes_written or runner.bytes_read > (runner.passes + runner.swaps) * (16 << N):
+                raise ValueError("wrong I/O stats")
+            if runner.bytes_read % block_bytes:
+                raise ValueError("expected whole blocks")
+        mapped.flush(state)
+        if has_diff(mapped.open_state(path, N, mode='r'), state):
+            raise ValueError("expected the state in the file")
+
+        # local qbits, controls and diagonal gates on global qbits: one pass, no swaps
+        state = mapped.create_state(path, N)
+        circuit = quant.Circuit([
+            quant.gate_H(6), quant.gate_cnot(0, 5), quant.gate_T(1), quant.gate_controlled([2], quant.gate_Z(0)),
+            quant.gate_H(4),
+        ])
+        runner = mapped.BlockedRunner(local_qbits=3)
+        runner.run(circuit, state)
+        if (runner.passes, runner.swaps) != (1, 0) or has_diff(state, circuit @ quant.State(N)):
+            raise ValueError("expected one pass")
+        # gate on a global qbit: swapped in, then back
+        runner.reset_stats()
+        runner.run(quant.Circuit([quant.gate_H(0)]), state)
+        if runner.swaps != 2 or has_diff(state, quant.Circuit(circuit.gates + [quant.gate_H(0)]) @ quant.State(N)):
+            raise ValueError("expected swap of the global qbit")
+
+        # QFT wider than the local qbits is run as its gates, local controls may be swapped out
+        start_state = random_state(N)
+        circuit = quant.Circuit([
+            quant.gate_fourier([0, 1, 2, 3, 4]), quant.gate_fourier([6, 2, 5, 0], inverse=True),
+            quant.gate_controlled([4], quant.Gate(quant.gate_fourier([0, 1, 2]).U, [0, 1, 2])),
+        ])
+        state.amp[:] = start_state.amp
+        mapped.BlockedRunner(local_qbits=3).run(circuit, state)
+        if has_diff(state, circuit @ start_state):
+            raise ValueError("wrong blocked run of QFT")
+
+        failed = False
+        try:
+            mapped.BlockedRunner(local_qbits=3).run(quant.Circuit([quant.Gate(np.eye(16)[::-1] * 1j, [0, 1, 2, 3])]), state)
+        except ValueError as error:
+            failed = 'local qbits' in str(error)
+        if not failed:
+            raise ValueError("expected error: gate wider than local qbits")
+        del state
+    print('ok')
+
+
+def test_quant_precision():
+    print("test_quant_precision")
+    N = 11
+    real_gates = [quant.gate_H(0), quant.gate_cnot(0, 5), quant.gate_swap(2, 9), quant.gate_toffoli(1, 3, 10),
+                  quant.gate_Z(4), quant.gate_X(7), quant.Gate(np.array([[0.6, 0.8], [0.8, -0.6]]), [8], controls=[6])]
+    circuit = quant.Circuit(real_gates)
+    if not circuit.is_real():
+        raise ValueError("expected real circuit")
+    amp = np.random.normal(size=1 << N)
+    start_state = quant.State(N, amp / np.linalg.norm(amp))
+    expected = quant.Circuit(real_gates).run(start_state.copy())
+    for precision, dtype, atol in [('double', np.float64, 1e-12), ('single', np.float32, 1e-6)]:
+        result = quant.Circuit(real_gates, precision) @ start_state
+        if result.amp.dtype != dtype or np.max(np.abs(result.amp - expected.amp)) > atol:
+            raise ValueError("wrong real run")
+        if start_state.amp.dtype != np.complex128:
+            raise ValueError("start state changed")
+
+    # complex gates: complex precision, also for chunked kernels
+    gates = real_gates + [quant.gate_T(3), quant.gate_phase(5), quant.gate_Y(1),
+             quant.Gate(np.linalg.qr(random_state(2).amp.reshape(2, 2))[0], [2])]
+    state = random_state(N)
+    expected = quant.Circuit(gates).run(state.copy())
+    gather_qbits = quant.GATHER_QBITS
+    try:
+        for quant.GATHER_QBITS in [gather_qbits, 4]:
+            result = quant.Circuit(gates, 'single') @ state
+            if result.amp.dtype != np.complex64 or np.max(np.abs(result.amp - expected.amp)) > 1e-5:
+                raise ValueError("wrong single precision run")
+    finally:
+        quant.GATHER_QBITS = gather_qbits
+
+    real_state = start_state.astype(np.float32)
+    if real_state.amp.dtype != np.float32 or not real_state.is_real() or real_state.astype(np.complex128).amp.dtype != np.complex128:
+        raise ValueError("wrong astype")
+    failed = False
+    try:
+        quant.gate_T(0).apply(real_state)
+    except ValueError:
+        failed = True
+    if not failed:
+        raise ValueError("expected error for complex gate on real state")
+    failed = False
+    try:
+        state.astype(np.float64)
+    except ValueError:
+        failed = True
+    if not failed:
+        raise ValueError("expected error for complex state")
+
+    # without precision of the circuit the precision of the state is kept, real only if possible
+    single = state.astype(np.complex64)
+    for circuit_gates, start, dtype in [(real_gates, real_state, np.float32), (gates, real_state, np.complex64),
+                                        (gates, single, np.complex64), (real_gates, start_state, np.float64)]:
+        if (quant.Circuit(circuit_gates) @ start).amp.dtype != dtype:
+            raise ValueError("precision of the state must be kept")
+    if (quant.Circuit(gates, 'double') @ single).amp.dtype != np.complex128:
+        raise ValueError("expected precision of the circuit")
+    if quant.StateBatch.from_states([single, single]).amp.dtype != np.complex64:
+        raise ValueError("wrong dtype of batch")
+
+    with tempfile.TemporaryDirectory() as directory:
+        state = mapped.create_state(os.path.join(directory, 'state.bin'), N, dtype=np.float32)
+        mapped.BlockedRunner(local_qbits=6).run(circuit, state)
+        if state.amp.dtype != np.float32 or has_diff(state, circuit @ quant.State(N)):
+            raise ValueError("wrong real blocked run")
+        del state
+    print('ok')
+
+
 def test_quant_fredkin():
     print("test_quant_fredkin")
 
@@ -189,18 +759,52 @@ def test_quant_fredkin():
 
 def test_fourier():
     print("test_fourier")
-    n = 2  # qbits count
-    F = fourier.get_fourier_circuit(n)
-
-    amp = np.random.normal(size=2**n)
-    amp = amp / np.linalg.norm(amp)
-
-    q_amp = F @ quant.State(n, amp)
-    fft_amp = np.fft.fft(amp)
-    c_amp = quant.State(n, np.conjugate(fft_amp) / np.linalg.norm(fft_amp))
-
-    if has_diff(q_amp, c_amp):
-        raise ValueError("Fourier: not equals fft")
+    for n in range(1, 7):  # qbits count
+        F = fourier.get_fourier_circuit(n)
+
+        amp = np.random.normal(size=2**n)
+        amp = amp / np.linalg.norm(amp)
+
+        q_amp = F @ quant.State(n, amp)
+        fft_amp = np.fft.fft(amp)
+        c_amp = quant.State(n, np.conjugate(fft_amp) / np.linalg.norm(fft_amp))
+
+        if has_diff(q_amp, c_amp):
+            raise ValueError("Fourier: not equals fft")
+        if has_diff(quant.gate_fourier(range(n)) @ quant.State(n, amp), c_amp):
+            raise ValueError("Fourier kernel: not equals fft")
+
+    # kernel on a subset of qbits, compiled circuit, inverse transform
+    N = 12
+    qbits = [7, 2, 10, 4, 0]
+    circuit = fourier.get_fourier_circuit(len(qbits), qbits)
+    compiled = quant.Circuit(circuit.gates + [quant.gate_H(3)])
+    if compiled.compile() != len(circuit.gates) - 1 or len(compiled.gates) != 2 or compiled.gates[0].kind != 'fourier':
+        raise ValueError("expected QFT substitution")
+    if compiled.gates[0].qbits != qbits:
+        raise ValueError("wrong qbits of QFT")
+    state = random_state(N)
+    chunk_qbits = quant.CHUNK_QBITS
+    try:
+        for quant.CHUNK_QBITS in [chunk_qbits, 8]:
+            if has_diff(compiled @ state, quant.Circuit(circuit.gates + [quant.gate_H(3)]) @ state):
+                raise ValueError("wrong compiled QFT")
+    finally:
+        quant.CHUNK_QBITS = chunk_qbits
+    if has_diff(quant.gate_fourier(qbits, inverse=True) @ (compiled.gates[0] @ state), state):
+        raise ValueError("wrong inverse QFT")
+    gate = quant.gate_fourier([1, 2])
+    if np.max(np.abs(gate.matrix([0, 1, 2]) - np.kron(np.eye(2), gate.U))) > 1e-12:
+        raise ValueError("wrong QFT matrix")
+    controlled = quant.gate_controlled([0], gate)
+    if controlled.kind != 'fourier' or has_diff(controlled @ state, controlled.dense() @ state):
+        raise ValueError("wrong controlled QFT")
+
+    # broken sequences are kept
+    gates = fourier.get_fourier_circuit(4).gates
+    for broken in [gates[:-1], gates[:3] + gates[4:], gates[:1] + [quant.gate_T(0)] + gates[1:]]:
+        if quant.Circuit(list(broken)).compile() != 0:
+            raise ValueError("unexpected QFT substitution")
 
     print("ok")
 
@@ -209,8 +813,20 @@ if __name__ == "__main__":
     np.random.seed(177)
     test_merge_bits_array()
     test_quant_X()
+    test_quant_apply()
+    test_quant_in_place()
+    test_quant_kernels()
+    test_bit_permutations()
+    test_index_plan()
     test_quant_equations()
     test_quant_controlled()
     test_quant_toffoli()
+    test_quant_optimize()
+    test_quant_simplify()
+    test_quant_batch()
+    test_quant_sampling()
+    test_quant_mid_circuit()
+    test_mapped_state()
+    test_quant_precision()
     test_quant_fredkin()
     test_fourier()
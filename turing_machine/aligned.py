@@ -0,0 +1,343 @@
+"""
+One-tape emulation of a multitape machine with collocated head cells.
+
+MultitapeEmulator keeps every tape in place and moves the real head between the multiheads,
+so every emulated step costs sweeps over the whole span between the heads. Here the heads do not move:
+the head cells of all tapes are kept in one block of the real tape (the head block),
+and a tape is shifted relative to the others only when its head moves differently than the head of the anchor tape.
+
+Layout: tape k of T is track k, block b is the cells [b * T, (b + 1) * T).
+    block 0: WALL cells, left end of the real tape
+    then padding of VOID cells, room for tracks shifted to the left
+    cells of a track: contiguous non-VOID cells, FIRST flag on position 0 of the emulated tape
+    head block: head cells of all tracks, HEAD flag on the cell of the anchor track
+An emulated step:
+    READ   head block from left to right (a VOID head cell is a new empty cell)
+    WRITE  head block from right to left
+    SHIFT  every other track by delta(anchor) - delta(track): sweep through the track carrying one cell;
+           if a track shifted to the left hits the WALL, all tracks are shifted to the right by one block first
+    ANCHOR move HEAD flag by delta(anchor)
+Tracks are shifted lazily: moves in lockstep with the anchor cost O(T), the head span does not matter;
+a relative move costs O(length of the moved track). Tapes with long contents should be anchors,
+e.g. the emulated tape of UTM: steps of UTM then cost O(length of rules) instead of O(length of the emulated tape).
+Note: no one-tape emulation is faster than Omega(n^2) for all machines (e.g. palindromes need n^2 steps on one tape).
+
+So this is a special case for machines whose heads move in lockstep most of the time, not a replacement
+of MultitapeEmulator: when heads move independently (palindrome: the input and its copy are read
+in opposite directions; UTM on a machine with a short tape) every step shifts a long track,
+and the emulation takes more steps than MultitapeEmulator (see benchmark.SUITE). Choosing the anchor per step
+does not change that: both tracks that move relative to each other are long.
+"""
+
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass, replace
+from enum import Enum, IntEnum
+from typing import Any
+
+from multitape import DeltaType, MultitapeTuringMachine
+from turing_machine import TuringMachine
+
+
+class Mark(Enum):
+    VOID = 0  # not a cell of the emulated tape
+    WALL = 1  # left end of the real tape
+    def __repr__(self):
+        return self._name_
+
+
+@dataclass(frozen=True)
+class AlignedSym[SYM_]:
+    symbol: SYM_ | Mark
+    first: bool = False  # position 0 of the emulated tape
+    head: bool = False  # head cell of the anchor tape
+    def __repr__(self):
+        return '{}{}{}'.format('|' if self.first else '', self.symbol, '^' if self.head else '')
+
+
+VOID: AlignedSym[Any] = AlignedSym(Mark.VOID)
+WALL: AlignedSym[Any] = AlignedSym(Mark.WALL)
+
+
+class AlignedStateGroup(IntEnum):
+    START = 10  # find the head block
+    READ = 20
+    WRITE = 30
+    HALT = 31
+    SHIFT_RIGHT_FIND = 40  # find the left end of the track
+    SHIFT_RIGHT = 41
+    SHIFT_LEFT_FIND = 42  # find the right end of the track
+    SHIFT_LEFT = 43
+    ROOM_FIND = 50  # find the left end of the track after the WALL
+    ROOM_SHIFT = 51
+    ROOM_BACK = 52
+    RETURN_LEFT = 60  # back to the head block
+    RETURN_RIGHT = 61
+    ANCHOR = 70
+    ANCHOR_SET = 71
+    MOVE = 80  # move by several cells, then switch to the target state
+    def __repr__(self):
+        return self._name_
+
+type AlignedSt[ST] = tuple[AlignedStateGroup, ST, int, Any]  # int - tape index or count of moves
+type Transition[ST, SYM] = tuple[AlignedSym[SYM] | None, AlignedSt[ST] | None, AlignedSym[SYM] | None, DeltaType]
+
+
+class AlignedEmulator[ST, SYM]:
+    """
+    Emulate MTM using regular TM, head cells of all tapes are kept together (see the module docstring).
+    anchor - index of the tape that is never shifted, the best one is the tape with the longest contents.
+    Like MultitapeEmulator, assumes that all heads start at 0.
+    """
+
+    type AlignedTM[ST_, SYM_] = TuringMachine[AlignedSt[ST_], AlignedSym[SYM_]]
+    machine: AlignedTM[ST, SYM]
+
+    def __init__(self, multitape_machine: MultitapeTuringMachine[ST, SYM], anchor: int = 0) -> None:
+        if not 0 <= anchor < multitape_machine.tapes_count:
+            raise ValueError("Wrong anchor tape: {}".format(anchor))
+        self.tapes_count = multitape_machine.tapes_count
+        self.anchor = anchor
+        self.orig_empty_symbol = multitape_machine.empty_symbol
+        self.machine = self._get_machine(multitape_machine)
+
+    def _get_machine(self, multitape_machine: MultitapeTuringMachine[ST, SYM]) -> AlignedTM[ST, SYM]:
+        self._orig_rules = multitape_machine.rules
+        self._prefixes: dict[ST, set[tuple[SYM, ...]]] = {}
+        self._has_default_rule: set[ST] = set()
+        for orig_state, orig_symbols in multitape_machine.rules:
+            if orig_symbols is None:
+                self._has_default_rule.add(orig_state)
+            else:
+                prefixes = self._prefixes.setdefault(orig_state, set())
+                prefixes.update(orig_symbols[:length] for length in range(1, len(orig_symbols)))
+        self._cells = [
+            AlignedSym(symbol, first, head)
+            for symbol in multitape_machine.alphabet for first in (False, True) for head in (False, True)
+        ]
+
+        # only reachable states, rules are generated by _get_transitions
+        init_state: AlignedSt[ST] = (AlignedStateGroup.START, multitape_machine.init_state, 0, None)
+        rules: TuringMachine.RulesType[AlignedSt[ST], AlignedSym[SYM]] = {}
+        seen = {init_state}
+        queue = deque([init_state])
+        while queue:
+            state = queue.popleft()
+            for cell, new_state, new_cell, delta in self._get_transitions(state):
+                if new_state is None:
+                    continue
+                rules[state, cell] = (new_state, None if new_cell == cell else new_cell, delta)
+                if new_state not in seen:
+                    seen.add(new_state)
+                    queue.append(new_state)
+        return TuringMachine(rules=rules, init_state=init_state, empty_symbol=VOID)
+
+    def _pending(self, count: int, delta: DeltaType, target: AlignedSt[ST]) -> AlignedSt[ST]:
+        """State that makes count moves by delta, then switches to target."""
+        if count == 0:
+            return target
+        return (AlignedStateGroup.MOVE, target[1], count, (delta, target))
+
+    def _go(self, count: int, delta: DeltaType, target: AlignedSt[ST]) -> tuple[AlignedSt[ST], DeltaType]:
+        """New state and delta of a transition that starts moving by count cells to target."""
+        if count == 0:
+            return target, 0
+        return self._pending(count - 1, delta, target), delta
+
+    def _get_ops(self, deltas: tuple[DeltaType, ...]) -> tuple[tuple[int, DeltaType], ...]:
+        """Shifts of tracks by one block (track, direction of contents), the move of the anchor is the last one."""
+        anchor = self.anchor
+        ops: list[tuple[int, DeltaType]] = []
+        for track, delta in enumerate(deltas):
+            shift = deltas[anchor] - delta
+            if track != anchor and shift != 0:
+                ops.extend([(track, 1 if shift > 0 else -1)] * abs(shift))
+        if deltas[anchor] != 0:
+            ops.append((anchor, deltas[anchor]))
+        return tuple(ops)
+
+    def _get_ops_state(self, orig_state: ST, ops: tuple[tuple[int, DeltaType], ...]) -> AlignedSt[ST]:
+        """State in the first cell of the head block that does the ops and starts the next emulated step."""
+        G = AlignedStateGroup
+        if not ops:
+            return (G.READ, orig_state, 0, ())
+        (track, delta), rest = ops[0], ops[1:]
+        if track == self.anchor:
+            target = (G.ANCHOR, orig_state, track, (rest, delta))
+        elif delta > 0:
+            target = (G.SHIFT_RIGHT_FIND, orig_state, track, rest)
+        else:
+            target = (G.SHIFT_LEFT_FIND, orig_state, track, rest)
+        return self._pending(track, +1, target)
+
+    def _get_write_transition(
+            self, cell: AlignedSym[SYM], read_cell: AlignedSym[SYM], tape_index: int,
+            orig_state: ST, new_symbols: tuple[SYM | None, ...], deltas: tuple[DeltaType, ...], halt: bool,
+        ) -> Transition[ST, SYM]:
+        G = AlignedStateGroup
+        new_symbol = new_symbols[tape_index]
+        new_cell = read_cell if new_symbol is None else replace(read_cell, symbol=new_symbol)
+        # moving to the left from position 0: halt, but after all writes
+        halt = halt or (deltas[tape_index] == -1 and read_cell.first)
+        if tape_index > 0:
+            return cell, (G.WRITE, orig_state, tape_index - 1, (new_symbols, deltas, halt)), new_cell, -1
+        if halt:
+            return cell, (G.HALT, orig_state, 0, None), new_cell, 0
+        return cell, self._get_ops_state(orig_state, self._get_ops(deltas)), new_cell, 0
+
+    def _get_transitions(self, state: AlignedSt[ST]) -> list[Transition[ST, SYM]]:
+        G = AlignedStateGroup
+        T = self.tapes_count
+        group, orig_state, index, data = state
+        content_cells = self._cells
+        all_cells = content_cells + [VOID]
+
+        if group == G.MOVE:
+            delta, target = data
+            return [(None, self._pending(index - 1, delta, target), None, delta)]
+
+        if group == G.START:
+            next_state, delta = self._go(self.anchor, -1, (G.READ, orig_state, 0, ()))
+            return [(cell, next_state, None, delta) for cell in content_cells if cell.head] + [(None, state, None, +1)]
+
+        if group == G.READ:
+            result: list[Transition[ST, SYM]] = []
+            prefix = data
+            for cell in all_cells:
+                read_cell = AlignedSym(self.orig_empty_symbol) if cell == VOID else cell
+                new_prefix = None if prefix is None else prefix + (read_cell.symbol,)
+                if index < T - 1:
+                    if new_prefix is not None and new_prefix in self._prefixes.get(orig_state, ()):
+                        result.append((cell, (G.READ, orig_state, index + 1, new_prefix), read_cell, +1))
+                    elif orig_state in self._has_default_rule:
+                        result.append((cell, (G.READ, orig_state, index + 1, None), read_cell, +1))
+                    continue
+                rule = None if new_prefix is None else self._orig_rules.get((orig_state, new_prefix))
+                if rule is None:
+                    rule = self._orig_rules.get((orig_state, None))
+                if rule is not None:
+                    new_orig_state, new_symbols, deltas = rule
+                    result.append(self._get_write_transition(cell, read_cell, index, new_orig_state, new_symbols, deltas, False))
+            return result
+
+        if group == G.WRITE:
+            new_symbols, deltas, halt = data
+            return [self._get_write_transition(cell, cell, index, orig_state, new_symbols, deltas, halt) for cell in content_cells]
+
+        if group == G.HALT:
+            return []
+
+        if group in (G.RETURN_LEFT, G.RETURN_RIGHT):
+            next_state, delta = self._go(self.anchor, -1, self._get_ops_state(orig_state, data))
+            scan_delta = -1 if group == G.RETURN_LEFT else +1
+            return [(cell, next_state, None, delta) for cell in content_cells if cell.head] + [(None, state, None, scan_delta)]
+
+        if group == G.SHIFT_RIGHT_FIND:
+            # the head cell is not VOID: every step starts with reading the head block
+            sweep_state = (G.SHIFT_RIGHT, orig_state, index, (data, VOID))
+            return [
+                (VOID, self._pending(T - 1, +1, sweep_state), None, +1),
+                (WALL, self._pending(T - 1, +1, sweep_state), None, +1),
+                (None, self._pending(T - 1, -1, state), None, -1),
+            ]
+
+        if group == G.SHIFT_RIGHT:
+            rest, carry = data
+            result = [(VOID, (G.RETURN_LEFT, orig_state, 0, rest), carry, -1)]
+            for cell in content_cells:
+                result.append((cell, self._pending(T - 1, +1, (G.SHIFT_RIGHT, orig_state, index, (rest, cell))), carry, +1))
+            return result
+
+        if group == G.SHIFT_LEFT_FIND:
+            # the head cell may be VOID after the first of two shifts, the previous cell is not
+            sweep_state = (G.SHIFT_LEFT, orig_state, index, (data, None))
+            return [
+                (VOID, self._pending(T - 1, -1, sweep_state), None, -1),
+                (None, self._pending(T - 1, +1, state), None, +1),
+            ]
+
+        if group == G.SHIFT_LEFT:
+            rest, carry = data
+            if carry is None:  # the last cell of the track
+                return [
+                    (cell, self._pending(T - 1, -1, (G.SHIFT_LEFT, orig_state, index, (rest, cell))), VOID, -1)
+                    for cell in content_cells
+                ]
+            # no room before the WALL: shift all tracks (this one with the carried cell) to the right
+            others = tuple(track for track in range(T) if track != index)
+            room_state = (G.ROOM_SHIFT, orig_state, index, (rest, others, carry))
+            result = [
+                (VOID, (G.RETURN_RIGHT, orig_state, 0, rest), carry, +1),
+                (WALL, self._pending(T - 1, +1, room_state), None, +1),
+            ]
+            for cell in content_cells:
+                result.append((cell, self._pending(T - 1, -1, (G.SHIFT_LEFT, orig_state, index, (rest, cell))), carry, -1))
+            return result
+
+        if group == G.ROOM_FIND:
+            rest, others = data
+            result = [(VOID, self._pending(T - 1, +1, state), None, +1)]
+            for cell in content_cells:
+                result.append((cell, self._pending(T - 1, +1, (G.ROOM_SHIFT, orig_state, index, (rest, others, cell))), VOID, +1))
+            return result
+
+        if group == G.ROOM_SHIFT:
+            rest, others, carry = data
+            result = [(VOID, (G.ROOM_BACK, orig_state, 0, (rest, others)), carry, -1)]
+            for cell in content_cells:
+                result.append((cell, self._pending(T - 1, +1, (G.ROOM_SHIFT, orig_state, index, (rest, others, cell))), carry, +1))
+            return result
+
+        if group == G.ROOM_BACK:
+            # the first WALL cell from the right is the last cell of block 0
+            rest, others = data
+            if others:
+                track = others[0]
+                next_state = self._pending(track, +1, (G.ROOM_FIND, orig_state, track, (rest, others[1:])))
+            else:
+                next_state = (G.RETURN_RIGHT, orig_state, 0, rest)
+            return [(WALL, next_state, None, +1), (None, state, None, -1)]
+
+        if group == G.ANCHOR:
+            rest, delta = data
+            set_state = (G.ANCHOR_SET, orig_state, index, rest)
+            return [(cell, self._pending(T - 1, delta, set_state), replace(cell, head=False), delta) for cell in content_cells if cell.head]
+
+        if group == G.ANCHOR_SET:
+            next_state, delta = self._go(self.anchor, -1, self._get_ops_state(orig_state, data))
+            return [
+                (cell, next_state, AlignedSym(self.orig_empty_symbol, head=True) if cell == VOID else replace(cell, head=True), delta)
+                for cell in all_cells
+            ]
+
+        raise ValueError("Unknown state: {}".format(state))
+
+    def encode_tapes(self, tapes: Sequence[list[SYM]], padding: int | None = None) -> list[AlignedSym[SYM]]:
+        """
+        Converts to one tape and sets heads = 0.
+        padding - VOID blocks before the tracks (default: total length of the tapes), tracks shifted to the left
+        further than that make all tracks shift, which is slow.
+        """
+        T = self.tapes_count
+        if len(tapes) != T:
+            raise ValueError("Wrong number of tapes, expected: {}, got: {}".format(T, len(tapes)))
+        tapes_list = [list(tape) or [self.orig_empty_symbol] for tape in tapes]
+        if padding is None:
+            padding = sum(len(tape) for tape in tapes_list)
+
+        result_tape = [WALL] * T + [VOID] * (T * padding)
+        for symbol_index in range(max(len(tape) for tape in tapes_list)):
+            for tape_index, tape in enumerate(tapes_list):
+                if symbol_index < len(tape):
+                    is_head = (symbol_index == 0 and tape_index == self.anchor)
+                    result_tape.append(AlignedSym(tape[symbol_index], symbol_index == 0, is_head))
+                else:
+                    result_tape.append(VOID)
+        return result_tape
+
+    def decode_tape(self, tape: list[AlignedSym[SYM]]) -> list[list[SYM]]:
+        tapes: list[list[SYM]] = [[] for _ in range(self.tapes_count)]
+        for index, cell in enumerate(tape):
+            if not isinstance(cell.symbol, Mark):
+                tapes[index % self.tapes_count].append(cell.symbol)
+        return tapes
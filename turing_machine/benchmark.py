@@ -0,0 +1,264 @@
+"""
+Benchmark suite for machines and transformations (see pipelines.py).
+
+For every case (machine, pipeline, input size) measures: build time of the pipeline, rules and states
+of the machine that actually runs, steps, run time (best of several repeats), steps per second,
+final tape length and peak memory of the run (measured in a separate run under tracemalloc).
+
+Results are written as JSON and can be compared with a stored baseline:
+    python benchmark.py --output bench.json                         # run and save
+    python benchmark.py --baseline bench.json --threshold seconds=0.3  # fail on regressions
+Deterministic metrics (steps, rules, states, tape length) must not grow at all by default,
+time and memory may grow by the threshold (relative).
+"""
+
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from typing import Any
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+
+import examples
+from pipelines import Pipeline, Tapes, SINGLE_TAPE_PIPELINES, MULTITAPE_PIPELINES
+
+
+FORMAT_VERSION = 1
+
+PIPELINES: dict[str, type[Pipeline]] = {cls.name: cls for cls in SINGLE_TAPE_PIPELINES + MULTITAPE_PIPELINES}
+
+# metric -> allowed relative growth; metrics not listed are not compared
+DEFAULT_THRESHOLDS = {
+    'steps': 0.0,
+    'rules': 0.0,
+    'states': 0.0,
+    'tape_length': 0.0,
+    'seconds': 0.25,
+    'build_seconds': 0.5,
+    'peak_memory': 0.25,
+}
+TIME_METRICS = ('seconds', 'build_seconds')
+MIN_SECONDS = 0.01  # shorter times are too noisy to compare
+
+
+@dataclass
+class BenchmarkCase:
+    name: str
+    machine_factory: Callable[[], Any]
+    make_input: Callable[[int], Tapes]
+    sizes: dict[str, list[int]]  # pipeline name -> input sizes
+
+
+@dataclass
+class BenchmarkResult:
+    case: str
+    pipeline: str
+    size: int
+    build_seconds: float
+    rules: int
+    states: int
+    steps: int
+    seconds: float
+    steps_per_second: float
+    tape_length: int
+    peak_memory: int  # bytes allocated at peak during the run, 0 if not measured
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        return (self.case, self.pipeline, self.size)
+
+
+@dataclass
+class Regression:
+    key: tuple[str, str, int]
+    metric: str
+    baseline: float
+    current: float
+
+    def __str__(self) -> str:
+        case, pipeline, size = self.key
+        return '{}/{}/{}: {} {} -> {} (x{:.2f})'.format(
+            case, pipeline, size, self.metric, self.baseline, self.current, self.current / self.baseline if self.baseline else float('inf'))
+
+
+def _get_add_machine():
+    return examples.AddMachineWrapper().machine
+
+
+def _get_add_input(size: int) -> Tapes:
+    # two numbers with size bits each
+    return [examples.AddMachineWrapper.encode((1 << size) - 1, 1 << (size - 1))]
+
+
+def _get_copy1_input(size: int) -> Tapes:
+    return [[1] * size]
+
+
+def _get_palindrome_input(size: int) -> Tapes:
+    # palindromes are the slowest inputs: the machine compares all symbols
+    half = ['abc'[index % 3] for index in range(size // 2)]
+    return [['*'] + half + half[::-1], [], []]
+
+
+SUITE = [
+    BenchmarkCase('add', _get_add_machine, _get_add_input, {
+        'plain': [8, 32, 64],
+        'binarized': [8, 32, 64],
+    }),
+    # aligned emulators (onetape_aligned_utm, aligned_emulator) are a special case for heads moving in lockstep:
+    # on copy1 and palindrome heads move independently and they take more steps than the interleaved emulators
+    BenchmarkCase('copy1', examples.get_copy1_machine, _get_copy1_input, {
+        'plain': [4, 16, 64],
+        'binarized': [4, 16, 64],
+        'utm': [4, 8, 16],
+        'onetape_utm': [1, 2],
+        'onetape_aligned_utm': [1, 2],
+    }),
+    # UTM on a machine with a long tape: heads of UTM move in lockstep, the case where aligned emulation wins
+    BenchmarkCase('unary', examples.get_unary_increment_machine, _get_copy1_input, {
+        'utm': [16, 64, 128],
+        'onetape_utm': [16, 64, 128],
+        'onetape_aligned_utm': [16, 64, 128],
+    }),
+    BenchmarkCase('palindrome', examples.get_abc_palyndrome_machine, _get_palindrome_input, {
+        'multitape': [16, 64, 128],
+        'emulator': [16, 64, 128],
+        'aligned_emulator': [16, 64, 128],
+    }),
+]
+
+
+def _measure_build(case: BenchmarkCase, pipeline_name: str) -> tuple[Pipeline, float]:
+    pipeline = PIPELINES[pipeline_name](case.machine_factory())
+    start = time.perf_counter()
+    pipeline.build()
+    return pipeline, time.perf_counter() - start
+
+
+def run_suite(
+        suite: Sequence[BenchmarkCase] = SUITE,
+        repeat: int = 3,
+        max_size: int | None = None,
+        measure_memory: bool = True,
+    ) -> list[BenchmarkResult]:
+    """Run all cases. max_size - skip larger inputs (for quick runs)."""
+    results = []
+    for case in suite:
+        for pipeline_name, sizes in case.sizes.items():
+            pipeline, build_seconds = _measure_build(case, pipeline_name)
+            rules = pipeline.machine.rules
+            states = len(set(state for state, _ in rules))
+            for size in sizes:
+                if max_size is not None and size > max_size:
+                    continue
+                tapes = case.make_input(size)
+                seconds = float('inf')
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run = pipeline.run(tapes)
+                    seconds = min(seconds, time.perf_counter() - start)
+
+                peak_memory = 0
+                if measure_memory:
+                    tracemalloc.start()
+                    pipeline.run(tapes)
+                    _, peak_memory = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                result = BenchmarkResult(
+                    case=case.name, pipeline=pipeline_name, size=size,
+                    build_seconds=build_seconds, rules=len(rules), states=states,
+                    steps=run.steps, seconds=seconds, steps_per_second=run.steps / seconds if seconds else 0.0,
+                    tape_length=run.tape_length, peak_memory=peak_memory,
+                )
+                logging.info('%s/%s/%d: %d steps, %.3f s', case.name, pipeline_name, size, run.steps, seconds)
+                results.append(result)
+    return results
+
+
+def save_results(path: str, results: Sequence[BenchmarkResult]) -> None:
+    data = {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [asdict(result) for result in results],
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=1)
+
+
+def load_results(path: str) -> list[BenchmarkResult]:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('version') != FORMAT_VERSION:
+        raise ValueError("Unsupported benchmark results version in {}".format(path))
+    return [BenchmarkResult(**result) for result in data['results']]
+
+
+def compare(
+        current: Sequence[BenchmarkResult],
+        baseline: Sequence[BenchmarkResult],
+        thresholds: dict[str, float] = DEFAULT_THRESHOLDS,
+    ) -> list[Regression]:
+    """Metrics that grew more than allowed (relative to the baseline). Cases missing in the baseline are ignored."""
+    baseline_by_key = {result.key: result for result in baseline}
+    regressions = []
+    for result in current:
+        old = baseline_by_key.get(result.key)
+        if old is None:
+            continue
+        for metric, threshold in thresholds.items():
+            old_value, new_value = getattr(old, metric), getattr(result, metric)
+            if metric in TIME_METRICS and new_value < MIN_SECONDS:
+                continue
+            if new_value > old_value * (1 + threshold):
+                regressions.append(Regression(result.key, metric, old_value, new_value))
+    return regressions
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    lines = ['{:<12}{:<21}{:>6}{:>8}{:>8}{:>12}{:>10}{:>12}{:>12}'.format(
+        'case', 'pipeline', 'size', 'rules', 'states', 'steps', 'seconds', 'steps/s', 'memory')]
+    for r in results:
+        lines.append('{:<12}{:<21}{:>6}{:>8}{:>8}{:>12}{:>10.4f}{:>12.0f}{:>12}'.format(
+            r.case, r.pipeline, r.size, r.rules, r.states, r.steps, r.seconds, r.steps_per_second, r.peak_memory))
+    return '\n'.join(lines)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results in this JSON file')
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=VALUE',
+                        help='allowed relative growth of the metric, e.g. seconds=0.3')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-size', type=int, help='skip larger inputs')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    args = parser.parse_args(argv)
+
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for item in args.threshold:
+        metric, value = item.split('=')
+        if metric not in BenchmarkResult.__dataclass_fields__:
+            parser.error('unknown metric: {}'.format(metric))
+        thresholds[metric] = float(value)
+
+    results = run_suite(repeat=args.repeat, max_size=args.max_size, measure_memory=not args.no_memory)
+    print(format_results(results))
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), thresholds)
+        for regression in regressions:
+            print('regression:', regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import itertools
-from collections.abc import Sequence
+from collections.abc import Iterable, Iterator, Sequence
 import logging
 from typing import Literal, Any
 from enum import Enum
@@ -53,6 +53,10 @@ class BinEncoder[ST, SYM]:
 
         self.orig_machine = machine
 
+        # precomputed blocks for streaming encode/decode
+        self._symbol_blocks = {symbol: tuple(self._encode_symbol(symbol)) for symbol in self.alphabet}
+        self._block_symbols = {block: symbol for symbol, block in self._symbol_blocks.items()}
+
     def _encode_symbol(self, symbol: SYM) -> list[Bit]:
         index = self.symbol_index[symbol]
         return list(map(int, self.formatter.format(index)))  # type: ignore
@@ -62,17 +66,23 @@ class BinEncoder[ST, SYM]:
         return self.alphabet[index]
 
     def encode_input(self, tape: list[SYM]) -> list[Bit]:
-        return sum((self._encode_symbol(s) for s in tape), start=[])
+        return list(self.iter_encode_input(tape))
 
     def decode_output(self, tape: list[Bit]) -> list[SYM]:
-        result = []
-        start = 0
-        b = self.block_size
-        while start + b <= len(tape):
-            block = tape[start:(start + b)]
-            result.append(self._decode_symbol(block))
-            start += b
-        return result
+        return list(self.iter_decode_output(tape))
+
+    def iter_encode_input(self, tape: Iterable[SYM]) -> Iterator[Bit]:
+        """Streaming version of encode_input."""
+        symbol_blocks = self._symbol_blocks
+        for symbol in tape:
+            yield from symbol_blocks[symbol]
+
+    def iter_decode_output(self, tape: Iterable[Bit]) -> Iterator[SYM]:
+        """Streaming version of decode_output: incomplete last block is ignored."""
+        block_symbols = self._block_symbols
+        for block in zip(*[iter(tape)] * self.block_size):
+            symbol = block_symbols.get(block)
+            yield symbol if symbol is not None else self._decode_symbol(block)
 
     def encode_machine(self) -> TuringMachine[BinState[ST], Bit]:
         G = BinStateGroup
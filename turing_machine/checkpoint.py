@@ -0,0 +1,213 @@
+"""
+Binary checkpoints of in-flight machine runs.
+
+Checkpoint layout (little-endian):
+    header: magic, version, halt flag, tapes count, step
+    symbol table (pickled list, written once) and the current state (pickled)
+    for each tape: head, length and zlib-compressed array of symbol codes
+Tape symbols are interned: the tape is packed as array of indices into the symbol table.
+
+WARNING: the state and the symbol table are pickled, so loading a checkpoint (load_checkpoint, resume)
+can run arbitrary code stored in the file. Load only checkpoints written by yourself.
+
+CheckpointedRun is the run loop of TuringMachine and MultitapeTuringMachine with periodic checkpoints,
+snapshot() and resume().
+"""
+
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Callable, Hashable, Iterable, MutableSequence, Sequence
+from dataclasses import dataclass
+from typing import Any
+import logging
+import os
+import pickle
+import struct
+import zlib
+
+
+MAGIC = b'TMCK'
+VERSION = 1
+_HEADER = struct.Struct('<4sBBHQ')
+_BLOCK = struct.Struct('<QQQ')  # head, tape length, compressed size
+_SIZE = struct.Struct('<Q')
+
+
+class SymbolTable[T: Hashable]:
+    """Interns hashable values into consecutive integer codes."""
+
+    def __init__(self, values: Iterable[T] = ()) -> None:
+        self.values: list[T] = []
+        self.codes: dict[T, int] = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value: T) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def typecode(self) -> str:
+        """Smallest array typecode that fits all codes."""
+        if len(self.values) <= 1 << 8:
+            return 'B'
+        if len(self.values) <= 1 << 16:
+            return 'H'
+        return 'I'
+
+    def unpack(self, codes: Iterable[int]) -> list[T]:
+        values = self.values
+        return [values[code] for code in codes]
+
+
+@dataclass
+class Checkpoint[ST, SYM]:
+    state: ST
+    tapes: list[list[SYM]]
+    heads: list[int]
+    step: int  # number of steps already made
+    halt: bool
+
+
+def save_checkpoint[ST, SYM](
+        path: str,
+        state: ST,
+        tapes: Sequence[Iterable[SYM]],
+        heads: Sequence[int],
+        step: int,
+        halt: bool,
+    ) -> None:
+    """Write checkpoint atomically: a crash during write keeps the previous checkpoint intact."""
+    table: SymbolTable[SYM] = SymbolTable()
+    codes_list = [[table.add(symbol) for symbol in tape] for tape in tapes]
+    packed = [array(table.typecode, codes) for codes in codes_list]  # typecode is known after all symbols are added
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, halt, len(tapes), step))
+        for obj in table.values, state:
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(_SIZE.pack(len(data)))
+            f.write(data)
+        for head, codes in zip(heads, packed):
+            data = zlib.compress(codes.tobytes())
+            f.write(_BLOCK.pack(head, len(codes), len(data)))
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """Read checkpoint. Unpickles the state and the symbols: never load a file from an untrusted source."""
+    with open(path, 'rb') as f:
+        magic, version, halt, tapes_count, step = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a checkpoint file (or unsupported version): {}".format(path))
+
+        def read_object():
+            size, = _SIZE.unpack(f.read(_SIZE.size))
+            return pickle.loads(f.read(size))
+
+        table = SymbolTable(read_object())
+        state = read_object()
+        tapes = []
+        heads = []
+        for _ in range(tapes_count):
+            head, length, size = _BLOCK.unpack(f.read(_BLOCK.size))
+            codes = array(table.typecode)
+            codes.frombytes(zlib.decompress(f.read(size)))
+            if len(codes) != length:
+                raise ValueError("Corrupted checkpoint: {}".format(path))
+            tapes.append(table.unpack(codes))
+            heads.append(head)
+
+    return Checkpoint(state=state, tapes=tapes, heads=heads, step=step, halt=bool(halt))
+
+
+class CheckpointedRun[SYM](ABC):
+    """
+    Run loop shared by machines: steps until halt or max_steps, saves a checkpoint every checkpoint_every steps.
+    A machine defines tapes_count, _next() (one step, sets halt) and access to its tapes:
+    _get_tapes() -> (tapes, heads), _set_tapes(tapes, heads) and _result() (what run() returns).
+    """
+
+    tapes_count: int
+    state: Any
+    halt: bool
+    steps: int
+
+    @abstractmethod
+    def _next(self) -> None:
+        ...
+
+    @abstractmethod
+    def _get_tapes(self) -> tuple[Sequence[MutableSequence[SYM]], list[int]]:
+        ...
+
+    @abstractmethod
+    def _set_tapes(self, tapes: list[MutableSequence[SYM]], heads: list[int]) -> None:
+        ...
+
+    @abstractmethod
+    def _result(self) -> Any:
+        ...
+
+    def resume(self,
+            checkpoint_path: str,
+            max_steps: int | None = None,  # total steps, including steps made before snapshot
+            tape_type: Callable[[Iterable[SYM]], MutableSequence[SYM]] = list,
+            checkpoint_every: int | None = None,
+        ) -> Any:
+        """
+        Continue the run saved by snapshot(). Returns the same as run().
+        The checkpoint is unpickled (see load_checkpoint): resume only from trusted files.
+        """
+        checkpoint = load_checkpoint(checkpoint_path)
+        if len(checkpoint.tapes) != self.tapes_count:
+            raise ValueError("Wrong number of tapes in checkpoint, expected: {}, got: {}".format(self.tapes_count, len(checkpoint.tapes)))
+        self.halt = checkpoint.halt
+        self.state = checkpoint.state
+        self._set_tapes([tape_type(tape) for tape in checkpoint.tapes], checkpoint.heads)
+        if self.halt:
+            self.steps = checkpoint.step
+            return self._result()
+        return self._run_loop(checkpoint.step, max_steps, checkpoint_path, checkpoint_every)
+
+    def snapshot(self, checkpoint_path: str) -> None:
+        """Save current configuration of the run to the file."""
+        done_steps = self.steps if self.halt else self.steps - 1
+        self._save(checkpoint_path, done_steps)
+
+    def _save(self, checkpoint_path: str, done_steps: int) -> None:
+        tapes, heads = self._get_tapes()
+        save_checkpoint(checkpoint_path, self.state, tapes, heads, done_steps, self.halt)
+
+    def _run_loop(self,
+            step: int,
+            max_steps: int | None,
+            checkpoint_path: str | None,
+            checkpoint_every: int | None,
+        ) -> Any:
+        if (checkpoint_every is not None) and (checkpoint_path is None):
+            raise ValueError("checkpoint_path required for periodic checkpoints")
+        if (checkpoint_every is not None) and (checkpoint_every <= 0):
+            raise ValueError("checkpoint_every must be positive, got: {}".format(checkpoint_every))
+
+        while not self.halt:
+            step += 1
+            if (max_steps is not None) and (step > max_steps):
+                break
+            logging.debug('=======')
+            logging.debug('step: %d', step)
+            self._next()
+            if (checkpoint_every is not None) and (step % checkpoint_every == 0):
+                self._save(checkpoint_path, step)  # type: ignore
+
+        self.steps = step
+        return self._result()
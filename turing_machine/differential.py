@@ -0,0 +1,233 @@
+"""
+Differential testing of machine transformations.
+
+Every input is run through several pipelines (see pipelines.py) in a pool of worker processes,
+decoded outputs are compared with the reference pipeline (the first one) and step counts are collected.
+Mismatching inputs are shrunk to minimal counterexamples (delta debugging: remove chunks of cells,
+replace cells with symbols that appear earlier in the input).
+
+The machine is given as a factory (module-level function) because workers build pipelines themselves:
+transformed machines are large and slow to pickle, and example machines may be unpicklable.
+"""
+
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+import logging
+import multiprocessing
+import random
+import statistics
+
+from pipelines import MachineFactory, Pipeline, Tapes, build_pipelines, default_pipelines
+
+
+@dataclass
+class Mismatch[SYM]:
+    input: Tapes[SYM]
+    outputs: dict[str, object]  # pipeline name -> output tapes or error description
+    shrunk: Tapes[SYM] | None = None
+    shrunk_outputs: dict[str, object] | None = None
+
+
+@dataclass
+class DifferentialReport[SYM]:
+    pipelines: list[str]
+    cases: int = 0
+    skipped: int = 0  # the reference pipeline did not halt within max_steps
+    mismatches: list[Mismatch[SYM]] = field(default_factory=list)
+    steps: dict[str, list[int]] = field(default_factory=dict)  # for every compared case
+
+    def ratios(self) -> dict[str, tuple[float, float, float]]:
+        """Step count ratio to the reference pipeline: min, mean, max."""
+        reference = self.steps[self.pipelines[0]]
+        result = {}
+        for name in self.pipelines[1:]:
+            ratios = [steps / ref_steps for steps, ref_steps in zip(self.steps[name], reference) if steps and ref_steps]
+            if ratios:
+                result[name] = (min(ratios), statistics.fmean(ratios), max(ratios))
+        return result
+
+    def summary(self) -> str:
+        lines = ['cases: {}, skipped: {}, mismatches: {}'.format(self.cases, self.skipped, len(self.mismatches))]
+        for name, (low, mean, high) in self.ratios().items():
+            lines.append('  {} / {} steps: min {:.1f}, mean {:.1f}, max {:.1f}'.format(name, self.pipelines[0], low, mean, high))
+        for mismatch in self.mismatches:
+            lines.append('  mismatch on {!r}, shrunk to {!r}'.format(mismatch.input, mismatch.shrunk))
+        return '\n'.join(lines)
+
+
+@dataclass
+class _CaseResult:
+    outputs: dict[str, object]
+    steps: dict[str, int]
+    mismatch: bool
+
+
+def _run_case(pipelines: Sequence[Pipeline], tapes: Tapes, max_steps: int | None, pipeline_max_steps: int | None) -> _CaseResult | None:
+    """Returns None if the reference pipeline does not halt."""
+    reference, *others = pipelines
+    result = reference.run(tapes, max_steps=max_steps)
+    if not result.halt:
+        return None
+    outputs: dict[str, object] = {reference.name: result.output}
+    steps = {reference.name: result.steps}
+    for pipeline in others:
+        try:
+            result = pipeline.run(tapes, max_steps=pipeline_max_steps)
+        except Exception as e:
+            outputs[pipeline.name] = 'error: {!r}'.format(e)
+            steps[pipeline.name] = 0
+            continue
+        outputs[pipeline.name] = result.output if result.halt else 'no halt in {} steps'.format(pipeline_max_steps)
+        steps[pipeline.name] = result.steps
+    mismatch = any(output != outputs[reference.name] for output in outputs.values())
+    return _CaseResult(outputs, steps, mismatch)
+
+
+# worker process state, see _init_worker
+_worker_pipelines: list[Pipeline] = []
+_worker_limits: tuple[int | None, int | None] = (None, None)
+
+
+def _init_worker(
+        machine_factory: MachineFactory,
+        pipeline_types: Sequence[type[Pipeline]],
+        max_steps: int | None,
+        pipeline_max_steps: int | None,
+    ) -> None:
+    global _worker_pipelines, _worker_limits
+    _worker_pipelines = build_pipelines(machine_factory, pipeline_types)
+    _worker_limits = (max_steps, pipeline_max_steps)
+
+
+def _worker_run_case(tapes: Tapes) -> tuple[Tapes, _CaseResult | None]:
+    return tapes, _run_case(_worker_pipelines, tapes, *_worker_limits)
+
+
+def shrink[SYM](tapes: Tapes[SYM], is_failing: Callable[[Tapes[SYM]], bool]) -> Tapes[SYM]:
+    """
+    Greedy minimization of a failing input: repeatedly try to remove chunks of cells
+    (from halves down to single cells) and to replace cells with symbols appearing earlier in the input.
+    """
+    order: dict[SYM, int] = {}
+    for tape in tapes:
+        for symbol in tape:
+            order.setdefault(symbol, len(order))
+    simpler = sorted(order, key=order.__getitem__)
+
+    tapes = [list(tape) for tape in tapes]
+    changed = True
+    while changed:
+        changed = False
+        for index in range(len(tapes)):
+            chunk = max(len(tapes[index]) // 2, 1)
+            while chunk >= 1:
+                start = 0
+                while start < len(tapes[index]):
+                    candidate = tapes.copy()
+                    candidate[index] = tapes[index][:start] + tapes[index][start + chunk:]
+                    if is_failing(candidate):
+                        tapes = candidate
+                        changed = True
+                    else:
+                        start += chunk
+                chunk //= 2
+
+            for position in range(len(tapes[index])):
+                for symbol in simpler[:order[tapes[index][position]]]:
+                    candidate = tapes.copy()
+                    candidate[index] = tapes[index].copy()
+                    candidate[index][position] = symbol
+                    if is_failing(candidate):
+                        tapes = candidate
+                        changed = True
+                        break
+    return tapes
+
+
+def run_differential[SYM](
+        machine_factory: MachineFactory,
+        inputs: Iterable[Tapes[SYM]],
+        pipeline_types: Sequence[type[Pipeline]] | None = None,
+        max_steps: int | None = None,
+        pipeline_max_steps: int | None = None,
+        processes: int | None = None,
+        chunksize: int = 16,
+        is_valid: Callable[[Tapes[SYM]], bool] | None = None,
+        shrink_mismatches: bool = True,
+    ) -> DifferentialReport[SYM]:
+    """
+    Run every input (list of tapes of the original machine) through all pipelines and compare outputs.
+    pipeline_types - pipelines to compare (default: all applicable), the first one is the reference
+    max_steps - limit for the reference pipeline, inputs on which it does not halt are skipped
+    pipeline_max_steps - limit for the other pipelines (not halting is a mismatch), no limit by default
+    processes - number of worker processes (default: cpu count), 1 runs everything in this process
+    is_valid - predicate restricting inputs considered while shrinking
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if pipeline_types is None:
+        pipeline_types = default_pipelines(machine_factory())  # type: ignore
+
+    local_pipelines: list[Pipeline] = []
+
+    def get_local_pipelines() -> list[Pipeline]:
+        if not local_pipelines:
+            local_pipelines.extend(build_pipelines(machine_factory, pipeline_types))
+        return local_pipelines
+
+    def results() -> Iterator[tuple[Tapes[SYM], _CaseResult | None]]:
+        if processes == 1:
+            pipelines = get_local_pipelines()
+            for tapes in inputs:
+                yield tapes, _run_case(pipelines, tapes, max_steps, pipeline_max_steps)
+            return
+        initargs = (machine_factory, pipeline_types, max_steps, pipeline_max_steps)
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            yield from pool.imap(_worker_run_case, inputs, chunksize=chunksize)
+
+    report: DifferentialReport[SYM] = DifferentialReport(pipelines=[pipeline_type.name for pipeline_type in pipeline_types])
+    report.steps = {name: [] for name in report.pipelines}
+    for tapes, result in results():
+        report.cases += 1
+        if result is None:
+            report.skipped += 1
+            continue
+        for name, steps in result.steps.items():
+            report.steps[name].append(steps)
+        if result.mismatch:
+            logging.debug('mismatch on %r: %r', tapes, result.outputs)
+            report.mismatches.append(Mismatch(input=tapes, outputs=result.outputs))
+
+    if shrink_mismatches and report.mismatches:
+        pipelines = get_local_pipelines()
+
+        def is_failing(tapes: Tapes[SYM]) -> bool:
+            if is_valid is not None and not is_valid(tapes):
+                return False
+            result = _run_case(pipelines, tapes, max_steps, pipeline_max_steps)
+            return result is not None and result.mismatch
+
+        for mismatch in report.mismatches:
+            mismatch.shrunk = shrink(mismatch.input, is_failing)
+            mismatch.shrunk_outputs = _run_case(pipelines, mismatch.shrunk, max_steps, pipeline_max_steps).outputs  # type: ignore
+
+    return report
+
+
+def random_inputs[SYM](
+        alphabets: Sequence[Sequence[SYM]],
+        count: int,
+        max_length: int,
+        prefixes: Sequence[Sequence[SYM]] | None = None,
+        seed: int = 0,
+    ) -> Iterator[Tapes[SYM]]:
+    """Random inputs: for every tape a random word over its alphabet (empty alphabet - empty tape) after the prefix."""
+    rng = random.Random(seed)
+    if prefixes is None:
+        prefixes = [[] for _ in alphabets]
+    for _ in range(count):
+        tapes = []
+        for alphabet, prefix in zip(alphabets, prefixes):
+            length = rng.randint(0, max_length) if alphabet else 0
+            tapes.append(list(prefix) + [rng.choice(alphabet) for _ in range(length)])
+        yield tapes
@@ -0,0 +1,271 @@
+"""
+Enumeration of all small machines: n states, k symbols (busy-beaver-style sweeps).
+
+Machines are generated in tree normal form: transitions are defined only when the run reaches them,
+and a new state/symbol may only be the next unused one. So every machine is generated once up to
+relabeling of states and non-empty symbols, and transitions that are never reached are not enumerated.
+A child machine continues the run of its parent from the configuration where the undefined transition was met.
+
+Runs use a compiled form of the machine: flat integer transition table and bytearray tape.
+Runs are pruned as soon as they are classified (see Status). The tree is split into subtrees
+which are processed by worker processes; results are streamed to a compact binary file.
+
+Machine conventions are the same as for TuringMachine: state 0 is initial, symbol 0 is empty,
+machine halts on undefined transition or when head leaves the tape.
+"""
+
+from collections import Counter
+from collections.abc import Iterator
+from dataclasses import dataclass
+from enum import IntEnum
+import multiprocessing
+import struct
+
+from turing_machine import TuringMachine
+
+
+class Status(IntEnum):
+    HALT = 0  # undefined transition
+    OUT_OF_TAPE = 1  # head moved to the left of the tape (halts too)
+    ESCAPE = 2  # on the blank part of the tape and moves right forever
+    CYCLE = 3  # configuration repeats
+    TRANSLATED_CYCLE = 4  # configuration repeats shifted to the right, see _simulate
+    LIMIT = 5  # max_steps reached, not classified
+
+    def __repr__(self):
+        return self._name_
+
+
+# transition is packed to int: (new_state * k + new_symbol) * 2 + (delta == +1); undefined is -1
+type Table = list[int]
+
+MAGIC = b'TMEN'
+_HEADER = struct.Struct('<4sBBQ')
+_RECORD = struct.Struct('<BQQ')  # status, steps, number of non-empty cells
+
+
+@dataclass
+class Result:
+    table: Table
+    status: Status
+    steps: int
+    nonempty: int
+
+
+@dataclass
+class _Node:
+    table: Table
+    used_states: int
+    used_symbols: int
+    tape: bytearray
+    head: int
+    state: int
+    steps: int
+    extent: int  # cells [0, extent) were visited, the rest of the tape is empty
+
+
+def _escapes(table: Table, k: int, state: int) -> bool:
+    """Whether machine standing on the empty part of the tape moves right forever."""
+    seen = set()
+    while state not in seen:
+        seen.add(state)
+        packed = table[state * k]
+        if packed < 0 or packed % 2 == 0:
+            return False
+        state = packed // 2 // k
+    return True
+
+
+def _simulate(node: _Node, k: int, max_steps: int) -> Status | None:
+    """
+    Continue the run of the node in place. Returns status or None if undefined transition is met.
+
+    Translated cycles: let at steps t1 < t2 the head visit new cells h1 < h2 in the same state,
+    and let m be the leftmost head position between t1 and t2. If the tape segments of length
+    L = h1 - m to the left of the head are equal, the run from t2 repeats the run from t1 shifted by h2 - h1.
+    """
+    table = node.table
+    tape = node.tape
+    head, state, steps, extent = node.head, node.state, node.steps, node.extent
+    status = None
+
+    # Brent's cycle detection: compare with configuration saved at steps 2^j (only saving copies the tape);
+    # the extent only grows, so the tapes are equal iff the saved cells are equal (prefix comparison,
+    # without copies) and the cells visited after saving are empty
+    saved_state, saved_head, saved_extent, saved_tape = state, head, extent, bytes(tape[:extent])
+    power = lam = 1
+
+    # state -> [head, tape to the left of head, leftmost head since then] when new cell was visited
+    new_cell_records: dict[int, list] = {}
+    segment_min = head  # leftmost head since the last new cell
+
+    while True:
+        if steps >= max_steps:
+            status = Status.LIMIT
+            break
+        packed = table[state * k + tape[head]]
+        if packed < 0:
+            break
+        steps += 1
+        move = packed & 1
+        packed >>= 1
+        state, tape[head] = divmod(packed, k)
+        if move:
+            head += 1
+            if head == extent:
+                extent += 1
+                if head == len(tape):
+                    tape.extend(bytes(len(tape)))
+                if _escapes(table, k, state):
+                    status = Status.ESCAPE
+                    break
+                for record in new_cell_records.values():
+                    record[2] = min(record[2], segment_min)
+                record = new_cell_records.get(state)
+                if record is not None:
+                    length = record[0] - record[2]
+                    if record[1][len(record[1]) - length:] == tape[head - length:head]:
+                        status = Status.TRANSLATED_CYCLE
+                        break
+                new_cell_records[state] = [head, bytes(tape[:head]), head]
+                segment_min = head
+        elif head == 0:
+            status = Status.OUT_OF_TAPE
+            break
+        else:
+            head -= 1
+            if head < segment_min:
+                segment_min = head
+
+        if state == saved_state and head == saved_head and tape.startswith(saved_tape) \
+                and (extent == saved_extent or tape.count(0, saved_extent, extent) == extent - saved_extent):
+            status = Status.CYCLE
+            break
+        if lam == power:
+            saved_state, saved_head, saved_extent, saved_tape = state, head, extent, bytes(tape[:extent])
+            power *= 2
+            lam = 0
+        lam += 1
+
+    node.head, node.state, node.steps, node.extent = head, state, steps, extent
+    return status
+
+
+def _children(node: _Node, states: int, symbols: int) -> Iterator[_Node]:
+    index = node.state * symbols + node.tape[node.head]
+    for new_state in range(min(states, node.used_states + 1)):
+        for new_symbol in range(min(symbols, node.used_symbols + 1)):
+            for move in (0, 1):
+                table = node.table.copy()
+                table[index] = ((new_state * symbols + new_symbol) << 1) | move
+                yield _Node(
+                    table=table,
+                    used_states=max(node.used_states, new_state + 1),
+                    used_symbols=max(node.used_symbols, new_symbol + 1),
+                    tape=node.tape.copy(),
+                    head=node.head,
+                    state=node.state,
+                    steps=node.steps,
+                    extent=node.extent,
+                )
+
+
+def _pack_record(node: _Node, status: Status) -> bytes:
+    table_bytes = bytes(packed + 1 for packed in node.table)
+    nonempty = len(node.tape) - node.tape.count(0)
+    return _RECORD.pack(status, node.steps, nonempty) + table_bytes
+
+
+def _expand(node: _Node, states: int, symbols: int, max_steps: int, max_nodes: int | None = None) -> tuple[bytes, list[_Node]]:
+    """
+    Depth-first search in the subtree of node. Returns packed results and unexpanded nodes
+    (if max_nodes was reached, used to split the tree into subtrees).
+    """
+    records = []
+    stack = [node]
+    expanded = 0
+    while stack:
+        if max_nodes is not None and expanded >= max_nodes:
+            break
+        node = stack.pop()
+        expanded += 1
+        status = _simulate(node, symbols, max_steps)
+        if status is not None:
+            records.append(_pack_record(node, status))
+            continue
+        # undefined transition: either it is a halt or we define it
+        records.append(_pack_record(node, Status.HALT))
+        stack.extend(_children(node, states, symbols))
+    return b''.join(records), stack
+
+
+def _expand_subtree(args: tuple[_Node, int, int, int]) -> bytes:
+    node, states, symbols, max_steps = args
+    records, _ = _expand(node, states, symbols, max_steps)
+    return records
+
+
+def enumerate_machines(
+        states: int,
+        symbols: int,
+        max_steps: int,
+        path: str,
+        processes: int | None = None,
+        subtrees_per_process: int = 64,
+    ) -> Counter[Status]:
+    """Run all machines, write results to the file. Returns number of machines by status."""
+    if states * symbols * 2 > 255:
+        raise ValueError("Too large machines for the result format")
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    root = _Node(
+        table=[-1] * (states * symbols), used_states=1, used_symbols=1,
+        tape=bytearray(64), head=0, state=0, steps=0, extent=1,
+    )
+    counts: Counter[Status] = Counter()
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, states, symbols, max_steps))
+
+        def write(records: bytes) -> None:
+            record_size = _RECORD.size + states * symbols
+            for offset in range(0, len(records), record_size):
+                counts[Status(records[offset])] += 1
+            f.write(records)
+
+        # the top of the tree is processed here, its frontier is split between workers
+        records, subtrees = _expand(root, states, symbols, max_steps, max_nodes=processes * subtrees_per_process)
+        write(records)
+        tasks = [(node, states, symbols, max_steps) for node in subtrees]
+        if processes == 1:
+            for task in tasks:
+                write(_expand_subtree(task))
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                for records in pool.imap_unordered(_expand_subtree, tasks):
+                    write(records)
+
+    return counts
+
+
+def read_results(path: str) -> Iterator[Result]:
+    with open(path, 'rb') as f:
+        magic, states, symbols, _ = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not an enumeration results file: {}".format(path))
+        table_size = states * symbols
+        while record := f.read(_RECORD.size + table_size):
+            status, steps, nonempty = _RECORD.unpack(record[:_RECORD.size])
+            table = [packed - 1 for packed in record[_RECORD.size:]]
+            yield Result(table=table, status=Status(status), steps=steps, nonempty=nonempty)
+
+
+def to_turing_machine(table: Table, symbols: int) -> TuringMachine[int, int]:
+    rules = {}
+    for index, packed in enumerate(table):
+        if packed < 0:
+            continue
+        new_state, new_symbol = divmod(packed >> 1, symbols)
+        rules[divmod(index, symbols)] = (new_state, new_symbol, +1 if packed & 1 else -1)
+    return TuringMachine(rules=rules, init_state=0, empty_symbol=0)
@@ -50,6 +50,15 @@ def get_copy1_machine():
     return TuringMachine(rules=rules, init_state='each', empty_symbol=0)
 
 
+def get_unary_increment_machine():
+    # binary machine: 1^n -> 1^(n+1), the head goes far from the start of the tape
+    rules = {
+        ('right', 1): ('right', None, +1),
+        ('right', 0): ('done', 1, 0),
+    }
+    return TuringMachine(rules=rules, init_state='right', empty_symbol=0)
+
+
 class AddMachineWrapper:
     # fast bin addition from turingmachine.io
 
@@ -196,3 +205,7 @@ def get_multitape_palyndrome_machine(base_alphabet: Sequence[str], start_symbol,
     final_rules = multitape.patch_partial(tapes_count=3, alphabet=alphabet, partial_rules=rules)
 
     return multitape.MultitapeTuringMachine(tapes_count=3, rules=final_rules, init_state='init', empty_symbol=empty_symbol)
+
+
+def get_abc_palyndrome_machine():
+    return get_multitape_palyndrome_machine(base_alphabet=list('abc'), start_symbol='*')
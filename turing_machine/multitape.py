@@ -4,7 +4,7 @@ This module also will provide wrapper to emulate MTM by a regular TM
 """
 
 from collections import Counter
-from collections.abc import Sequence, Iterable
+from collections.abc import Callable, Iterable, MutableSequence, Sequence
 from copy import deepcopy
 from dataclasses import dataclass
 from enum import Enum, IntEnum
@@ -13,6 +13,7 @@ import logging
 import itertools
 
 from turing_machine import TuringMachine
+from checkpoint import CheckpointedRun
 from common import PrettyTape
 
 
@@ -52,12 +53,12 @@ def patch_partial[ST, SYM](
     return result
 
 
-class MultitapeTuringMachine[ST, SYM]:
+class MultitapeTuringMachine[ST, SYM](CheckpointedRun[SYM]):
     """
     Enriched Turing Machine: allows multiple tapes.
     """
 
-    tapes: list[list[SYM]]
+    tapes: list[MutableSequence[SYM]]
     heads: list[int]
 
     def __init__(self,
@@ -90,13 +91,22 @@ class MultitapeTuringMachine[ST, SYM]:
     def run(self,
             tapes: Sequence[list[SYM]],
             heads: Sequence[int] | None = None,
-            max_steps: int | None = None
-        ) -> list[list[SYM]]:
-        """Run machine for given number of steps or until it halts. Returns tapes."""
+            max_steps: int | None = None,
+            tape_type: Callable[[Iterable[SYM]], MutableSequence[SYM]] = list,
+            checkpoint_path: str | None = None,
+            checkpoint_every: int | None = None,
+            in_place: bool = False,
+        ) -> list[MutableSequence[SYM]]:
+        """
+        Run machine for given number of steps or until it halts. Returns tapes.
+        tape_type - tape representation used during the run, e.g. tapes.RunLengthTape
+        checkpoint_path, checkpoint_every - save snapshot to the file every given number of steps
+        in_place - run on the given tape objects without copying (tape_type is ignored)
+        """
 
         if len(tapes) != self.tapes_count:
             raise ValueError("Wrong number of input tapes, expected: {}, got: {}".format(self.tapes_count, len(tapes)))
-        self.tapes = [tape.copy() for tape in tapes]
+        self.tapes = list(tapes) if in_place else [tape_type(tape) for tape in tapes]
 
         if heads is None:
             heads = [0] * self.tapes_count
@@ -114,16 +124,16 @@ class MultitapeTuringMachine[ST, SYM]:
             if head >= len(tape):
                 tape.extend([self.empty_symbol] * (head - len(tape) + 1))
 
-        step = 0
-        while not self.halt:
-            step += 1
-            logging.debug('=======')
-            logging.debug('step: %d', step)
-            if (max_steps is not None) and (step > max_steps):
-                break
-            self._next()
+        return self._run_loop(0, max_steps, checkpoint_path, checkpoint_every)
 
-        self.steps = step
+    def _get_tapes(self) -> tuple[list[MutableSequence[SYM]], list[int]]:
+        return self.tapes, self.heads
+
+    def _set_tapes(self, tapes: list[MutableSequence[SYM]], heads: list[int]) -> None:
+        self.tapes = tapes
+        self.heads = list(heads)
+
+    def _result(self) -> list[MutableSequence[SYM]]:
         return self.tapes
 
     def _next(self) -> None:
@@ -0,0 +1,117 @@
+"""
+Non-deterministic Turing machine: rules map a key to a collection of transitions.
+
+Configurations are explored breadth-first (optionally with a bounded beam).
+Tapes are persistent (see tapes.PersistentTape), so branches share structure,
+and visited configurations are deduplicated by (state, head, incremental tape hash).
+"""
+
+from collections.abc import Callable, Collection, Hashable
+from dataclasses import dataclass
+from typing import Any, Literal
+import logging
+
+from tapes import PersistentTape
+
+
+type DeltaType = Literal[-1, 0, 1]
+
+
+@dataclass(frozen=True)
+class Configuration[ST, SYM]:
+    state: ST
+    head: int
+    tape: PersistentTape[SYM]
+
+    def __hash__(self) -> int:
+        return hash((self.state, self.head, self.tape.content_hash))
+
+
+class NondeterministicTuringMachine[ST: Hashable, SYM: Hashable]:
+    """
+    Turing machine with rules: (state, symbol) -> {(new_state, new_symbol, delta), ...}
+    Conventions are the same as in TuringMachine: symbol None is a fallback rule for any symbol,
+    new_symbol None means no write; branch halts if there are no rules or head leaves the tape.
+    """
+
+    type RulesType[ST_, SYM_] = dict[tuple[ST_, SYM_ | None], Collection[tuple[ST_, SYM_ | None, DeltaType]]]
+
+    def __init__(self,
+            rules: RulesType[ST, SYM],
+            init_state: ST,
+            empty_symbol: SYM,
+        ):
+        self.rules = {key: tuple(transitions) for key, transitions in rules.items()}
+        self.init_state = init_state
+        self.empty_symbol = empty_symbol
+
+    def run(self,
+            tape: list[SYM],
+            head: int = 0,
+            max_steps: int | None = None,
+            beam_width: int | None = None,
+            beam_key: Callable[[Configuration[ST, SYM]], Any] | None = None,
+            accept_states: Collection[ST] | None = None,
+        ) -> list[Configuration[ST, SYM]]:
+        """
+        Explore configurations level by level. Returns halted configurations.
+        beam_width - keep at most that many configurations on each level (ordered by beam_key, if given)
+        accept_states - stop as soon as some branch halts in one of these states
+        """
+        if head < 0:
+            raise ValueError("Head must be non-negative!")
+        init_tape = PersistentTape(tape, empty_symbol=self.empty_symbol).extend_to(head + 1)
+        init_config = Configuration(self.init_state, head, init_tape)
+
+        self.halted: list[Configuration[ST, SYM]] = []
+        visited = {init_config}
+        frontier = [init_config]
+        step = 0
+        while frontier:
+            step += 1
+            if (max_steps is not None) and (step > max_steps):
+                break
+            next_frontier = []
+            for config in frontier:
+                children = self._next(config)
+                if children is None:
+                    self.halted.append(config)
+                    continue
+                for child in children:
+                    if child.head < 0:
+                        self.halted.append(Configuration(child.state, 0, child.tape))  # head stays, as in TuringMachine
+                        continue
+                    if child not in visited:
+                        visited.add(child)
+                        next_frontier.append(child)
+
+            if accept_states is not None and any(c.state in accept_states for c in self.halted):
+                break
+
+            if beam_width is not None and len(next_frontier) > beam_width:
+                if beam_key is not None:
+                    next_frontier.sort(key=beam_key)
+                next_frontier = next_frontier[:beam_width]
+            logging.debug('step %d: %d configurations, %d visited', step, len(next_frontier), len(visited))
+            frontier = next_frontier
+
+        self.steps = step
+        self.visited_count = len(visited)
+        self.frontier = frontier
+        return self.halted
+
+    def _next(self, config: Configuration[ST, SYM]) -> list[Configuration[ST, SYM]] | None:
+        tape = config.tape
+        transitions = self.rules.get((config.state, tape[config.head]))
+        if transitions is None:
+            transitions = self.rules.get((config.state, None))
+            if transitions is None:
+                return None
+
+        children = []
+        for new_state, new_symbol, delta in transitions:
+            new_tape = tape if new_symbol is None else tape.set(config.head, new_symbol)
+            new_head = config.head + delta
+            # maintain invariant as TuringMachine does: tape[head] is defined
+            children.append(Configuration(new_state, new_head, new_tape.extend_to(new_head + 1)))
+        return children
@@ -0,0 +1,236 @@
+"""
+Pipelines: the same computation run through different machine transformations.
+
+A pipeline is built once from the original machine (transformations may be expensive),
+then run() encodes the input tapes, runs the derived machine and decodes its output
+back to the tapes of the original machine. So outputs of all pipelines are comparable.
+
+Single-tape machines: plain, binarized, utm (multitape UTM on the binary or binarized machine), onetape_utm,
+onetape_aligned_utm.
+Multitape machines: multitape, emulator (one-tape emulation), aligned_emulator (one-tape emulation with collocated heads).
+"""
+
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from aligned import AlignedEmulator
+from binarize import BinEncoder
+from multitape import MultitapeEmulator, MultitapeTuringMachine
+from turing_machine import TuringMachine
+from universal import UniversalMachineWrapper
+
+
+type Tapes[SYM] = list[list[SYM]]
+type MachineFactory = Callable[[], Any]
+
+
+@dataclass
+class RunResult[SYM]:
+    output: Tapes[SYM]  # decoded tapes without trailing empty symbols
+    steps: int
+    tape_length: int  # total length of the tapes of the machine that actually ran
+    halt: bool
+
+
+def strip_empty[SYM](tape: Sequence[SYM], empty_symbol: SYM) -> list[SYM]:
+    end = len(tape)
+    while end > 0 and tape[end - 1] == empty_symbol:
+        end -= 1
+    return list(tape[:end])
+
+
+class Pipeline[SYM](ABC):
+    """
+    Base class: subclasses define _build() that returns the machine to run,
+    encode() (original tapes -> argument of machine.run) and decode() (machine output -> original tapes).
+    """
+
+    name = ''
+
+    def __init__(self, orig_machine: TuringMachine[Any, SYM] | MultitapeTuringMachine[Any, SYM]) -> None:
+        self.orig_machine = orig_machine
+        self.machine: Any = None
+
+    def build(self) -> None:
+        if self.machine is None:
+            self.machine = self._build()
+
+    @abstractmethod
+    def _build(self) -> Any:
+        ...
+
+    @abstractmethod
+    def encode(self, tapes: Tapes[SYM]) -> Any:
+        ...
+
+    @abstractmethod
+    def decode(self, output: Any) -> Tapes[SYM]:
+        ...
+
+    def run(self, tapes: Tapes[SYM], max_steps: int | None = None) -> RunResult[SYM]:
+        self.build()
+        machine = self.machine
+        output = machine.run(self.encode(tapes), max_steps=max_steps)
+        if isinstance(machine, MultitapeTuringMachine):
+            tape_length = sum(len(tape) for tape in machine.tapes)
+        else:
+            tape_length = len(machine.tape)
+        empty_symbol = self.orig_machine.empty_symbol
+        decoded = [strip_empty(tape, empty_symbol) for tape in self.decode(output)]
+        return RunResult(output=decoded, steps=machine.steps, tape_length=tape_length, halt=machine.halt)
+
+
+class PlainPipeline[SYM](Pipeline[SYM]):
+    name = 'plain'
+
+    def _build(self) -> TuringMachine:
+        return self.orig_machine
+
+    def encode(self, tapes: Tapes[SYM]) -> list[SYM]:
+        tape, = tapes
+        return tape
+
+    def decode(self, output: list[SYM]) -> Tapes[SYM]:
+        return [output]
+
+
+class BinarizedPipeline[SYM](Pipeline[SYM]):
+    name = 'binarized'
+
+    def _build(self) -> TuringMachine:
+        self.encoder = BinEncoder(self.orig_machine)
+        return self.encoder.encode_machine()
+
+    def encode(self, tapes: Tapes[SYM]) -> list[int]:
+        tape, = tapes
+        return self.encoder.encode_input(tape)
+
+    def decode(self, output: list[int]) -> Tapes[SYM]:
+        return [self.encoder.decode_output(output)]
+
+
+def is_binary(machine: TuringMachine) -> bool:
+    """Whether UTM can run the machine as is: symbols are 0 and 1, 0 is empty."""
+    symbols = {symbol for (_, symbol), (_, new_symbol, _) in machine.rules.items() for symbol in (symbol, new_symbol)}
+    return machine.empty_symbol == 0 and symbols <= {0, 1, None}
+
+
+class UniversalPipeline[SYM](Pipeline[SYM]):
+    """Multitape UTM running the machine (binarized, unless it is binary already)."""
+
+    name = 'utm'
+
+    def _build(self) -> Any:
+        if is_binary(self.orig_machine):
+            self.encoder = None
+            self.bin_machine = self.orig_machine
+        else:
+            self.encoder = BinEncoder(self.orig_machine)
+            self.bin_machine = self.encoder.encode_machine()
+        self.utm = UniversalMachineWrapper()
+        return self.utm.machine
+
+    def encode(self, tapes: Tapes[SYM]) -> Any:
+        tape, = tapes
+        bin_tape = tape if self.encoder is None else self.encoder.encode_input(tape)
+        return self.utm.encode(self.bin_machine, bin_tape)
+
+    def decode(self, output: Any) -> Tapes[SYM]:
+        bin_tape = self.utm.decode(output)
+        return [bin_tape if self.encoder is None else self.encoder.decode_output(bin_tape)]
+
+
+class OneTapeUniversalPipeline[SYM](UniversalPipeline[SYM]):
+    """Classical one-tape UTM: emulator of the multitape UTM running the binarized machine."""
+
+    name = 'onetape_utm'
+
+    def _build(self) -> TuringMachine:
+        self.emulator = MultitapeEmulator(super()._build())
+        return self.emulator.machine
+
+    def encode(self, tapes: Tapes[SYM]) -> Any:
+        return self.emulator.encode_tapes(super().encode(tapes))
+
+    def decode(self, output: Any) -> Tapes[SYM]:
+        return super().decode(self.emulator.decode_tape(output))
+
+
+class OneTapeAlignedUniversalPipeline[SYM](UniversalPipeline[SYM]):
+    """
+    One-tape UTM with collocated heads, anchored at the emulated tape (see aligned.py).
+    Special case: fewer steps than onetape_utm only if heads move in lockstep, e.g. a long emulated tape.
+    """
+
+    name = 'onetape_aligned_utm'
+
+    def _build(self) -> TuringMachine:
+        self.emulator = AlignedEmulator(super()._build(), anchor=2)
+        return self.emulator.machine
+
+    def encode(self, tapes: Tapes[SYM]) -> Any:
+        return self.emulator.encode_tapes(super().encode(tapes))
+
+    def decode(self, output: Any) -> Tapes[SYM]:
+        return super().decode(self.emulator.decode_tape(output))
+
+
+class MultitapePipeline[SYM](Pipeline[SYM]):
+    name = 'multitape'
+
+    def _build(self) -> MultitapeTuringMachine:
+        return self.orig_machine
+
+    def encode(self, tapes: Tapes[SYM]) -> Tapes[SYM]:
+        return tapes
+
+    def decode(self, output: Tapes[SYM]) -> Tapes[SYM]:
+        return output
+
+
+class EmulatorPipeline[SYM](Pipeline[SYM]):
+    name = 'emulator'
+
+    def _build(self) -> TuringMachine:
+        self.emulator = MultitapeEmulator(self.orig_machine)
+        return self.emulator.machine
+
+    def encode(self, tapes: Tapes[SYM]) -> Any:
+        return self.emulator.encode_tapes(tapes)
+
+    def decode(self, output: Any) -> Tapes[SYM]:
+        return self.emulator.decode_tape(output)
+
+
+class AlignedEmulatorPipeline[SYM](EmulatorPipeline[SYM]):
+    """One-tape emulation with collocated heads: special case for heads moving in lockstep (see aligned.py)."""
+
+    name = 'aligned_emulator'
+
+    def _build(self) -> TuringMachine:
+        self.emulator = AlignedEmulator(self.orig_machine)
+        return self.emulator.machine
+
+
+SINGLE_TAPE_PIPELINES: list[type[Pipeline]] = [
+    PlainPipeline, BinarizedPipeline, UniversalPipeline, OneTapeUniversalPipeline, OneTapeAlignedUniversalPipeline,
+]
+MULTITAPE_PIPELINES: list[type[Pipeline]] = [MultitapePipeline, EmulatorPipeline, AlignedEmulatorPipeline]
+
+
+def default_pipelines(machine: TuringMachine | MultitapeTuringMachine) -> list[type[Pipeline]]:
+    """All pipelines applicable to the machine, the first one runs the machine itself."""
+    if isinstance(machine, MultitapeTuringMachine):
+        return list(MULTITAPE_PIPELINES)
+    return list(SINGLE_TAPE_PIPELINES)
+
+
+def build_pipelines(machine_factory: MachineFactory, pipeline_types: Sequence[type[Pipeline]]) -> list[Pipeline]:
+    """Pipelines sharing one original machine, already built."""
+    machine = machine_factory()
+    pipelines = [pipeline_type(machine) for pipeline_type in pipeline_types]
+    for pipeline in pipelines:
+        pipeline.build()
+    return pipelines
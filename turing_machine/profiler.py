@@ -0,0 +1,221 @@
+"""
+Step-complexity profiler: how steps and tape length of a machine scale with the input size.
+
+The machine is run through one or several pipelines (see pipelines.py) on inputs of growing size
+in a pool of worker processes. For every pipeline asymptotic models are fitted (see fit_growth):
+    log-log slope between the two largest sizes: empirical degree d of steps ~ n^d
+    degree k: the slope rounded to an integer (at most max_degree), c = value / n^k at the largest size
+        is the constant factor of the model c * n^k
+    least squares polynomial of degree k (by relative error) over all sizes, its error shows how well k fits
+Overhead of one pipeline over another (e.g. multitape -> one-tape emulator, TM -> UTM)
+is the ratio of their steps, it is fitted in the same way.
+
+    python profiler.py add palindrome  # cases from benchmark.SUITE
+"""
+
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+import argparse
+import math
+import multiprocessing
+import sys
+
+import benchmark
+from pipelines import MachineFactory, Pipeline, Tapes, build_pipelines, default_pipelines
+
+
+@dataclass
+class Sample:
+    size: int
+    steps: int
+    tape_length: int
+
+
+@dataclass
+class Fit:
+    slope: float  # log-log slope between the two largest sizes, empirical degree
+    degree: int  # asymptotic degree: rounded slope
+    factor: float  # constant factor: value / n^degree at the largest size
+    coefficients: list[float]  # least squares polynomial c0 + c1 * n + ... of the degree
+    error: float  # relative RMS error of the polynomial
+
+    def __str__(self) -> str:
+        return '{:.3g} * n^{} (slope {:.2f}, polynomial error {:.1%})'.format(self.factor, self.degree, self.slope, self.error)
+
+
+@dataclass
+class Profile:
+    pipeline: str
+    samples: list[Sample]
+
+    @property
+    def sizes(self) -> list[int]:
+        return [sample.size for sample in self.samples]
+
+    def steps_fit(self, max_degree: int = 4) -> Fit:
+        return fit_growth(self.sizes, [sample.steps for sample in self.samples], max_degree)
+
+    def tape_fit(self, max_degree: int = 4) -> Fit:
+        return fit_growth(self.sizes, [sample.tape_length for sample in self.samples], max_degree)
+
+
+def _solve(matrix: list[list[float]], vector: list[float]) -> list[float]:
+    """Gaussian elimination with partial pivoting."""
+    size = len(vector)
+    rows = [row + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        if rows[column][column] == 0:
+            raise ValueError("Singular matrix")
+        for row in range(column + 1, size):
+            ratio = rows[row][column] / rows[column][column]
+            for k in range(column, size + 1):
+                rows[row][k] -= ratio * rows[column][k]
+    solution = [0.0] * size
+    for row in range(size - 1, -1, -1):
+        rest = sum(rows[row][k] * solution[k] for k in range(row + 1, size))
+        solution[row] = (rows[row][size] - rest) / rows[row][row]
+    return solution
+
+
+def _fit_polynomial(sizes: Sequence[float], values: Sequence[float], degree: int) -> tuple[list[float], float]:
+    """Least squares of relative errors. Returns coefficients and relative RMS error."""
+    scale = max(sizes)  # powers of scaled sizes are well-conditioned
+    rows = [[(n / scale) ** k / v for k in range(degree + 1)] for n, v in zip(sizes, values)]
+    normal = [[sum(row[i] * row[j] for row in rows) for j in range(degree + 1)] for i in range(degree + 1)]
+    scaled = _solve(normal, [sum(row[i] for row in rows) for i in range(degree + 1)])
+    error = math.sqrt(sum((sum(c * x for c, x in zip(scaled, row)) - 1) ** 2 for row in rows) / len(rows))
+    return [c / scale ** k for k, c in enumerate(scaled)], error
+
+
+def fit_growth(sizes: Sequence[float], values: Sequence[float], max_degree: int = 4) -> Fit:
+    """
+    Fit values as a polynomial of the size. The degree is taken from the growth between the two largest sizes,
+    so lower-order terms and small-size effects do not affect it. Sizes and values must be positive.
+    """
+    points = sorted(set(zip(sizes, values)))
+    if len(set(n for n, _ in points)) < 2:
+        raise ValueError("At least two distinct sizes are required")
+    if points[0][0] <= 0 or min(v for _, v in points) <= 0:
+        raise ValueError("Sizes and values must be positive")
+    (n1, v1), (n2, v2) = points[-2:]
+    slope = math.log(v2 / v1) / math.log(n2 / n1)
+    degree = min(max(round(slope), 0), max_degree)
+    coefficients, error = _fit_polynomial([n for n, _ in points], [v for _, v in points], degree)
+    return Fit(slope=slope, degree=degree, factor=v2 / n2 ** degree, coefficients=coefficients, error=error)
+
+
+def overhead(base: Profile, other: Profile, max_degree: int = 4) -> tuple[list[tuple[int, float]], Fit | None]:
+    """Steps ratio other / base for common sizes and its fit (None if there are less than two common sizes)."""
+    base_steps = {sample.size: sample.steps for sample in base.samples}
+    ratios = [(sample.size, sample.steps / base_steps[sample.size]) for sample in other.samples if sample.size in base_steps]
+    if len(ratios) < 2:
+        return ratios, None
+    return ratios, fit_growth([size for size, _ in ratios], [ratio for _, ratio in ratios], max_degree)
+
+
+# worker process state, see _init_worker
+_worker_pipelines: list[Pipeline] = []
+
+
+def _init_worker(machine_factory: MachineFactory, pipeline_types: Sequence[type[Pipeline]]) -> None:
+    global _worker_pipelines
+    _worker_pipelines = build_pipelines(machine_factory, pipeline_types)
+
+
+def _worker_run(task: tuple[int, int, Tapes]) -> tuple[int, Sample]:
+    index, size, tapes = task
+    result = _worker_pipelines[index].run(tapes)
+    return index, Sample(size=size, steps=result.steps, tape_length=result.tape_length)
+
+
+def profile(
+        machine_factory: MachineFactory,
+        make_input: Callable[[int], Tapes],
+        sizes: Sequence[int] | dict[str, Sequence[int]],
+        pipeline_types: Sequence[type[Pipeline]] | None = None,
+        processes: int | None = None,
+    ) -> dict[str, Profile]:
+    """
+    Run pipelines on inputs make_input(size) for all sizes. Returns profiles by pipeline name.
+    sizes - common sizes or sizes for every pipeline name (slow pipelines may need smaller inputs)
+    processes - number of worker processes (default: cpu count), 1 runs everything in this process
+    """
+    if pipeline_types is None:
+        pipeline_types = default_pipelines(machine_factory())
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    tasks = []
+    for index, pipeline_type in enumerate(pipeline_types):
+        pipeline_sizes = sizes[pipeline_type.name] if isinstance(sizes, dict) else sizes
+        tasks.extend((index, size, make_input(size)) for size in pipeline_sizes)
+    # the largest inputs first, so that the pool is not waiting for one long task in the end
+    tasks.sort(key=lambda task: -task[1])
+
+    if processes == 1:
+        _init_worker(machine_factory, pipeline_types)
+        results = list(map(_worker_run, tasks))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(machine_factory, pipeline_types)) as pool:
+            results = pool.map(_worker_run, tasks, chunksize=1)
+
+    profiles = {pipeline_type.name: Profile(pipeline_type.name, []) for pipeline_type in pipeline_types}
+    for index, sample in results:
+        profiles[pipeline_types[index].name].samples.append(sample)
+    for prof in profiles.values():
+        prof.samples.sort(key=lambda sample: sample.size)
+    return profiles
+
+
+def format_report(profiles: dict[str, Profile]) -> str:
+    lines = []
+    for prof in profiles.values():
+        lines.append('{}:'.format(prof.pipeline))
+        for sample in prof.samples:
+            lines.append('  n={:<6} steps={:<10} tape={}'.format(sample.size, sample.steps, sample.tape_length))
+        if len(set(prof.sizes)) >= 2:
+            lines.append('  steps ~ {}'.format(prof.steps_fit()))
+            lines.append('  tape ~ {}'.format(prof.tape_fit()))
+    # overhead over the original machine and over the previous transformation
+    names = list(profiles)
+    pairs = [(names[0], name) for name in names[1:]] + list(zip(names[1:], names[2:]))
+    for base_name, name in pairs:
+        ratios, fit = overhead(profiles[base_name], profiles[name])
+        if fit is not None:
+            lines.append('{} / {} overhead: {} ~ {}'.format(
+                name, base_name, ', '.join('{:.1f}'.format(ratio) for _, ratio in ratios), fit))
+    return '\n'.join(lines)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    cases = {case.name: case for case in benchmark.SUITE}
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cases', nargs='*', help='cases from benchmark.SUITE: {} (default: all)'.format(', '.join(cases)))
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--scale', type=int, default=2, help='sizes grow up to the largest benchmark size times scale')
+    args = parser.parse_args(argv)
+    for name in args.cases:
+        if name not in cases:
+            parser.error('unknown case: {}'.format(name))
+
+    for name in args.cases or list(cases):
+        case = cases[name]
+        sizes = {}
+        for pipeline_name, case_sizes in case.sizes.items():
+            # powers of two, so that pipelines with different ranges have common sizes to compare
+            size, high = 1, max(case_sizes) * args.scale
+            sizes[pipeline_name] = []
+            while size <= high:
+                sizes[pipeline_name].append(size)
+                size *= 2
+        pipeline_types = [benchmark.PIPELINES[pipeline_name] for pipeline_name in case.sizes]
+        profiles = profile(case.machine_factory, case.make_input, sizes, pipeline_types, args.processes)
+        print('== {} =='.format(name))
+        print(format_report(profiles))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Streaming machine pipelines: chains of machines, encoders and decoders with zero-copy tape hand-off.
+
+A stage is any callable: tape (or tapes) -> tape (or tapes).
+Machine stages run the machine in place on the tape buffer they receive and return the same buffer,
+so consecutive machines share one list (the input of the pipeline is copied once, it is not changed). Encoders and decoders are generators (e.g. BinEncoder.iter_encode_input),
+a stream is materialized only once, by the machine stage that consumes it.
+
+    encoder = BinEncoder(machine)
+    pipeline = StreamPipeline([encoder.iter_encode_input, MachineStage(encoder.encode_machine()), encoder.iter_decode_output])
+    output = pipeline.run(tape)
+
+Stages keep run state (machines store their configuration), so one pipeline runs one input at a time;
+independent inputs are run concurrently by worker processes with their own pipelines, see run_concurrently.
+"""
+
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from typing import Any
+import multiprocessing
+import time
+
+from binarize import BinEncoder
+from multitape import MultitapeTuringMachine
+from turing_machine import TuringMachine
+from universal import UniversalMachineWrapper
+import pipelines
+
+
+type Stage = Callable[[Any], Any]
+
+
+class MachineStage:
+    """Runs the machine in place on the incoming tape (tapes for multitape machines)."""
+
+    def __init__(self, machine: TuringMachine | MultitapeTuringMachine, max_steps: int | None = None) -> None:
+        self.machine = machine
+        self.max_steps = max_steps
+        self.__name__ = 'machine'
+
+    def copy_input(self, data: Any) -> Any:
+        """Own copy of the tape (tapes) for the first stage, so the machine does not overwrite the caller's data."""
+        if isinstance(self.machine, MultitapeTuringMachine):
+            return [list(tape) for tape in data]
+        return list(data)
+
+    def __call__(self, data: Any) -> Any:
+        if isinstance(self.machine, MultitapeTuringMachine):
+            tapes = [tape if isinstance(tape, list) else list(tape) for tape in data]
+            return self.machine.run(tapes, max_steps=self.max_steps, in_place=True)
+        tape = data if isinstance(data, list) else list(data)
+        return self.machine.run(tape, max_steps=self.max_steps, in_place=True)
+
+
+class UniversalEncodeStage:
+    """Encodes the input of a binary machine for UTM; the rules tape is encoded once."""
+
+    def __init__(self, machine: TuringMachine) -> None:
+        self.rules_tape = UniversalMachineWrapper.encode_rules(machine)
+        self.__name__ = 'utm_encode'
+
+    def __call__(self, tape: Iterable[Any]) -> list[list[Any]]:
+        return UniversalMachineWrapper.encode_with_rules(self.rules_tape, tape)
+
+
+class StreamPipeline:
+    """
+    Chain of stages. After run(): steps - total steps of machine stages, seconds - time by stage name,
+    so it is visible whether the throughput is limited by machine steps or by the glue code.
+    """
+
+    def __init__(self, stages: Sequence[Stage]) -> None:
+        self.stages = list(stages)
+        self.names = [getattr(stage, '__name__', type(stage).__name__) for stage in self.stages]
+        self.steps = 0
+        self.machine_seconds = 0.0
+        self.seconds: dict[str, float] = {}
+
+    def run(self, data: Any) -> Any:
+        """Returns output of the last stage (if it is a stream, it is materialized to a list)."""
+        self.steps = 0
+        self.machine_seconds = 0.0
+        self.seconds = dict.fromkeys(self.names, 0.0)
+        if self.stages and isinstance(self.stages[0], MachineStage):
+            data = self.stages[0].copy_input(data)
+        for name, stage in zip(self.names, self.stages):
+            # a lazy stream is consumed (and its time is accounted) by the next stage
+            start = time.perf_counter()
+            data = stage(data)
+            seconds = time.perf_counter() - start
+            self.seconds[name] += seconds
+            if isinstance(stage, MachineStage):
+                self.steps += stage.machine.steps
+                self.machine_seconds += seconds
+        if isinstance(data, Iterator):
+            data = list(data)
+        return data
+
+
+def repeat_stages(machine_factory: pipelines.MachineFactory, count: int, max_steps: int | None = None) -> list[Stage]:
+    """The same machine applied count times, e.g. repeated increments."""
+    return [MachineStage(machine_factory(), max_steps) for _ in range(count)]
+
+
+def binarized_stages(machine: TuringMachine, max_steps: int | None = None) -> list[Stage]:
+    """encode -> binarized machine -> decode."""
+    encoder = BinEncoder(machine)
+    return [encoder.iter_encode_input, MachineStage(encoder.encode_machine(), max_steps), encoder.iter_decode_output]
+
+
+def universal_stages(machine: TuringMachine, max_steps: int | None = None) -> list[Stage]:
+    """encode -> UTM running the machine (binarized, unless it is binary already) -> decode."""
+    utm = UniversalMachineWrapper()
+    if pipelines.is_binary(machine):
+        return [UniversalEncodeStage(machine), MachineStage(utm.machine, max_steps), UniversalMachineWrapper.iter_decode]
+    encoder = BinEncoder(machine)
+    return [
+        encoder.iter_encode_input,
+        UniversalEncodeStage(encoder.encode_machine()),
+        MachineStage(utm.machine, max_steps),
+        UniversalMachineWrapper.iter_decode,
+        encoder.iter_decode_output,
+    ]
+
+
+# worker process state, see _init_worker
+_worker_pipeline: StreamPipeline | None = None
+
+
+def _init_worker(pipeline_factory: Callable[[], StreamPipeline]) -> None:
+    global _worker_pipeline
+    _worker_pipeline = pipeline_factory()
+
+
+def _worker_run(data: Any) -> Any:
+    return _worker_pipeline.run(data)  # type: ignore
+
+
+def run_concurrently(
+        pipeline_factory: Callable[[], StreamPipeline],
+        inputs: Iterable[Any],
+        processes: int | None = None,
+        chunksize: int = 1,
+    ) -> Iterator[Any]:
+    """
+    Run independent pipeline instances on the inputs (outputs are in the order of inputs).
+    pipeline_factory must be picklable (module-level function), every worker builds its own pipeline.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes == 1:
+        pipeline = pipeline_factory()
+        for data in inputs:
+            yield pipeline.run(data)
+        return
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(pipeline_factory,)) as pool:
+        yield from pool.imap(_worker_run, inputs, chunksize=chunksize)
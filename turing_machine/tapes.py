@@ -0,0 +1,300 @@
+"""
+Alternative tape representations for Turing machines.
+
+A tape is any mutable sequence supporting the operations used by machines:
+len(), indexing, item assignment, append() and extend(). Plain python list is the default.
+"""
+
+from array import array
+from collections.abc import Iterable, Iterator
+import itertools
+import sys
+
+
+class RunLengthTape[SYM]:
+    """
+    Run-length encoded tape: stores (symbol, run_length) segments.
+
+    Suitable for unary-style machines that produce long runs of identical symbols.
+    Access is done via a cursor (current segment), so head moves within a run
+    and to the neighbour runs are O(1); writes split or merge segments.
+    """
+
+    def __init__(self, symbols: Iterable[SYM] = ()) -> None:
+        self._symbols: list[SYM] = []
+        self._lengths = array('q')
+        self._len = 0
+        # cursor: index of some segment and its start position on the tape
+        self._seg = 0
+        self._seg_start = 0
+        if isinstance(symbols, RunLengthTape):
+            self._symbols = symbols._symbols.copy()
+            self._lengths = array('q', symbols._lengths)
+            self._len = symbols._len
+        else:
+            self.extend(symbols)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def runs(self) -> Iterator[tuple[SYM, int]]:
+        return zip(self._symbols, self._lengths)
+
+    def __iter__(self) -> Iterator[SYM]:
+        for symbol, length in self.runs():
+            yield from itertools.repeat(symbol, length)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RunLengthTape):
+            return self._symbols == other._symbols and self._lengths == other._lengths
+        if isinstance(other, list):
+            return len(other) == self._len and all(x == y for x, y in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        runs = ', '.join('{!r}x{}'.format(symbol, length) for symbol, length in self.runs())
+        return 'RunLengthTape([{}])'.format(runs)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self._symbols) + sys.getsizeof(self._lengths)
+
+    def copy(self) -> 'RunLengthTape[SYM]':
+        return RunLengthTape(self)
+
+    def to_list(self) -> list[SYM]:
+        return list(self)
+
+    def _normalize_index(self, index: int) -> int:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('tape index out of range')
+        return index
+
+    def _locate(self, index: int) -> int:
+        """Move cursor to the segment containing index (must be valid), return segment."""
+        seg, start = self._seg, self._seg_start
+        if seg >= len(self._lengths):
+            seg, start = 0, 0
+        while index < start:
+            seg -= 1
+            start -= self._lengths[seg]
+        while index >= start + self._lengths[seg]:
+            start += self._lengths[seg]
+            seg += 1
+        self._seg, self._seg_start = seg, start
+        return seg
+
+    def __getitem__(self, index: int) -> SYM:
+        index = self._normalize_index(index)
+        return self._symbols[self._locate(index)]
+
+    def __setitem__(self, index: int, symbol: SYM) -> None:
+        index = self._normalize_index(index)
+        seg = self._locate(index)
+        if self._symbols[seg] == symbol:
+            return
+
+        symbols, lengths = self._symbols, self._lengths
+        start = self._seg_start
+        length = lengths[seg]
+        joins_prev = (index == start and seg > 0 and symbols[seg - 1] == symbol)
+        joins_next = (index == start + length - 1 and seg + 1 < len(symbols) and symbols[seg + 1] == symbol)
+
+        if length == 1:
+            symbols[seg] = symbol
+            if joins_next:
+                lengths[seg] += lengths[seg + 1]
+                del symbols[seg + 1], lengths[seg + 1]
+            if joins_prev:
+                self._seg_start -= lengths[seg - 1]
+                lengths[seg - 1] += lengths[seg]
+                del symbols[seg], lengths[seg]
+                self._seg = seg - 1
+        elif joins_prev:
+            lengths[seg - 1] += 1
+            lengths[seg] -= 1
+            self._seg = seg - 1
+            self._seg_start -= lengths[seg - 1] - 1
+        elif joins_next:
+            lengths[seg] -= 1
+            lengths[seg + 1] += 1
+            self._seg = seg + 1
+            self._seg_start = index
+        else:
+            # split the run: [start, index) + [index] + (index, start + length)
+            old_symbol = symbols[seg]
+            before = index - start
+            after = length - before - 1
+            new_runs = [(symbol, 1)]
+            if after > 0:
+                new_runs.append((old_symbol, after))
+            if before > 0:
+                new_runs.insert(0, (old_symbol, before))
+            symbols[seg:seg + 1] = [s for s, _ in new_runs]
+            lengths[seg:seg + 1] = array('q', [n for _, n in new_runs])
+            if before > 0:
+                self._seg = seg + 1
+                self._seg_start = index
+
+    def append(self, symbol: SYM) -> None:
+        if self._symbols and self._symbols[-1] == symbol:
+            self._lengths[-1] += 1
+        else:
+            self._symbols.append(symbol)
+            self._lengths.append(1)
+        self._len += 1
+
+    def extend(self, symbols: Iterable[SYM]) -> None:
+        for symbol, group in itertools.groupby(symbols):
+            count = sum(1 for _ in group)
+            if self._symbols and self._symbols[-1] == symbol:
+                self._lengths[-1] += count
+            else:
+                self._symbols.append(symbol)
+                self._lengths.append(count)
+            self._len += count
+
+
+class PersistentTape[SYM]:
+    """
+    Immutable tape with structural sharing: set() returns a new tape that shares
+    all untouched chunks with the old one (radix tree of fixed-size chunks, path copying).
+    The tape is infinite to the right: cells that were never written contain empty symbol.
+
+    The tape maintains a polynomial hash of its content, updated in O(log index) on every write;
+    trailing empty cells do not affect the hash, so it is suitable for configurations deduplication.
+    """
+
+    CHUNK = 32  # symbols in a leaf and children in a node
+    _MOD = (1 << 61) - 1
+    _BASE = 1_000_003
+
+    __slots__ = ('empty_symbol', 'length', 'depth', 'root', 'content_hash')
+
+    def __init__(self, symbols: Iterable[SYM] = (), empty_symbol: SYM = None) -> None:  # type: ignore
+        self.empty_symbol = empty_symbol
+        self.length = 0
+        self.depth = 0  # root is a leaf at depth 0
+        self.root = None  # None is a subtree of empty symbols
+        self.content_hash = 0
+        tape = self
+        for index, symbol in enumerate(symbols):
+            tape = tape.set(index, symbol)
+        self.length, self.depth, self.root, self.content_hash = tape.length, tape.depth, tape.root, tape.content_hash
+
+    def _replace(self, length: int, depth: int, root, content_hash: int) -> 'PersistentTape[SYM]':
+        tape = object.__new__(PersistentTape)
+        tape.empty_symbol = self.empty_symbol
+        tape.length = length
+        tape.depth = depth
+        tape.root = root
+        tape.content_hash = content_hash
+        return tape
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __hash__(self) -> int:
+        return self.content_hash
+
+    def _symbol_hash(self, symbol: SYM) -> int:
+        return 0 if symbol == self.empty_symbol else hash(symbol) % self._MOD
+
+    def _capacity(self, depth: int) -> int:
+        return self.CHUNK ** (depth + 1)
+
+    def __getitem__(self, index: int) -> SYM:
+        if index < 0:
+            raise IndexError('tape index out of range')
+        if index >= self._capacity(self.depth):
+            return self.empty_symbol
+        node = self.root
+        for level in range(self.depth, -1, -1):
+            if node is None:
+                return self.empty_symbol
+            node = node[(index // self.CHUNK ** level) % self.CHUNK]
+        return node
+
+    def set(self, index: int, symbol: SYM) -> 'PersistentTape[SYM]':
+        if index < 0:
+            raise IndexError('tape index out of range')
+        old_symbol = self[index]
+        length = max(self.length, index + 1)
+        if old_symbol == symbol:
+            return self if length == self.length else self._replace(length, self.depth, self.root, self.content_hash)
+
+        depth, root = self.depth, self.root
+        while index >= self._capacity(depth):
+            if root is not None:
+                root = (root,) + (None,) * (self.CHUNK - 1)
+            depth += 1
+
+        def updated(node, level):
+            position = (index // self.CHUNK ** level) % self.CHUNK
+            if node is None:
+                fill = self.empty_symbol if level == 0 else None
+                node = (fill,) * self.CHUNK
+            value = symbol if level == 0 else updated(node[position], level - 1)
+            return node[:position] + (value,) + node[(position + 1):]
+
+        root = updated(root, depth)
+        delta = self._symbol_hash(symbol) - self._symbol_hash(old_symbol)
+        content_hash = (self.content_hash + delta * pow(self._BASE, index, self._MOD)) % self._MOD
+        return self._replace(length, depth, root, content_hash)
+
+    def extend_to(self, length: int) -> 'PersistentTape[SYM]':
+        """Tape with at least given length (new cells are empty)."""
+        if length <= self.length:
+            return self
+        return self._replace(length, self.depth, self.root, self.content_hash)
+
+    def __iter__(self) -> Iterator[SYM]:
+        for index in range(self.length):
+            yield self[index]
+
+    def to_list(self) -> list[SYM]:
+        return list(self)
+
+    def __eq__(self, other: object) -> bool:
+        """Equality of content, trailing empty cells are ignored. Shared subtrees are not traversed."""
+        if not isinstance(other, PersistentTape):
+            return NotImplemented
+        if self.content_hash != other.content_hash or self.empty_symbol != other.empty_symbol:
+            return False
+        if self.root is other.root:
+            return True
+        return self._content_equal(other)
+
+    def _content_equal(self, other: 'PersistentTape') -> bool:
+        def is_empty(node, level):
+            if node is None:
+                return True
+            if level == 0:
+                return all(symbol == self.empty_symbol for symbol in node)
+            return all(is_empty(child, level - 1) for child in node)
+
+        def equal(a, b, level):
+            if a is b:
+                return True
+            if a is None or b is None:
+                return is_empty(a if b is None else b, level)
+            if level == 0:
+                return a == b
+            return all(equal(x, y, level - 1) for x, y in zip(a, b))
+
+        a, b = self.root, other.root
+        a_depth, b_depth = self.depth, other.depth
+        # lift the shallower tree: its root is the first child of the virtual deeper root
+        while a_depth != b_depth:
+            if a is None or b is None:
+                return is_empty(a, a_depth) and is_empty(b, b_depth)
+            if a_depth < b_depth:
+                if not all(is_empty(child, b_depth - 1) for child in b[1:]):
+                    return False
+                b, b_depth = b[0], b_depth - 1
+            else:
+                if not all(is_empty(child, a_depth - 1) for child in a[1:]):
+                    return False
+                a, a_depth = a[0], a_depth - 1
+        return equal(a, b, a_depth)
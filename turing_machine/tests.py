@@ -2,13 +2,27 @@ from collections import Counter
 from typing import Any
 import logging
 import pprint
+import os
+import random
 import string
+import sys
+import tempfile
 
 from turing_machine import TuringMachine
 import multitape
+import aligned
 import examples
+import benchmark
+import differential
+import pipelines
+import profiler
+import streaming
+import enumeration
 from binarize import BinEncoder
 import universal
+from nondeterministic import NondeterministicTuringMachine
+from tapes import RunLengthTape
+from timetravel import RunRecorder
 
 
 # TODO: add tests with symbols not in rules?
@@ -35,6 +49,39 @@ def test_copy1():
     assert output == expected
 
 
+def test_rle_tape():
+    rng = random.Random(1)
+    reference = [rng.choice('ab') for _ in range(20)]
+    tape = RunLengthTape(reference)
+    for _ in range(2000):
+        index = rng.randrange(len(reference))
+        symbol = rng.choice('abc')
+        reference[index] = symbol
+        tape[index] = symbol
+        if rng.random() < 0.1:
+            reference.append(symbol)
+            tape.append(symbol)
+        assert tape[index] == reference[index]
+    assert tape == reference
+    assert all(symbol != next_symbol for (symbol, _), (next_symbol, _) in zip(tape.runs(), list(tape.runs())[1:]))
+
+    print('copy1 machine (rle tape):')
+    machine = examples.get_copy1_machine()
+    N = 200
+    list_output = machine.run(tape=[1] * N)
+    list_steps = machine.steps
+    rle_output = machine.run(tape=[1] * N, tape_type=RunLengthTape)
+    assert machine.steps == list_steps
+    assert rle_output == list_output
+    print('  list tape memory:', sys.getsizeof(list_output))
+    print('  rle tape memory:', sys.getsizeof(rle_output))
+    assert sys.getsizeof(rle_output) < sys.getsizeof(list_output)
+
+    utm = universal.UniversalMachineWrapper()
+    utm_output = utm.machine.run(tapes=utm.encode(machine, [1] * 3), tape_type=RunLengthTape)
+    assert utm.decode([tape.to_list() for tape in utm_output]) == [1] * 3 + [0] + [1] * 3
+
+
 def test_add():
     wrapper = examples.AddMachineWrapper()
     machine = wrapper.machine
@@ -127,6 +174,38 @@ def test_multitape_emulator():
         assert is_palyndrome == result
 
 
+def test_aligned_emulator():
+    print('palindrome machine (aligned emulator)')
+    inputs = list(differential.random_inputs(['abc', '', ''], count=30, max_length=8, prefixes=['*', '', '']))
+    inputs += [[['*'] + list(data), [], []] for data in ['', 'a', 'abba', 'abcba', 'abccab']]
+    pipeline_types = [pipelines.MultitapePipeline, pipelines.EmulatorPipeline, pipelines.AlignedEmulatorPipeline]
+    report = differential.run_differential(examples.get_abc_palyndrome_machine, inputs, pipeline_types, processes=1)
+    print(report.summary())
+    assert report.mismatches == [] and report.skipped == 0
+
+    # any tape can be the anchor, tracks hitting the wall shift all tracks
+    machine = examples.get_abc_palyndrome_machine()
+    for anchor in range(3):
+        emulator = aligned.AlignedEmulator(machine, anchor)
+        for padding in [0, 1, None]:
+            tm_output = emulator.machine.run(emulator.encode_tapes([list('*abcba'), [], []], padding=padding))
+            assert emulator.decode_tape(tm_output)[-1][0] == '1'
+
+    # UTM anchored at the emulated tape: steps do not depend on how far the emulated head is
+    machine = examples.get_unary_increment_machine()
+    steps = {}
+    for pipeline_type in [pipelines.OneTapeUniversalPipeline, pipelines.OneTapeAlignedUniversalPipeline]:
+        pipeline = pipeline_type(machine)
+        for size in [8, 32]:
+            result = pipeline.run([[1] * size])
+            assert result.output == [[1] * (size + 1)]
+            steps[pipeline.name, size] = result.steps
+    print('  steps:', steps)
+    assert steps['onetape_aligned_utm', 32] < steps['onetape_utm', 32]
+    aligned_growth = steps['onetape_aligned_utm', 32] / steps['onetape_aligned_utm', 8]
+    assert aligned_growth < 4 < steps['onetape_utm', 32] / steps['onetape_utm', 8]
+
+
 def test_universal():
     # basic test: multitape UTM on binary TM
     print('utm:')
@@ -207,18 +286,331 @@ def test_universal_onetape():
     assert output == expected
 
 
+def test_snapshot():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'run.ckpt')
+
+        wrapper = examples.AddMachineWrapper()
+        machine = wrapper.machine
+        tape = wrapper.encode(300, 500)
+        expected = machine.run(tape=tape)
+        expected_steps = machine.steps
+        machine.run(tape=tape, checkpoint_path=path, checkpoint_every=50, max_steps=120)
+        output = examples.AddMachineWrapper().machine.resume(path)  # resumed from step 100
+        assert output == expected
+        assert wrapper.decode(output) == 800
+
+        utm = universal.UniversalMachineWrapper()
+        utm_tapes = utm.encode(examples.get_copy1_machine(), [1] * 5)
+        utm.machine.run(tapes=utm_tapes, max_steps=5000)
+        utm.machine.snapshot(path)
+        print('utm checkpoint size:', os.path.getsize(path))
+        resumed_utm = universal.UniversalMachineWrapper()
+        resumed_tapes = resumed_utm.machine.resume(path, tape_type=RunLengthTape)
+        output = resumed_utm.decode([tape.to_list() for tape in resumed_tapes])
+        assert output == [1] * 5 + [0] + [1] * 5
+        assert resumed_utm.machine.steps == 11478
+
+        emulator = multitape.MultitapeEmulator(utm.machine)
+        emulator.machine.run(emulator.encode_tapes(utm.encode(examples.get_copy1_machine(), [1])), max_steps=10000)
+        emulator.machine.snapshot(path)
+        emulator.machine.resume(path, checkpoint_every=10000)
+        output = utm.decode(emulator.decode_tape(emulator.machine.resume(path)))
+        assert output == [1, 0, 1]
+
+        for checkpoint_every in [0, -2]:
+            try:
+                machine.run(tape=tape, checkpoint_path=path, checkpoint_every=checkpoint_every)
+                assert False, "expected ValueError"
+            except ValueError:
+                pass
+
+
+def test_timetravel():
+    utm = universal.UniversalMachineWrapper()
+    utm_tapes = utm.encode(examples.get_copy1_machine(), [1] * 5)
+    recorder = RunRecorder(utm.machine, keyframe_interval=1000)
+    output = utm.decode(recorder.run(utm_tapes))
+    assert output == [1] * 5 + [0] + [1] * 5
+    assert recorder.steps == utm.machine.steps == 11478
+
+    reference = universal.UniversalMachineWrapper().machine
+    for step in [0, 1, 999, 1000, 5432, 5431, 11477, 11478, 3]:
+        config = recorder.seek(step)
+        reference.run(tapes=utm_tapes, max_steps=step)
+        assert config.step == step
+        assert (config.state, config.tapes, config.heads) == (reference.state, reference.tapes, reference.heads)
+    assert recorder.seek(11478).halt
+
+    config = recorder.seek(7001).copy()
+    reference.run(tapes=utm_tapes, max_steps=6999)
+    expected = (reference.state, reference.tapes, reference.heads)
+    for _ in range(3):
+        recorder.step_back()
+    back = recorder.step_forward()
+    assert back.step == 6999 and (back.state, back.tapes, back.heads) == expected
+    recorder.seek(9000)
+    back = recorder.seek(6999)
+    assert back.step == 6999 and (back.state, back.tapes, back.heads) == expected
+    recorder.step_forward()
+    recorder.step_forward()
+    assert recorder.seek(7001) == config
+
+    machine = examples.get_copy1_machine()
+    recorder = RunRecorder(machine, keyframe_interval=7)
+    recorder.run([1, 1, 1, 1], max_steps=40)
+    assert recorder.steps == 40
+    for step in range(40, -1, -1):
+        config = recorder.seek(step)
+        machine.run([1, 1, 1, 1], max_steps=step)
+        assert (config.state, config.tapes, config.heads) == (machine.state, [machine.tape], [machine.head])
+
+
+def test_nondeterministic():
+    # guess all binary words of length N
+    N = 12
+    rules: Any = {(index, '_'): [(index + 1, '0', +1), (index + 1, '1', +1)] for index in range(N)}
+    machine = NondeterministicTuringMachine(rules=rules, init_state=0, empty_symbol='_')
+    halted = machine.run(tape=[])
+    assert len(halted) == 2 ** N
+    assert len({''.join(config.tape.to_list()[:N]) for config in halted}) == 2 ** N
+
+    # both branches write the same and meet again => configurations are deduplicated
+    rules = {(index, None): [(index + 1, 'x', 0), (index + 1, None, 0)] for index in range(N)}
+    rules[0, None] = [(1, 'x', 0)]
+    machine = NondeterministicTuringMachine(rules=rules, init_state=0, empty_symbol='_')
+    halted = machine.run(tape=[])
+    assert len(halted) == 1
+    assert machine.visited_count == N + 1
+
+    machine = NondeterministicTuringMachine(rules=rules, init_state=0, empty_symbol='_')
+    assert machine.run(tape=[], max_steps=3) == []
+    assert len(machine.frontier) == 1
+
+    # deterministic machine as a special case
+    increment = examples.get_increment_machine()
+    rules = {key: [value] for key, value in increment.rules.items()}
+    machine = NondeterministicTuringMachine(rules=rules, init_state='right', empty_symbol='_')
+    config, = machine.run(tape=['1', '0', '1', '1'])
+    assert config.tape.to_list() == increment.run(tape=['1', '0', '1', '1'])
+
+    # beam: keep one branch per level preferring ones
+    rules = {(index, '_'): [(index + 1, '0', +1), (index + 1, '1', +1)] for index in range(N)}
+    machine = NondeterministicTuringMachine(rules=rules, init_state=0, empty_symbol='_')
+    config, = machine.run(tape=[], beam_width=1, beam_key=lambda config: config.tape[config.head - 1] != '1')
+    assert config.tape.to_list()[:N] == ['1'] * N
+
+
+def test_enumeration():
+    STATES, SYMBOLS, MAX_STEPS = 2, 2, 100
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'results.bin')
+        counts = enumeration.enumerate_machines(STATES, SYMBOLS, MAX_STEPS, path, processes=2, subtrees_per_process=4)
+        results = list(enumeration.read_results(path))
+        counts1 = enumeration.enumerate_machines(STATES, SYMBOLS, MAX_STEPS, path, processes=1)
+        results1 = list(enumeration.read_results(path))
+
+    assert counts == counts1
+    assert sum(counts.values()) == len(results) == len(results1)
+    assert sorted((r.table, r.status) for r in results) == sorted((r.table, r.status) for r in results1)
+    assert len({tuple(r.table) for r in results}) == len(results)
+
+    # busy beaver on one-sided tape with halting on undefined transition (so it does not write)
+    halted = [r for r in results if r.status == enumeration.Status.HALT]
+    assert max(r.steps for r in halted) == 5
+    assert max(r.nonempty for r in halted) == 2
+
+    for result in results:
+        machine = enumeration.to_turing_machine(result.table, SYMBOLS)
+        tape = machine.run(tape=[], max_steps=MAX_STEPS * 2)
+        if result.status == enumeration.Status.HALT:
+            assert machine.halt and machine.steps == result.steps + 1
+            assert sum(1 for symbol in tape if symbol != 0) == result.nonempty
+        elif result.status == enumeration.Status.OUT_OF_TAPE:
+            assert machine.halt and machine.steps == result.steps
+        elif result.status != enumeration.Status.LIMIT:
+            assert not machine.halt
+
+
+class _BrokenPipeline(pipelines.BinarizedPipeline):
+    # corrupts the output if the input contains '1', '1'
+    name = 'broken'
+
+    def run(self, tapes, max_steps=None):
+        result = super().run(tapes, max_steps=max_steps)
+        if any(a == b == '1' for a, b in zip(tapes[0], tapes[0][1:])):
+            result.output = [['?']]
+        return result
+
+
+def test_differential():
+    print('differential:')
+    inputs = differential.random_inputs([['0', '1']], count=200, max_length=10, seed=1)
+    report = differential.run_differential(
+        examples.get_increment_machine, inputs,
+        pipeline_types=[pipelines.PlainPipeline, pipelines.BinarizedPipeline], processes=2)
+    print(' ', report.summary().replace('\n', '\n  '))
+    assert report.cases == 200 and not report.mismatches
+    assert all(ratio > 1 for ratio in report.ratios()['binarized'])
+
+    report = differential.run_differential(examples.get_increment_machine, [], processes=1)
+    assert report.pipelines == ['plain', 'binarized', 'utm', 'onetape_utm', 'onetape_aligned_utm']
+
+    inputs = [[[]], [['0']], [['1']], [['1', '0']]]
+    pipeline_types = [pipelines.PlainPipeline, pipelines.UniversalPipeline]
+    report = differential.run_differential(examples.get_increment_machine, inputs, pipeline_types=pipeline_types, processes=2)
+    assert report.cases == 4 and not report.mismatches
+
+    factory = examples.get_abc_palyndrome_machine
+    inputs = differential.random_inputs([['a', 'b', 'c'], [], []], count=100, max_length=8, prefixes=[['*'], [], []])
+    report = differential.run_differential(factory, inputs, processes=2)
+    print(' ', report.summary().replace('\n', '\n  '))
+    assert report.cases == 100 and not report.mismatches
+
+    # mismatches are shrunk to minimal counterexamples
+    inputs = [[list('0110111')], [list('0101')], [list('10011')]]
+    report = differential.run_differential(
+        examples.get_increment_machine, inputs, pipeline_types=[pipelines.PlainPipeline, _BrokenPipeline], processes=2)
+    assert [mismatch.input for mismatch in report.mismatches] == [[list('0110111')], [list('10011')]]
+    assert all(mismatch.shrunk == [['1', '1']] for mismatch in report.mismatches)
+
+    # inputs on which the reference does not halt are skipped
+    inputs = [[[]], [['_', '_']], [['1']]]
+    pipeline_types = [pipelines.PlainPipeline, pipelines.BinarizedPipeline]
+    report = differential.run_differential(examples.get_repeat_machine, inputs, pipeline_types, max_steps=100, processes=1)
+    assert report.cases == 3 and report.skipped == 2 and not report.mismatches
+
+    # a pipeline without decode() can't be created
+    class _AbstractPipeline(pipelines.Pipeline):
+        def _build(self) -> Any:
+            return self.orig_machine
+
+        def encode(self, tapes: Any) -> Any:
+            return tapes[0]
+
+    try:
+        _AbstractPipeline(examples.get_increment_machine())
+        assert False, "expected TypeError"
+    except TypeError:
+        pass
+
+
+def test_benchmark():
+    suite = [
+        benchmark.BenchmarkCase('copy1', examples.get_copy1_machine, lambda size: [[1] * size], {
+            'plain': [2, 4],
+            'utm': [2],
+        }),
+        benchmark.BenchmarkCase('palindrome', examples.get_abc_palyndrome_machine, benchmark._get_palindrome_input, {
+            'emulator': [4],
+        }),
+    ]
+    results = benchmark.run_suite(suite, repeat=1)
+    assert [result.key for result in results] == [('copy1', 'plain', 2), ('copy1', 'plain', 4), ('copy1', 'utm', 2), ('palindrome', 'emulator', 4)]
+    plain, _, utm, emulator = results
+    assert (plain.rules, plain.states, plain.steps) == (10, 5, 16)
+    assert utm.steps > plain.steps and utm.peak_memory > 0 and utm.seconds > 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.json')
+        benchmark.save_results(path, results)
+        baseline = benchmark.load_results(path)
+    assert baseline == results
+    assert benchmark.compare(results, baseline) == []
+
+    baseline[0].steps -= 1
+    baseline[3].seconds = emulator.seconds / 2
+    regressions = benchmark.compare(results, baseline, thresholds={'steps': 0.0, 'seconds': 0.5})
+    assert [(r.key, r.metric) for r in regressions][0] == (('copy1', 'plain', 2), 'steps')
+    assert all(r.metric == 'steps' or r.current >= benchmark.MIN_SECONDS for r in regressions)
+
+
+def test_profiler():
+    fit = profiler.fit_growth([1, 2, 4, 8, 16, 32], [3 * n * n + 5 * n + 7 for n in [1, 2, 4, 8, 16, 32]])
+    assert fit.degree == 2 and abs(fit.factor - 3) < 0.2 and fit.error < 1e-9
+    assert all(abs(c - expected) < 1e-6 for c, expected in zip(fit.coefficients, [7, 5, 3]))
+
+    add = benchmark.SUITE[0]
+    profiles = profiler.profile(add.machine_factory, add.make_input, [4, 8, 16, 32],
+                                [pipelines.PlainPipeline, pipelines.BinarizedPipeline], processes=2)
+    assert [sample.size for sample in profiles['plain'].samples] == [4, 8, 16, 32]
+    assert profiles['plain'].steps_fit().degree == 2
+    assert profiles['binarized'].steps_fit().degree == 2
+    assert profiles['plain'].tape_fit().degree == 1
+    _, fit = profiler.overhead(profiles['plain'], profiles['binarized'])
+    assert fit.degree == 0
+
+    # one-tape emulation of the multitape palindrome machine is quadratic: the overhead grows linearly
+    palindrome, = [case for case in benchmark.SUITE if case.name == 'palindrome']
+    profiles = profiler.profile(palindrome.machine_factory, palindrome.make_input, [8, 16, 32, 64], processes=1)
+    print('palindrome profile:')
+    print('  ' + profiler.format_report(profiles).replace('\n', '\n  '))
+    assert profiles['multitape'].steps_fit().degree == 1
+    assert profiles['emulator'].steps_fit().degree == 2
+    assert profiles['aligned_emulator'].steps_fit().degree == 2
+    _, fit = profiler.overhead(profiles['multitape'], profiles['emulator'])
+    assert fit.degree == 1
+
+
+def _get_increments_pipeline():
+    return streaming.StreamPipeline(streaming.repeat_stages(examples.get_increment_machine, 5))
+
+
+def test_streaming():
+    # consecutive machines share the tape buffer, the input is copied once
+    pipeline = _get_increments_pipeline()
+    tape = list('1011')
+    buffers = []
+    pipeline.stages.insert(2, lambda data: buffers.append(data) or data)
+    pipeline.names.insert(2, 'spy')
+    output = pipeline.run(tape)
+    assert output is not tape and tape == list('1011')
+    assert buffers == [output] and buffers[0] is output
+    assert output[:-1] == list('0000')  # 11 + 5 = 16 overflows 4 bits
+    assert pipeline.steps > 0 and pipeline.machine_seconds > 0
+
+    wrapper = examples.AddMachineWrapper()
+    pipeline = streaming.StreamPipeline(streaming.binarized_stages(wrapper.machine))
+    for x, y in [(0, 0), (3, 5), (300, 500)]:
+        assert wrapper.decode(pipeline.run(wrapper.encode(x, y))) == x + y
+    encoder = BinEncoder(wrapper.machine)
+    tape = wrapper.encode(300, 500)
+    assert list(encoder.iter_decode_output(encoder.iter_encode_input(tape))) == tape
+    print('streaming add 300 + 500:', pipeline.steps, 'steps,', 'machine time {:.0%}'.format(
+        pipeline.machine_seconds / sum(pipeline.seconds.values())))
+
+    pipeline = streaming.StreamPipeline(streaming.universal_stages(examples.get_copy1_machine()))
+    assert pipeline.run([1, 1]) == [1, 1, 0, 1, 1]
+    pipeline = streaming.StreamPipeline(streaming.universal_stages(examples.get_increment_machine()))
+    assert pipeline.run(list('101'))[:-1] == list('110')
+
+    inputs = [list(format(x, 'b')) + ['_'] for x in range(32, 64)]
+    outputs = list(streaming.run_concurrently(_get_increments_pipeline, inputs, processes=2))
+    assert [int(''.join(output).strip('_'), base=2) for output in outputs] == [(x + 5) % 64 for x in range(32, 64)]
+
+
 if __name__ == "__main__":
     #logging.basicConfig(level=logging.DEBUG)
     test_repeat()
     test_increment()
     test_copy1()
+    test_rle_tape()
     test_add()
     test_bin_add()
     test_bin_inc()
     test_multitape()
     test_multitape_emulator()
+    test_aligned_emulator()
     test_universal()
     test_universal_on_binarized()
     test_universal_add()
     test_universal_onetape()
+    test_snapshot()
+    test_timetravel()
+    test_nondeterministic()
+    test_enumeration()
+    test_differential()
+    test_benchmark()
+    test_profiler()
+    test_streaming()
     print('ok!')
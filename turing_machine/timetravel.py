@@ -0,0 +1,159 @@
+"""
+Time-travel over recorded runs: seek to any step of a long run and step backwards.
+
+The recorder stores sparse keyframes (full configuration every K steps)
+and compact per-step deltas: for every tape the written cell's old and new symbols
+and the head move; and the new state. Seeking replays at most K deltas from the nearest keyframe.
+Memory is tuned via K: keyframes take O(tape / K) per step, deltas take several bytes per step.
+"""
+
+from array import array
+from dataclasses import dataclass
+from typing import Any
+import logging
+
+from checkpoint import SymbolTable
+from multitape import MultitapeTuringMachine
+from turing_machine import TuringMachine
+
+
+@dataclass
+class Configuration[ST, SYM]:
+    step: int
+    state: ST
+    tapes: list[list[SYM]]
+    heads: list[int]
+    halt: bool
+
+    def copy(self) -> 'Configuration[ST, SYM]':
+        return Configuration(self.step, self.state, [tape.copy() for tape in self.tapes], self.heads.copy(), self.halt)
+
+
+class RunRecorder[ST, SYM]:
+    """
+    Records a run of TuringMachine or MultitapeTuringMachine.
+
+    Usage:
+        recorder = RunRecorder(machine, keyframe_interval=1000)
+        output = recorder.run(tape)  # same arguments as machine.run()
+        config = recorder.seek(3000000)
+        config = recorder.step_back()
+    Configuration returned by seek/step_back/step_forward is updated in place by the next call, use copy() to keep it.
+    """
+
+    # move code: (delta + 1) | (tape grew << 2)
+    _GREW = 4
+
+    def __init__(self, machine: TuringMachine[ST, SYM] | MultitapeTuringMachine[ST, SYM], keyframe_interval: int = 1000) -> None:
+        if keyframe_interval < 1:
+            raise ValueError("Keyframe interval must be positive")
+        self.machine = machine
+        self.keyframe_interval = keyframe_interval
+        self._multitape = isinstance(machine, MultitapeTuringMachine)
+
+    def _get_tapes(self) -> list[Any]:
+        return self.machine.tapes if self._multitape else [self.machine.tape]
+
+    def _get_heads(self) -> list[int]:
+        return list(self.machine.heads) if self._multitape else [self.machine.head]
+
+    def _keyframe(self, step: int) -> Configuration[ST, SYM]:
+        machine = self.machine
+        tapes = [list(tape) for tape in self._get_tapes()]
+        return Configuration(step, machine.state, tapes, self._get_heads(), machine.halt)
+
+    def run(self, *args, max_steps: int | None = None, **kwargs) -> Any:
+        """Run machine with given machine.run() arguments and record the run. Returns machine output."""
+        machine = self.machine
+        machine.run(*args, max_steps=0, **kwargs)  # initialize the configuration
+
+        self.empty_symbol = machine.empty_symbol
+        self.tapes_count = len(self._get_tapes())
+        self._symbols: SymbolTable[SYM] = SymbolTable()
+        self._states: SymbolTable[ST] = SymbolTable()
+        self._old = array('I')
+        self._new = array('I')
+        self._moves = array('B')
+        self._new_states = array('I')
+        self.keyframes = [self._keyframe(0)]
+
+        symbol_code = self._symbols.add
+        step = 0
+        while not machine.halt:
+            step += 1
+            if (max_steps is not None) and (step > max_steps):
+                break
+
+            tapes = self._get_tapes()
+            heads = self._get_heads()
+            lengths = [len(tape) for tape in tapes]
+            old_symbols = [tape[head] for head, tape in zip(heads, tapes)]
+            machine._next()
+
+            for head, tape, length, old_symbol, new_head in zip(heads, tapes, lengths, old_symbols, self._get_heads()):
+                self._old.append(symbol_code(old_symbol))
+                self._new.append(symbol_code(tape[head]))
+                self._moves.append((new_head - head + 1) | (self._GREW if len(tape) > length else 0))
+            self._new_states.append(self._states.add(machine.state))
+
+            if step % self.keyframe_interval == 0:
+                self.keyframes.append(self._keyframe(step))
+
+        machine.steps = step
+        self.steps = len(self._new_states)
+        self.halt = machine.halt
+        self._cursor = self.keyframes[0].copy()
+        logging.debug('recorded %d steps, %d keyframes', self.steps, len(self.keyframes))
+        return machine.tapes if self._multitape else machine.tape
+
+    def _forward(self, config: Configuration[ST, SYM]) -> None:
+        base = config.step * self.tapes_count
+        symbols = self._symbols.values
+        for index, tape in enumerate(config.tapes):
+            head = config.heads[index]
+            tape[head] = symbols[self._new[base + index]]
+            move = self._moves[base + index]
+            if move & self._GREW:
+                tape.append(self.empty_symbol)
+            config.heads[index] = head + (move & 3) - 1
+        config.state = self._states.values[self._new_states[config.step]]
+        config.step += 1
+        config.halt = (config.step == self.steps) and self.halt
+
+    def _backward(self, config: Configuration[ST, SYM]) -> None:
+        config.step -= 1
+        base = config.step * self.tapes_count
+        symbols = self._symbols.values
+        for index, tape in enumerate(config.tapes):
+            move = self._moves[base + index]
+            if move & self._GREW:
+                tape.pop()
+            head = config.heads[index] - (move & 3) + 1
+            tape[head] = symbols[self._old[base + index]]
+            config.heads[index] = head
+        if config.step > 0:
+            config.state = self._states.values[self._new_states[config.step - 1]]
+        else:
+            config.state = self.keyframes[0].state
+        config.halt = False
+
+    def seek(self, step: int) -> Configuration[ST, SYM]:
+        """Configuration after given number of steps, O(keyframe_interval)."""
+        if not 0 <= step <= self.steps:
+            raise ValueError("Step out of recorded range: {}".format(step))
+        cursor = self._cursor
+        # moving from the current position may be cheaper than from the keyframe
+        if not (cursor.step <= step < cursor.step + self.keyframe_interval
+                or step < cursor.step <= step + self.keyframe_interval):
+            cursor = self._cursor = self.keyframes[step // self.keyframe_interval].copy()
+        while cursor.step < step:
+            self._forward(cursor)
+        while cursor.step > step:
+            self._backward(cursor)
+        return cursor
+
+    def step_back(self) -> Configuration[ST, SYM]:
+        return self.seek(self._cursor.step - 1)
+
+    def step_forward(self) -> Configuration[ST, SYM]:
+        return self.seek(self._cursor.step + 1)
@@ -7,17 +7,18 @@ There are only two "improvements":
 """
 
 from copy import deepcopy
-from collections.abc import Sequence, Hashable
+from collections.abc import Callable, Hashable, Iterable, MutableSequence, Sequence
 from typing import Literal
 import logging
 
+from checkpoint import CheckpointedRun
 from common import PrettyTape
 
 
 type DeltaType = Literal[-1, 0, 1]
 
 
-class TuringMachine[ST: Hashable, SYM: Hashable]:
+class TuringMachine[ST: Hashable, SYM: Hashable](CheckpointedRun[SYM]):
     """
     Classical Turing machine.
     ST - States type
@@ -33,6 +34,8 @@ class TuringMachine[ST: Hashable, SYM: Hashable]:
 
     type RulesType[ST_, SYM_] = dict[tuple[ST_, SYM_ | None] | None, tuple[ST_, SYM_ | None, DeltaType]]
 
+    tapes_count = 1
+
     def __init__(self,
             rules: RulesType[ST, SYM],  # machine halts iff rules are not defined
             init_state: ST,
@@ -45,30 +48,38 @@ class TuringMachine[ST: Hashable, SYM: Hashable]:
     def run(self,
             tape: list[SYM],  # initial symbols on the tape
             head: int = 0,
-            max_steps: int | None = None
-        ) -> list[SYM]:
-        """Run machine for given number of steps or until it halts. Returns tape."""
+            max_steps: int | None = None,
+            tape_type: Callable[[Iterable[SYM]], MutableSequence[SYM]] = list,
+            checkpoint_path: str | None = None,
+            checkpoint_every: int | None = None,
+            in_place: bool = False,
+        ) -> MutableSequence[SYM]:
+        """
+        Run machine for given number of steps or until it halts. Returns tape.
+        tape_type - tape representation used during the run, e.g. tapes.RunLengthTape
+        checkpoint_path, checkpoint_every - save snapshot to the file every given number of steps
+        in_place - run on the given tape object without copying (tape_type is ignored)
+        """
 
         self.halt = False
         self.state = self.init_state
-        self.tape = tape.copy()
+        self.tape = tape if in_place else tape_type(tape)
         # maintain invariant: tape[head] is defined
         if head < 0:
             raise ValueError("Head must be non-negative!")
         if head >= len(tape):
             self.tape.extend([self.empty_symbol] * (head - len(tape) + 1))
         self.head = head
+        return self._run_loop(0, max_steps, checkpoint_path, checkpoint_every)
+
+    def _get_tapes(self) -> tuple[list[MutableSequence[SYM]], list[int]]:
+        return [self.tape], [self.head]
 
-        step = 0
-        while not self.halt:
-            step += 1
-            if (max_steps is not None) and (step > max_steps):
-                break
-            logging.debug('=======')
-            logging.debug('step: %d', step)
-            self._next()
+    def _set_tapes(self, tapes: list[MutableSequence[SYM]], heads: list[int]) -> None:
+        self.tape, = tapes
+        self.head, = heads
 
-        self.steps = step
+    def _result(self) -> MutableSequence[SYM]:
         # maybe cleanup trailing empty symbols
         return self.tape
 
@@ -1,3 +1,4 @@
+from collections.abc import Iterable, Iterator
 from enum import Enum
 import itertools
 import logging
@@ -75,8 +76,17 @@ class UniversalMachineWrapper:
 
     @classmethod
     def encode[ST](cls, machine: TuringMachine[ST, Bits], tape: list[Bits]) -> list[list[Alphabet]]:
+        return cls.encode_with_rules(cls.encode_rules(machine), tape)
+
+    @classmethod
+    def encode_rules[ST](cls, machine: TuringMachine[ST, Bits]) -> list[Alphabet]:
+        """Rules tape, may be encoded once for many inputs, see encode_with_rules."""
+        return ['>'] + cls._encode_tm(machine)
+
+    @classmethod
+    def encode_with_rules(cls, rules_tape: list[Alphabet], tape: Iterable[Bits]) -> list[list[Alphabet]]:
         return [
-            ['>'] + cls._encode_tm(machine),
+            rules_tape.copy(),
             ['>'] + ['0'],  # TM init state
             ['>'] + cls._encode_input(tape),
         ]
@@ -128,7 +138,7 @@ class UniversalMachineWrapper:
         return tape
 
     @staticmethod
-    def _encode_input(tape: list[Bits]) -> list[Alphabet]:
+    def _encode_input(tape: Iterable[Bits]) -> list[Alphabet]:
         return [str(bit) for bit in tape]
 
     def _switch(self, state, new_state, symbol=None, new_symbol=(None, None, None), delta=(0, 0, 0)):
@@ -259,11 +269,17 @@ class UniversalMachineWrapper:
         self._switch(S.RETURN_1, exit, symbol=('>', '>', None), delta=(+1, +1, 0))
         self._switch(S.RETURN_1, S.RETURN_1, delta=(0, -1, 0))
 
+    @classmethod
+    def decode(cls, tapes: list[list[Alphabet]]) -> list[Bits]:
+        return list(cls.iter_decode(tapes))
+
     @staticmethod
-    def decode(tapes: list[list[Alphabet]]) -> list[Bits]:
-        output = tapes[2].copy()
-        output.pop(0)  # remove '>'
-        while len(output) > 0 and output[-1] == '_':
-            # remove trailing UTM empty symbols
-            output.pop()
-        return [int(x) for x in output]
+    def iter_decode(tapes: list[list[Alphabet]]) -> Iterator[Bits]:
+        """Streaming version of decode: reads the emulated tape without copying."""
+        tape = tapes[2]
+        end = len(tape)
+        while end > 1 and tape[end - 1] == '_':
+            # skip trailing UTM empty symbols
+            end -= 1
+        for index in range(1, end):  # skip '>'
+            yield int(tape[index])  # type: ignore